@@ -2,6 +2,7 @@
 DIR_DKA = 'T40_dka'
 DIR_DKB = 'T40_dkb'
 SUBSYSTEMS = [ 'flight', 'propulsion', 'spraying' ]
+DIR_PROFILES = 'dk_profiles'   # Timing reports and cProfile output of the DK build
 
 # Agent Prompts
 DIR_PROMPTS = 'agent_prompts'
@@ -10,5 +11,11 @@ PROMPTS     = [ 'v2_intro.md', 'v2_read_errors.md' ]
 # Agent Evaluator
 DIR_S1_INPUT  = '/home/luis/errorDS/DAL/t40_t50/prop/'
 DIR_S1_OUTPUT = 'agent_results/pixtral-12b-2409/'
+DIR_S1_CACHE  = 'agent_cache/pixtral-12b-2409/'
 FORMAT_IMG    = '.jpg'
 FORMAT_DATA   = '.json'
+
+# Agent Model (Stage 1) and pricing in USD per million tokens
+MODEL_S1           = 'pixtral-12b-2409'
+PRICE_S1_INPUT_MT  = 0.15
+PRICE_S1_OUTPUT_MT = 0.15
@@ -7,16 +7,29 @@ import tkinter as tk
 from tkinter import ttk
 
 import os
+import queue
+import threading
 from abc_project_vars import DIR_S1_INPUT
 from abc_project_vars import DIR_S1_OUTPUT
 from abc_project_vars import FORMAT_IMG
-from PIL import Image, ImageTk
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from PIL import ImageTk
 from agent_read_errors import read_errors
 from agent_read_errors import write_errors_summary
 from utilities_io import ensure_dir
 from utilities_io import exists_file
 from utilities_io import load_json_file
 from utilities_io import save_to_json_file
+from utilities_images import export_rotated_image
+from utilities_images import load_image_for_display
+from utilities_images import rotate_to_fit
+from utilities_ocr_store import OcrStore
+from utilities_ocr_store import confirmed_duplicates
+from utilities_phash import CLUSTERS_FILE
+from utilities_phash import cluster_members
+from utilities_phash import load_clusters
 
 class EvaluatorAppS1 :
     
@@ -62,6 +75,17 @@ class EvaluatorAppS1 :
                                      wrap = tk.WORD )
         self.message_text.grid( row = 5, column = 3, rowspan = 5, columnspan = 3, 
                                 padx = 5, pady = 5, sticky = "nsew" )
+        
+        # Evaluation queue list: Parameters
+        self.QUEUE_HEIGHT = 5
+        # Evaluation queue list: Object
+        self.queue_list = tk.Listbox( self.root,
+                                      width = self.TEXT_WIDTH,
+                                      height = self.QUEUE_HEIGHT,
+                                      bg = self.TEXT_BG_COLOR,
+                                      fg = self.TEXT_FG_COLOR )
+        self.queue_list.grid( row = 4, column = 3, columnspan = 3,
+                              padx = 5, pady = 5, sticky = "nsew" )
 
         # Buttons: Definitions
         self.buttons = {}
@@ -115,6 +139,36 @@ class EvaluatorAppS1 :
         self.root.bind( "<KP_2>", lambda e: self.image_delete_json())
         self.root.bind( "<KP_3>", lambda e: self.image_rotate_right())
         
+        # Prefetching: Parameters
+        self.PREFETCH_RADIUS  = 3     # Images prefetched before and after the current one
+        self.PREFETCH_WORKERS = 2
+        self.CACHE_SIZE       = 2 * self.PREFETCH_RADIUS + 5
+        # Prefetching: Worker threads, LRU cache of prepared images and pending futures
+        self.prefetch_executor = ThreadPoolExecutor( max_workers = self.PREFETCH_WORKERS)
+        self.prefetch_cache    = OrderedDict() # index : dict_prepared_image
+        self.prefetch_futures  = {}            # index : future_prepared_image
+        self.prefetch_lock     = threading.RLock()
+        
+        # OCR results of the error screen selector (if any), shown for unevaluated images
+        self.ocr_store = OcrStore.open_if_exists()
+        
+        # Near-duplicate clusters of the input images (see cluster_duplicates.py): the
+        # saved evaluation of a near-duplicate is reused instead of calling the LLM again,
+        # if the OCR results store confirms both show the same screen
+        clusters = cluster_members(load_clusters(os.path.join( DIR_S1_INPUT, CLUSTERS_FILE)))
+        self.image_duplicates = { filename : members for members in clusters.values()
+                                                     for filename in members }
+        
+        # Evaluations: Parameters
+        self.EVAL_WORKERS = 4
+        self.EVAL_POLL_MS = 100
+        # Evaluations: Worker threads, results queue, status and unsaved results
+        # Statuses: PENDING, COMPLETE, FAILED or SAVED
+        self.eval_executor = ThreadPoolExecutor( max_workers = self.EVAL_WORKERS)
+        self.eval_queue    = queue.Queue()   # ( index, errors_obj ) of finished calls
+        self.eval_status   = OrderedDict()   # index : status
+        self.eval_results  = {}              # index : errors_obj (not saved yet)
+        
         # Initialize list of image filenames
         self.image_filenames = []
         for filename in sorted(os.listdir(DIR_S1_INPUT)) :
@@ -129,25 +183,12 @@ class EvaluatorAppS1 :
         # Ensure output directory exists
         ensure_dir(DIR_S1_OUTPUT)
         
+        # Start polling for finished evaluations
+        self.root.after( self.EVAL_POLL_MS, self.eval_poll)
+        
         return
     
-    def image_display( self, image_path : str | None = None) -> None :
-        # Initialize image object
-        if image_path :
-            self.image = Image.open(image_path)
-        # Calculate resizing dimensions
-        self.image_ratio  = self.image.width / self.image.height
-        # Case 1: Image is wider relative to height
-        if self.image_ratio > self.CANVAS_RATIO :
-            new_width  = self.CANVAS_WIDTH
-            new_height = int( self.CANVAS_WIDTH / self.image_ratio )
-        # Case 2: Image is taller relative to width
-        else :
-            new_height = self.CANVAS_HEIGHT
-            new_width  = int( self.CANVAS_HEIGHT * self.image_ratio )
-        # Resize image maintaining aspect ratio
-        self.image_resized = self.image.resize( ( new_width, new_height),
-                                                Image.Resampling.LANCZOS )
+    def image_display(self) -> None :
         # Center the image on canvas
         self.image_tk_pi = ImageTk.PhotoImage(self.image_resized)
         self.canvas.delete("all")
@@ -157,35 +198,90 @@ class EvaluatorAppS1 :
         # The grand finale
         return
     
-    def image_evaluate_current(self) -> None :
-        # Clear text box and show status
-        self.textbox_print( f"Calling LLM API. Please wait...\n", clear = True)
-        self.root.update()
-        
-        # Call read_errors function
-        self.image_errors_obj = None
-        try:
-            self.image_errors_obj = read_errors(self.image_current_path)
-        except Exception as e:
-            self.textbox_print( f"Exception thrown!\n", clear = True)
-            self.textbox_print( f"Check console for exception info.\n")
-            self.update_button_states()
-            self.root.update()
-            return
-        
-        self.textbox_clear()
-        if self.image_errors_obj :
+    def eval_poll(self) -> None :
+        # Collect finished evaluations (runs in the Tk thread)
+        updated = False
+        while True :
+            try :
+                index, errors_obj = self.eval_queue.get_nowait()
+            except queue.Empty :
+                break
+            updated = True
+            if errors_obj :
+                self.eval_status[index]  = 'COMPLETE'
+                self.eval_results[index] = errors_obj
+            else :
+                self.eval_status[index] = 'FAILED'
+            # Show results right away if the image is on display
+            if index == self.image_current_index :
+                self.eval_show_current()
+        if updated :
+            self.queue_list_update()
+        self.root.after( self.EVAL_POLL_MS, self.eval_poll)
+        return
+    
+    def eval_run( self, index : int, image_path : str, rotation : int = 0) -> None :
+        # Call read_errors function (runs in worker threads)
+        errors_obj = None
+        try :
+            # Reuse the evaluation of a near-duplicate (unless rotated to be read again)
+            if not rotation :
+                errors_obj = self.eval_reuse(index)
+            if errors_obj is None :
+                # Rotate the full resolution image only now, if the user rotated it
+                image_path = export_rotated_image( image_path, rotation)
+                errors_obj = read_errors(image_path)
+        except Exception as e :
+            print(f"Exception thrown while evaluating {image_path}: {e}")
+        self.eval_queue.put( ( index, errors_obj) )
+        return
+    
+    def eval_reuse( self, index : int) -> dict | None :
+        # Saved evaluation of a confirmed near-duplicate of an image (None if there is none)
+        image_name = self.image_filenames[index]
+        if self.ocr_store is None or image_name not in self.image_duplicates :
+            return None
+        record = self.ocr_store.lookup(os.path.join( DIR_S1_INPUT, image_name))
+        for filename in self.image_duplicates[image_name] :
+            json_path = os.path.join( DIR_S1_OUTPUT, filename.replace( FORMAT_IMG, '.json'))
+            if filename == image_name or not exists_file(json_path) :
+                continue
+            other = self.ocr_store.lookup(os.path.join( DIR_S1_INPUT, filename))
+            if confirmed_duplicates( record, other) :
+                print(f"Reusing the evaluation of near-duplicate {filename} for {image_name}")
+                return load_json_file(json_path)
+        return None
+    
+    def eval_show_current(self) -> None :
+        # Show the evaluation state of the current image in the textbox
+        status = self.eval_status.get(self.image_current_index)
+        if status == 'PENDING' :
+            self.textbox_print( f"Calling LLM API. Evaluation pending...\n", clear = True)
+        elif status == 'COMPLETE' :
+            self.image_errors_obj     = self.eval_results[self.image_current_index]
             self.image_errors_summary = write_errors_summary(self.image_errors_obj)
-            self.textbox_print(f"Evaluation successful.\n")
+            self.textbox_print( f"Evaluation successful.\n", clear = True)
             self.textbox_print(f"RESULTS:\n")
             self.textbox_print(self.image_errors_summary)
-        else :
-            self.textbox_print(f"Evaluation failure.\n")
+        elif status == 'FAILED' :
+            self.textbox_print( f"Evaluation failure.\n", clear = True)
             self.textbox_print(f"REASON: API returned None.\n")
-        
+            self.textbox_print(f"Check console for exception info.\n")
         self.update_button_states()
-        self.root.update()
-        
+        return
+    
+    def image_evaluate_current(self) -> None :
+        # Dispatch the evaluation to the worker threads (unless already pending)
+        index = self.image_current_index
+        if self.eval_status.get(index) == 'PENDING' :
+            return
+        self.eval_status[index] = 'PENDING'
+        self.eval_status.move_to_end(index)
+        self.eval_results.pop( index, None)
+        self.eval_executor.submit( self.eval_run, index, self.image_current_path,
+                                   self.image_rotation)
+        self.eval_show_current()
+        self.queue_list_update()
         return
     
     def image_load(self) -> None :
@@ -193,15 +289,24 @@ class EvaluatorAppS1 :
             # Get image name and path
             self.image_current_name = self.image_filenames[self.image_current_index]
             self.image_current_path = os.path.join( DIR_S1_INPUT, self.image_current_name)
-            # Get corresponding image JSON file and path and check if it exists
+            # Get corresponding image JSON file and path
             self.image_json_file   = self.image_current_name.replace( FORMAT_IMG, '.json')
             self.image_json_path   = os.path.join( DIR_S1_OUTPUT, self.image_json_file)
-            self.image_json_exists = exists_file(self.image_json_path)
             
-            # Load existing JSON file if it exists
+            # Get prepared image and JSON data (prefetched if possible)
+            prepared = self.prefetch_get(self.image_current_index)
+            self.image_base        = prepared['image_resized']
+            self.image_rotation    = 0
+            self.image_resized     = self.image_base
+            self.image_json_exists = prepared['json_exists']
+            self.image_ocr         = prepared['ocr']
+            
+            # Load existing JSON data if it exists
             if self.image_json_exists :
                 try :
-                    self.image_errors_obj     = load_json_file(self.image_json_path)
+                    if prepared['json_error'] :
+                        raise prepared['json_error']
+                    self.image_errors_obj     = prepared['errors_obj']
                     self.image_errors_summary = write_errors_summary(self.image_errors_obj)
                 except Exception as e :
                     self.image_errors_obj     = None
@@ -217,16 +322,28 @@ class EvaluatorAppS1 :
             self.textbox_clear()
             
             # Display image and update button states and window
-            self.image_display(self.image_current_path)
+            self.image_display()
             
             # If we have existing results, display them in the textbox
             if self.image_errors_summary:
                 self.textbox_print(f"EXISTING RESULTS:\n")
                 self.textbox_print(self.image_errors_summary)
+            # Otherwise display its stored OCR text (if any)
+            elif self.image_ocr and self.image_ocr['status'] in ( 'ocr', 'duplicate') \
+                                and self.image_ocr['text'] :
+                self.textbox_print(f"STORED OCR TEXT (rotation {self.image_ocr['rotation']}):\n")
+                self.textbox_print(self.image_ocr['text'])
+            
+            # If the image has an unsaved or pending evaluation, display it instead
+            if self.image_current_index in self.eval_status :
+                self.eval_show_current()
             
             # Update button states and window
             self.update_button_states()
             self.root.update()
+            
+            # Prefetch neighboring images
+            self.prefetch_schedule(self.image_current_index)
         
         return
     
@@ -253,7 +370,10 @@ class EvaluatorAppS1 :
         return
     
     def image_rotate( self, angle : int) -> None :
-        self.image = self.image.rotate( angle, expand = True)
+        # Rotate the display buffer only (the full image is rotated upon evaluation)
+        self.image_rotation = ( self.image_rotation + angle ) % 360
+        self.image_resized  = rotate_to_fit( self.image_base, self.image_rotation,
+                                             ( self.CANVAS_WIDTH, self.CANVAS_HEIGHT ) )
         self.image_display()
         return
     
@@ -268,6 +388,11 @@ class EvaluatorAppS1 :
     def image_save_errors_json(self) -> None :
         if self.image_errors_obj :
             save_to_json_file( self.image_errors_obj, self.image_json_path)
+            self.prefetch_invalidate(self.image_current_index)
+            if self.image_current_index in self.eval_results :
+                self.eval_results.pop(self.image_current_index)
+                self.eval_status[self.image_current_index] = 'SAVED'
+                self.queue_list_update()
             self.textbox_print(f"RESULTS SAVED TO: {self.image_json_path}\n")
             self.image_json_exists = True
             self.update_button_states()
@@ -278,6 +403,7 @@ class EvaluatorAppS1 :
         if self.image_json_exists and exists_file(self.image_json_path):
             try:
                 os.remove(self.image_json_path)
+                self.prefetch_invalidate(self.image_current_index)
                 self.image_json_exists = False
                 self.image_errors_obj = None
                 self.image_errors_summary = None
@@ -289,6 +415,92 @@ class EvaluatorAppS1 :
                 self.root.update()
         return
     
+    def prefetch_get( self, index : int) -> dict :
+        # Take the prepared image from the cache or wait for its pending future
+        with self.prefetch_lock :
+            prepared = self.prefetch_cache.get(index)
+            if prepared :
+                self.prefetch_cache.move_to_end(index)
+                return prepared
+            future = self.prefetch_futures.get(index)
+        if future and not future.exception() :
+            prepared = future.result()
+        else :
+            prepared = self.prefetch_prepare(index)
+            self.prefetch_store( index, prepared)
+        return prepared
+    
+    def prefetch_invalidate( self, index : int) -> None :
+        # Drop a cached image (e.g. after its JSON file changed)
+        with self.prefetch_lock :
+            self.prefetch_cache.pop( index, None)
+        return
+    
+    def prefetch_prepare( self, index : int) -> dict :
+        # Decode and resize image and load its JSON file (runs in worker threads)
+        image_name = self.image_filenames[index]
+        image_path = os.path.join( DIR_S1_INPUT, image_name)
+        json_path  = os.path.join( DIR_S1_OUTPUT, image_name.replace( FORMAT_IMG, '.json'))
+        prepared   = { 'image_resized' : None,
+                       'json_exists'   : exists_file(json_path),
+                       'errors_obj'    : None,
+                       'json_error'    : None,
+                       'ocr'           : None }
+        prepared['image_resized'] = load_image_for_display( image_path,
+                                                            ( self.CANVAS_WIDTH,
+                                                              self.CANVAS_HEIGHT ) )
+        if prepared['json_exists'] :
+            try :
+                prepared['errors_obj'] = load_json_file(json_path)
+            except Exception as e :
+                prepared['json_error'] = e
+        elif self.ocr_store is not None :
+            prepared['ocr'] = self.ocr_store.lookup(image_path)
+        return prepared
+    
+    def prefetch_schedule( self, index : int) -> None :
+        # Submit the neighbors of an image (nearest first) to the worker threads
+        neighbors = []
+        for offset in range( 1, self.PREFETCH_RADIUS + 1) :
+            neighbors += [ index + offset, index - offset ]
+        with self.prefetch_lock :
+            for neighbor in neighbors :
+                if not 0 <= neighbor < self.image_num :
+                    continue
+                if neighbor in self.prefetch_cache or neighbor in self.prefetch_futures :
+                    continue
+                future = self.prefetch_executor.submit( self.prefetch_prepare, neighbor)
+                callback = lambda f, i = neighbor : self.prefetch_done( i, f)
+                future.add_done_callback(callback)
+                self.prefetch_futures[neighbor] = future
+        return
+    
+    def prefetch_done( self, index : int, future : Future) -> None :
+        # Move a finished future into the cache
+        with self.prefetch_lock :
+            self.prefetch_futures.pop( index, None)
+        if future.exception() :
+            print(f"Error prefetching {self.image_filenames[index]}: {future.exception()}")
+            return
+        self.prefetch_store( index, future.result())
+        return
+    
+    def prefetch_store( self, index : int, prepared : dict) -> None :
+        # Insert into the LRU cache, evicting the least recently used images
+        with self.prefetch_lock :
+            self.prefetch_cache[index] = prepared
+            self.prefetch_cache.move_to_end(index)
+            while len(self.prefetch_cache) > self.CACHE_SIZE :
+                self.prefetch_cache.popitem( last = False)
+        return
+    
+    def queue_list_update(self) -> None :
+        # List evaluated images (most recent first) with their status
+        self.queue_list.delete( 0, tk.END)
+        for index, status in reversed(self.eval_status.items()) :
+            self.queue_list.insert( tk.END, f"{status:<10}{self.image_filenames[index]}")
+        return
+    
     def textbox_print( self, text : str, clear : bool = False) -> None :
         if clear :
             self.textbox_clear()
@@ -328,3 +540,5 @@ if __name__ == "__main__":
     
     app = EvaluatorAppS1()
     app.root.mainloop()
+    app.prefetch_executor.shutdown( wait = False, cancel_futures = True)
+    app.eval_executor.shutdown( wait = False, cancel_futures = True)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Headless Batch Agent Evaluator: Stage 1
+"""
+
+import argparse
+import csv
+import os
+import re
+from abc_project_vars import DIR_S1_CACHE
+from abc_project_vars import DIR_S1_INPUT
+from abc_project_vars import DIR_S1_OUTPUT
+from abc_project_vars import FORMAT_DATA
+from abc_project_vars import FORMAT_IMG
+from abc_project_vars import MODEL_S1
+from abc_project_vars import PRICE_S1_INPUT_MT
+from abc_project_vars import PRICE_S1_OUTPUT_MT
+from agent_read_errors import load_prompt
+from agent_read_errors import read_errors_with_usage
+from collections import Counter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from hashlib import sha256
+from utilities_io import ensure_dir
+from utilities_io import exists_file
+from utilities_io import load_json_file
+from utilities_io import save_to_json_file
+from utilities_printing import print_ind
+from utilities_printing import print_sep
+
+def load_labels( csv_paths : list[str]) -> OrderedDict :
+    """
+    Load label CSV files into a dict mapping image filenames to their list of labels
+    """
+    result = OrderedDict()
+    for csv_path in csv_paths :
+        with open( csv_path, 'r', newline = '', encoding = 'utf-8') as f :
+            for row in csv.reader(f) :
+                if not row :
+                    continue
+                result[row[0]] = [ label.strip() for label in row[2:] if label.strip() ]
+    return result
+
+def load_ground_truth( filename : str, labels : list, dir_truth : str) -> list | None :
+    """
+    Get the ground truth messages of an image.
+    Reviewed Stage 1 results take precedence. Images without any label (e.g. rows of
+    the 'empty' label files) are known to show no messages. Otherwise returns None.
+    """
+    truth_path = os.path.join( dir_truth, os.path.splitext(filename)[0] + FORMAT_DATA)
+    if exists_file(truth_path) :
+        return list( load_json_file(truth_path).get( 'data', []) )
+    if not labels :
+        return []
+    return None
+
+def normalize_message( message : str) -> str :
+    """
+    Normalize a message for comparison: lowercase, collapsed whitespace, no final dot
+    """
+    return re.sub( r'\s+', ' ', str(message)).strip().rstrip('.').lower()
+
+def compare_messages( predicted : list, truth : list) -> tuple[ int, int, int] :
+    """
+    Compare predicted and ground truth messages as multisets of normalized strings.
+    Returns the number of true positives, false positives and false negatives.
+    """
+    pred_counter  = Counter( normalize_message(m) for m in predicted )
+    truth_counter = Counter( normalize_message(m) for m in truth )
+    true_pos      = sum( ( pred_counter & truth_counter ).values() )
+    false_pos     = sum(pred_counter.values()) - true_pos
+    false_neg     = sum(truth_counter.values()) - true_pos
+    return true_pos, false_pos, false_neg
+
+def percentile( values : list[float], q : float) -> float :
+    """
+    Percentile with linear interpolation between closest ranks
+    """
+    if not values :
+        return 0.0
+    values = sorted(values)
+    pos    = ( len(values) - 1 ) * q / 100.0
+    lower  = int(pos)
+    upper  = min( lower + 1, len(values) - 1)
+    return values[lower] + ( values[upper] - values[lower] ) * ( pos - lower )
+
+def compute_cost( usage : dict) -> float :
+    """
+    Cost in USD of one API call
+    """
+    return ( usage.get( 'prompt_tokens', 0) * PRICE_S1_INPUT_MT
+           + usage.get( 'completion_tokens', 0) * PRICE_S1_OUTPUT_MT ) / 1e6
+
+def evaluate_image( image_path : str, prompt : str, dir_cache : str) -> dict :
+    """
+    Run the reader on one image. Results are cached by image content, model and prompt
+    so that re-running the benchmark only calls the API for new images or prompts.
+    """
+    hasher = sha256()
+    with open( image_path, 'rb') as f :
+        hasher.update(f.read())
+    hasher.update(MODEL_S1.encode('utf-8'))
+    hasher.update(prompt.encode('utf-8'))
+    cache_path = os.path.join( dir_cache, hasher.hexdigest() + FORMAT_DATA)
+
+    if exists_file(cache_path) :
+        record = load_json_file(cache_path)
+        record['cached'] = True
+        return record
+
+    errors_obj, usage = read_errors_with_usage(image_path)
+    record = { 'errors' : errors_obj, 'usage' : usage, 'cached' : False }
+    if errors_obj is not None :
+        save_to_json_file( record, cache_path)
+    return record
+
+def evaluate_batch( filenames : list[str],
+                    labels : OrderedDict,
+                    dir_images : str,
+                    dir_truth : str,
+                    dir_cache : str,
+                    num_workers : int) -> list[dict] :
+    """
+    Evaluate all images concurrently and score them against the ground truth
+    """
+    ensure_dir(dir_cache)
+    prompt  = load_prompt()
+    results = []
+    with ThreadPoolExecutor( max_workers = num_workers) as executor :
+        futures = {}
+        for filename in filenames :
+            image_path = os.path.join( dir_images, filename)
+            future     = executor.submit( evaluate_image, image_path, prompt, dir_cache)
+            futures[future] = filename
+        for i, future in enumerate( as_completed(futures), 1) :
+            filename = futures[future]
+            record   = future.result()
+            record['file'] = filename
+            errors_obj     = record['errors']
+            predicted      = list(errors_obj.get( 'data', [])) if errors_obj else []
+            truth          = load_ground_truth( filename, labels[filename], dir_truth)
+            record['predicted'] = predicted
+            record['truth']     = truth
+            if truth is not None and errors_obj is not None :
+                tp, fp, fn = compare_messages( predicted, truth)
+                record['tp'], record['fp'], record['fn'] = tp, fp, fn
+            results.append(record)
+            status = 'cached' if record['cached'] else f"{record['usage']['latency']:.1f}s"
+            print_ind( f'[{i}/{len(filenames)}] {filename} ({status})', 1)
+    results.sort( key = lambda r : r['file'])
+    return results
+
+def compute_metrics( results : list[dict]) -> OrderedDict :
+    """
+    Aggregate precision, recall, latency percentiles and cost over the results.
+    Latency and cost are those of the API calls made by this run: results served from
+    the cache are left out (the cost of their original calls is reported apart).
+    """
+    scored    = [ r for r in results if 'tp' in r ]
+    true_pos  = sum( r['tp'] for r in scored )
+    false_pos = sum( r['fp'] for r in scored )
+    false_neg = sum( r['fn'] for r in scored )
+    precision = true_pos / ( true_pos + false_pos ) if ( true_pos + false_pos ) else 0.0
+    recall    = true_pos / ( true_pos + false_neg ) if ( true_pos + false_neg ) else 0.0
+    f1_score  = 0.0
+    if precision + recall :
+        f1_score = 2 * precision * recall / ( precision + recall )
+    live      = [ r for r in results if not r['cached'] ]
+    latencies = [ r['usage']['latency'] for r in live if r['errors'] is not None ]
+    costs     = [ compute_cost(r['usage']) for r in live ]
+
+    metrics = OrderedDict()
+    metrics['num_images']         = len(results)
+    metrics['num_failed']         = sum( 1 for r in results if r['errors'] is None )
+    metrics['num_cached']         = len(results) - len(live)
+    metrics['num_live']           = len(live)
+    metrics['num_scored']         = len(scored)
+    metrics['num_exact']          = sum( 1 for r in scored if r['fp'] == r['fn'] == 0 )
+    metrics['precision']          = precision
+    metrics['recall']             = recall
+    metrics['f1_score']           = f1_score
+    metrics['latency_p50']        = percentile( latencies, 50)
+    metrics['latency_p90']        = percentile( latencies, 90)
+    metrics['latency_p99']        = percentile( latencies, 99)
+    metrics['cost_per_image']     = sum(costs) / len(costs) if costs else 0.0
+    metrics['cost_total']         = sum(costs)
+    metrics['cost_cached']        = sum( compute_cost(r['usage'])
+                                         for r in results if r['cached'] )
+    return metrics
+
+def parse_arguments() -> argparse.Namespace :
+    parser = argparse.ArgumentParser( description = 'Batch Agent Evaluator: Stage 1')
+    parser.add_argument( '-csv', '--labels', nargs = '+', required = True,
+                         help = 'Label CSV files listing the images to evaluate')
+    parser.add_argument( '-img', '--image_dir', default = DIR_S1_INPUT,
+                         help = 'Directory containing the images')
+    parser.add_argument( '-gt', '--truth_dir', default = DIR_S1_OUTPUT,
+                         help = 'Directory with reviewed Stage 1 results (ground truth)')
+    parser.add_argument( '-c', '--cache_dir', default = DIR_S1_CACHE,
+                         help = 'Directory for cached API results')
+    parser.add_argument( '-w', '--workers', type = int, default = 8,
+                         help = 'Number of concurrent API calls')
+    parser.add_argument( '-n', '--limit', type = int, default = 0,
+                         help = 'Evaluate at most this many images (0 = all)')
+    parser.add_argument( '-o', '--report', default = '',
+                         help = 'Path of JSON report with per-image results')
+    return parser.parse_args()
+
+if __name__ == "__main__" :
+
+    args   = parse_arguments()
+    labels = load_labels(args.labels)
+
+    filenames = [ f for f in labels
+                  if f.lower().endswith(FORMAT_IMG)
+                  and exists_file(os.path.join( args.image_dir, f)) ]
+    if args.limit > 0 :
+        filenames = filenames[:args.limit]
+
+    print_ind(f'Evaluating {len(filenames)} images from: {args.image_dir}')
+    results = evaluate_batch( filenames, labels, args.image_dir, args.truth_dir,
+                              args.cache_dir, args.workers)
+    metrics = compute_metrics(results)
+
+    print_sep()
+    print_ind(f'Model: {MODEL_S1}')
+    print_sep()
+    for key, value in metrics.items() :
+        value_str = f'{value:.4f}' if isinstance( value, float) else f'{value}'
+        print(f'{key:<30}{value_str:>12}')
+    print_sep()
+
+    if args.report :
+        save_to_json_file( { 'metrics' : metrics, 'results' : results }, args.report)
+        print_ind(f'Saved report to: {args.report}')
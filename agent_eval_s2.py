@@ -7,15 +7,14 @@ import tkinter as tk
 from tkinter import ttk
 
 import os
-from abc_project_vars import DIR_DKB
 from abc_project_vars import DIR_S1_OUTPUT
 from abc_project_vars import FORMAT_DATA
 from agent_read_errors import write_errors_summary
-from thefuzz import process
-from thefuzz.fuzz import token_set_ratio
+from dkb_matcher import NAME_FIELDS
+from dkb_matcher import DomainKnowledgeMatcher
+from dkb_retriever import DomainKnowledgeRetriever
 from utilities_printing import print_recursively
 from utilities_io import load_json_file
-from utilities_io import load_json_files_starting_with
 
 class EvaluatorAppS2 :
     
@@ -90,8 +89,10 @@ class EvaluatorAppS2 :
         self.root.bind( "<Shift-Left>",  lambda e: self.error_load_prev())
         self.root.bind( "<Shift-Right>", lambda e: self.error_load_next())
         
-        # Load errors database
-        self.errors_db = load_json_files_starting_with( DIR_DKB, 'errors_')
+        # Load errors database and build its match index
+        retriever      = DomainKnowledgeRetriever()
+        self.errors_db = retriever.data['messages']
+        self.matcher   = DomainKnowledgeMatcher( self.errors_db, retriever.data['synonyms'])
         
         # Initialize list of data filenames
         self.data_filenames = []
@@ -138,26 +139,18 @@ class EvaluatorAppS2 :
         return
     
     def edb_get_list( self, language : str) -> list :
-        result = []
-        match language :
-            case 'English' :
-                for inner_dict in self.errors_db.values() :
-                    result.append(inner_dict['name'])
-            case 'Spanish' :
-                for inner_dict in self.errors_db.values() :
-                    result.append(inner_dict['name_spanish'])
-            case _ :
-                raise ValueError( f"Invalid language: {language}")
-        return result
+        return self.matcher.get_names(language)
     
     def error_eval_fuzz_tsr(self) -> None :
-        error_list = self.edb_get_list('Spanish')
-        error_matches = process.extract( self.error_name,
-                                         error_list,
-                                         scorer = token_set_ratio )
+        # Restrict matches to the language of the data file (if known)
+        language = self.data_obj.get( 'metadata', {}).get('language')
+        if language not in NAME_FIELDS :
+            language = None
+        error_matches = self.matcher.match( self.error_name, 5, language)
         self.textbox_print( 'B', 'TOP MATCHES:')
-        for error, score in error_matches :
+        for error_key, error, score in error_matches :
             self.textbox_print( 'B', f'Error: {error}')
+            self.textbox_print( 'B', f'\tKey: {error_key}')
             self.textbox_print( 'B', f'\tScore: {score}')
         return
     
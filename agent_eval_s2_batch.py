@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Headless Batch Agent Evaluator: Stage 2
+Maps the messages of every Stage 1 result file to their best DKB message key
+"""
+
+import argparse
+import os
+import pandas as pd
+from abc_project_vars import DIR_S1_OUTPUT
+from abc_project_vars import FORMAT_DATA
+from concurrent.futures import ProcessPoolExecutor
+from dkb_matcher import MIN_MATCH_SCORE
+from dkb_matcher import NAME_FIELDS
+from dkb_matcher import DomainKnowledgeMatcher
+from dkb_retriever import DomainKnowledgeRetriever
+from utilities_io import load_json_file
+from utilities_printing import print_ind
+
+# Columns of the results table (matched: the best DKB message scored at least min_score)
+COLUMNS = [ 'file', 'language', 'screen_type', 'msg_index', 'message',
+            'matched', 'message_key', 'message_name', 'score' ]
+
+# Match index of each worker process (see init_worker)
+worker_matcher = None
+
+def init_worker( matcher : DomainKnowledgeMatcher) -> None :
+    """
+    Store the match index (built once by the parent process) in the worker process
+    """
+    global worker_matcher
+    worker_matcher = matcher
+    return
+
+def map_files( dir_data : str, filenames : list[str], min_score : float) -> list[list] :
+    """
+    Map the messages of a chunk of Stage 1 result files to DKB message keys.
+    Returns one row per message (see COLUMNS). Messages scoring below min_score are
+    left unmatched (empty key and name, with the score of the best candidate).
+    """
+    rows = []
+    for filename in filenames :
+        try :
+            data_obj = load_json_file(os.path.join( dir_data, filename))
+        except Exception as e :
+            print(f"Error loading {filename}: {e}")
+            continue
+        metadata    = data_obj.get( 'metadata', {})
+        language    = metadata.get( 'language', 'Unknown')
+        screen_type = metadata.get( 'screen_type', 'Unknown')
+        messages    = [ str(m) for m in data_obj.get( 'data', []) ]
+        if not messages :
+            continue
+        matches = worker_matcher.match_batch( messages, 1,
+                                              language if language in NAME_FIELDS else None,
+                                              workers = 1)
+        for i, ( message, message_matches) in enumerate( zip( messages, matches) ) :
+            key, name, score = message_matches[0] if message_matches else ( '', '', 0.0)
+            matched = bool(message_matches) and score >= min_score
+            if not matched :
+                key, name = '', ''
+            rows.append( [ filename, language, screen_type, i, message,
+                           matched, key, name, score ] )
+    return rows
+
+def map_directory( dir_data : str,
+                   matcher : DomainKnowledgeMatcher,
+                   min_score : float = MIN_MATCH_SCORE,
+                   num_workers : int | None = None,
+                   chunk_size : int = 64) -> list[list] :
+    """
+    Map all Stage 1 result files of a directory using a pool of worker processes
+    """
+    filenames = sorted( f for f in os.listdir(dir_data) if f.lower().endswith(FORMAT_DATA) )
+    chunks    = [ filenames[ i : i + chunk_size ]
+                  for i in range( 0, len(filenames), chunk_size) ]
+    rows = []
+    with ProcessPoolExecutor( max_workers = num_workers,
+                              initializer = init_worker,
+                              initargs = ( matcher,) ) as executor :
+        futures = [ executor.submit( map_files, dir_data, chunk, min_score)
+                    for chunk in chunks ]
+        for future in futures :
+            rows.extend(future.result())
+    return rows
+
+def make_results_table( rows : list[list]) -> pd.DataFrame :
+    """
+    Build the results table with typed columns
+    """
+    df = pd.DataFrame( rows, columns = COLUMNS)
+    df = df.astype( { 'msg_index' : 'int32', 'matched' : bool, 'score' : float } )
+    for column in ( 'language', 'screen_type' ) :
+        df[column] = df[column].astype('category')
+    return df
+
+def save_results_table( df : pd.DataFrame, filepath : str) -> None :
+    """
+    Save the results table in the format of the file extension: Parquet or Feather
+    (columnar, need pyarrow), else CSV with header
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.parquet' :
+        df.to_parquet( filepath, index = False)
+    elif extension == '.feather' :
+        df.to_feather(filepath)
+    else :
+        df.to_csv( filepath, index = False, lineterminator = '\n')
+    return
+
+def parse_arguments() -> argparse.Namespace :
+    parser = argparse.ArgumentParser( description = 'Batch Agent Evaluator: Stage 2')
+    parser.add_argument( '-d', '--data_dir', default = DIR_S1_OUTPUT,
+                         help = 'Directory with Stage 1 result files')
+    parser.add_argument( '-o', '--output', default = 'agent_results_s2.csv',
+                         help = 'Path of the results table (.parquet, .feather or CSV)')
+    parser.add_argument( '-s', '--min_score', type = float, default = MIN_MATCH_SCORE,
+                         help = 'Leave messages scoring below this value unmatched')
+    parser.add_argument( '-w', '--workers', type = int, default = None,
+                         help = 'Number of worker processes (default: all cores)')
+    return parser.parse_args()
+
+if __name__ == "__main__" :
+
+    args = parse_arguments()
+
+    print_ind('Building DKB match index...')
+    retriever = DomainKnowledgeRetriever()
+    matcher   = DomainKnowledgeMatcher( retriever.data['messages'],
+                                        retriever.data['synonyms'])
+
+    print_ind(f'Mapping Stage 1 results in: {args.data_dir}')
+    df = make_results_table(map_directory( args.data_dir, matcher, args.min_score, args.workers))
+    save_results_table( df, args.output)
+
+    print_ind( f'Mapped {len(df)} messages from {df["file"].nunique()} files', 1)
+    print_ind( f'Unmatched messages (score below {args.min_score}): {(~df["matched"]).sum()}', 1)
+    print_ind( f'Saved results table to: {args.output}', 1)
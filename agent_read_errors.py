@@ -1,7 +1,10 @@
 import os
+import time
 from abc_project_vars import DIR_PROMPTS
+from abc_project_vars import MODEL_S1
 from abc_project_vars import PROMPTS
 from base64 import b64encode
+from functools import lru_cache
 from mistralai import Mistral
 from typing import Any
 from utilities_io import load_file_as_string
@@ -19,6 +22,19 @@ def encode_image( image_path : str) -> str | None :
         print(f"Error: {e}")
         return None
 
+@lru_cache( maxsize = 1)
+def get_client( api_key : str) -> Mistral :
+    """Return the Mistral client for the given API key (created once)."""
+    return Mistral( api_key = api_key)
+
+def load_prompt() -> str :
+    """Load and concatenate the agent prompts."""
+    prompt = ''
+    for p in PROMPTS :
+        prompt_path = os.path.join( DIR_PROMPTS, p)
+        prompt += load_file_as_string(prompt_path) + '\n'
+    return prompt
+
 def read_errors( image_path : str) -> str | None :
     """
     Analyze an image using Mistral API to extract error information.
@@ -27,23 +43,34 @@ def read_errors( image_path : str) -> str | None :
     Returns:
         str: Extracted errors
     """
+    errors_obj, _ = read_errors_with_usage(image_path)
+    return errors_obj
+
+def read_errors_with_usage( image_path : str) -> tuple[ Any | None, dict] :
+    """
+    Analyze an image using Mistral API to extract error information.
+    Args:
+        image_path (str): Path to the image file to analyze
+    Returns:
+        tuple: Extracted errors (or None) and usage dict with keys 'model',
+               'latency' (seconds), 'prompt_tokens' and 'completion_tokens'
+    """
+    usage = { 'model' : MODEL_S1, 'latency' : 0.0,
+              'prompt_tokens' : 0, 'completion_tokens' : 0 }
     try:
         # Setup the API key, client and model
         api_key = os.environ.get("MISTRAL_API_KEY")
         if not api_key:
             print("Error: MISTRAL_API_KEY environment variable not set")
-            return None
-        client = Mistral(api_key=api_key)
-        model  = "pixtral-12b-2409"
+            return None, usage
+        client = get_client(api_key)
+        model  = MODEL_S1
         # Load agent prompts
-        prompt = ''
-        for p in PROMPTS :
-            prompt_path = os.path.join( DIR_PROMPTS, p)
-            prompt += load_file_as_string(prompt_path) + '\n'
+        prompt = load_prompt()
         # Encode image as base64
         base64_image = encode_image(image_path)
         if not base64_image :
-            return None
+            return None, usage
         # Define the messages for the chat
         messages = [
         {
@@ -61,23 +88,28 @@ def read_errors( image_path : str) -> str | None :
         }
         ]
         # Call the API
+        time_start    = time.perf_counter()
         chat_response = client.chat.complete(
             model=model,
             messages=messages # type: ignore
         )
+        usage['latency'] = time.perf_counter() - time_start
+        if chat_response and chat_response.usage :
+            usage['prompt_tokens']     = chat_response.usage.prompt_tokens or 0
+            usage['completion_tokens'] = chat_response.usage.completion_tokens or 0
         if chat_response and chat_response.choices :
             # Extract the content of the response
             errors_read = str(chat_response.choices[0].message.content)
             errors_obj  = load_json_string(errors_read)
             # The grand finale
-            return errors_obj
+            return errors_obj, usage
         else :
             print("No response received from the API")
     # The sad finale: Exception
     except Exception as e:
         print(f"Exception in read_errors: {e}")
     # The sad finale: None
-    return None
+    return None, usage
 
 def write_errors_summary( errors_obj : Any) -> str :
     """Print a summary of the extracted errors."""
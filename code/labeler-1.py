@@ -1,10 +1,20 @@
 import os
-import csv
 import tkinter as tk
 from tkinter import ttk
 from PIL import Image, ImageTk
 from tkinter import messagebox
 import argparse
+import sys
+
+# Shared utilities live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities_images import load_image_for_display
+from utilities_images import rotate_to_fit
+from utilities_labels import LabelStore
+from utilities_labels import list_images
+
+# Interval between flushes of label updates to disk (milliseconds)
+FLUSH_INTERVAL_MS = 2000
 
 # Configuration for DJI_AGRAS_LATINO
 IMAGE_DIR = "/home/luis/DJI_AGRAS_LATINO/raw/"
@@ -32,9 +42,12 @@ class ImageLabelingApp:
         # Replace hardcoded paths with parameters
         self.image_dir = image_dir
         self.csv_file = csv_file
+        # Labels indexed by filename (last labeled image goes last)
+        self.labels = LabelStore(csv_file, move_on_update=True)
         
         # Update image loading to use the new path
-        self.image_files = sorted([f for f in os.listdir(self.image_dir) if f.lower().endswith(('png', 'jpg', 'jpeg'))])
+        self.image_files = list_images(self.image_dir)
+        self.image_index = {name: i for i, name in enumerate(self.image_files)}
         self.current_index = 0
 
         # Configure grid spacing
@@ -107,29 +120,32 @@ class ImageLabelingApp:
         self.root.bind("<KP_5>", lambda e: self.label_image("T50", "B"))
         self.root.bind("<KP_6>", lambda e: self.label_image("T60", "B"))
 
-        self.load_last_index()
+        self.load_cursor_index()
+
+        # Flush label updates in batches and save all labels upon closing the window
+        self.root.after(FLUSH_INTERVAL_MS, self.flush_labels)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
     
     def load_image(self):
         if not self.image_files:
             return
         img_path = os.path.join(self.image_dir, self.image_files[self.current_index])
-        self.image = Image.open(img_path)
+        self.labels.cursor = self.image_files[self.current_index]
+        
+        # Get saved rotation
+        rotation = 0
+        row = self.labels.get(self.image_files[self.current_index])
+        if row:  # If rotation data exists
+            try:
+                rotation = int(row[0])  # rotation is in column 1
+            except ValueError:
+                # If rotation can't be parsed, assume 0
+                pass
         
-        # Apply saved rotation
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row[0] == self.image_files[self.current_index]:
-                        if len(row) > 1:  # If rotation data exists
-                            try:
-                                rotation = int(row[1])  # rotation is in column 1
-                                if rotation != 0:
-                                    self.image = self.image.rotate(rotation, expand=True)
-                            except ValueError:
-                                # If rotation can't be parsed, assume 0
-                                pass
-                        break
+        # Decode at display resolution and apply the saved rotation to the display buffer
+        self.image_base = load_image_for_display(img_path, (800, 600))
+        self.rotation = rotation % 360
+        self.image = rotate_to_fit(self.image_base, self.rotation, (800, 600))
         
         self.display_image()
         self.update_button_states()
@@ -149,14 +165,26 @@ class ImageLabelingApp:
             new_height = 600
             new_width = int(600 * img_ratio)
 
-        # Resize image maintaining aspect ratio
-        img_resized = self.image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Resize image maintaining aspect ratio (display buffers usually fit already)
+        img_resized = self.image
+        if self.image.size != (new_width, new_height):
+            img_resized = self.image.resize((new_width, new_height), Image.Resampling.LANCZOS)
         self.tk_image = ImageTk.PhotoImage(img_resized)
         # Center the image on canvas
         x = 400  # canvas center x
         y = 300  # canvas center y
         self.canvas.create_image(x, y, image=self.tk_image)
     
+    def flush_labels(self):
+        """Write pending label updates to disk (runs periodically)"""
+        self.labels.flush()
+        self.root.after(FLUSH_INTERVAL_MS, self.flush_labels)
+    
+    def close(self):
+        """Save all labels and close the window"""
+        self.labels.close()
+        self.root.destroy()
+    
     def next_image(self):
         if self.current_index < len(self.image_files) - 1:
             # Check if both groups have labels
@@ -167,14 +195,10 @@ class ImageLabelingApp:
             # Ensure current image is in CSV before moving on
             self.ensure_image_in_csv(img_name)
             
-            if os.path.exists(self.csv_file):
-                with open(self.csv_file, newline='') as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if row[0] == img_name:
-                            has_group_a = bool(row[2]) if len(row) > 2 else False
-                            has_group_b = bool(row[3]) if len(row) > 3 else False
-                            break
+            row = self.labels.get(img_name)
+            if row:
+                has_group_a = bool(row[1]) if len(row) > 1 else False
+                has_group_b = bool(row[2]) if len(row) > 2 else False
 
             # Warn if only one group is labeled
             if (has_group_a and not has_group_b) or (not has_group_a and has_group_b):
@@ -189,36 +213,35 @@ class ImageLabelingApp:
             self.current_index -= 1
             self.load_image()
     
+    def rotate_display(self, angle_change):
+        # Transpose the display buffer only (the full image is rotated when exported)
+        self.rotation = (self.rotation + angle_change) % 360
+        self.image = rotate_to_fit(self.image_base, self.rotation, (800, 600))
+    
     def rotate_left(self):
-        self.image = self.image.rotate(90, expand=True)
+        self.rotate_display(90)
         self.save_rotation(90)
         self.display_image()
     
     def rotate_right(self):
-        self.image = self.image.rotate(-90, expand=True)
+        self.rotate_display(-90)
         self.save_rotation(-90)
         self.display_image()
     
     def label_image(self, label, group):
         img_name = self.image_files[self.current_index]
-        rows = []
         current_rotation = 0
         current_group_a = ""
         current_group_b = ""
         current_group_c = ""
         
         # Read existing labels
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row[0] == img_name:
-                        current_rotation = int(row[1]) if row[1] else 0
-                        current_group_a = row[2] if len(row) > 2 else ""
-                        current_group_b = row[3] if len(row) > 3 else ""
-                        current_group_c = row[4] if len(row) > 4 else ""
-                    else:
-                        rows.append(row)
+        row = self.labels.get(img_name)
+        if row:
+            current_rotation = int(row[0]) if row[0] else 0
+            current_group_a = row[1] if len(row) > 1 else ""
+            current_group_b = row[2] if len(row) > 2 else ""
+            current_group_c = row[3] if len(row) > 3 else ""
 
         # Reset buttons in the corresponding group
         group_a_labels = ["RC", "DRONE"]
@@ -259,20 +282,21 @@ class ImageLabelingApp:
                 return
 
         # Write back with new format: filename, rotation, group A, group B, group C
-        rows.append([img_name, str(current_rotation), current_group_a, current_group_b, current_group_c])
-        
-        with open(self.csv_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(rows)
+        self.labels.set(img_name, [str(current_rotation), current_group_a, current_group_b, current_group_c])
     
+    def load_cursor_index(self):
+        """Load the image on display when the labeler was last closed (if any)"""
+        if self.labels.cursor in self.image_index:
+            self.current_index = self.image_index[self.labels.cursor]
+            self.load_image()
+            self.update_button_states()
+        else:
+            self.load_last_index()
+
     def load_last_index(self):
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = list(csv.reader(f))
-                if reader:
-                    last_image = reader[-1][0]
-                    if last_image in self.image_files:
-                        self.current_index = self.image_files.index(last_image)
+        last_image = self.labels.last()
+        if last_image in self.image_index:
+            self.current_index = self.image_index[last_image]
         self.load_image()
         self.update_button_states()
     
@@ -283,76 +307,44 @@ class ImageLabelingApp:
             
         # Check current image label
         img_name = self.image_files[self.current_index]
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row[0] == img_name:
-                        # Check group A label
-                        if len(row) > 2 and row[2] in self.label_buttons:
-                            self.label_buttons[row[2]].state(['selected'])
-                        # Check group B label
-                        if len(row) > 3 and row[3] in self.label_buttons:
-                            self.label_buttons[row[3]].state(['selected'])
-                        # Check group C label
-                        if len(row) > 4 and row[4] in self.label_buttons:
-                            self.label_buttons[row[4]].state(['selected'])
-                        break
+        row = self.labels.get(img_name)
+        if row:
+            # Check group A label
+            if len(row) > 1 and row[1] in self.label_buttons:
+                self.label_buttons[row[1]].state(['selected'])
+            # Check group B label
+            if len(row) > 2 and row[2] in self.label_buttons:
+                self.label_buttons[row[2]].state(['selected'])
+            # Check group C label
+            if len(row) > 3 and row[3] in self.label_buttons:
+                self.label_buttons[row[3]].state(['selected'])
 
     def save_rotation(self, angle_change):
         img_name = self.image_files[self.current_index]
-        rows = []
         current_rotation = 0
         current_group_a = ""
         current_group_b = ""
         current_group_c = ""
         
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row[0] == img_name:
-                        try:
-                            current_rotation = int(row[1]) if row[1] else 0
-                        except ValueError:
-                            current_rotation = 0
-                        current_group_a = row[2] if len(row) > 2 else ""
-                        current_group_b = row[3] if len(row) > 3 else ""
-                        current_group_c = row[4] if len(row) > 4 else ""
-                    else:
-                        rows.append(row)
+        row = self.labels.get(img_name)
+        if row:
+            try:
+                current_rotation = int(row[0]) if row[0] else 0
+            except ValueError:
+                current_rotation = 0
+            current_group_a = row[1] if len(row) > 1 else ""
+            current_group_b = row[2] if len(row) > 2 else ""
+            current_group_c = row[3] if len(row) > 3 else ""
         
         # Update rotation (normalize to 0-359)
         new_rotation = (current_rotation + angle_change) % 360
-        rows.append([img_name, str(new_rotation), current_group_a, current_group_b, current_group_c])
-        
-        with open(self.csv_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(rows)
+        self.labels.set(img_name, [str(new_rotation), current_group_a, current_group_b, current_group_c])
 
     def ensure_image_in_csv(self, img_name):
         """Ensures the current image is in the CSV file with at least rotation data"""
-        if not os.path.exists(self.csv_file):
-            with open(self.csv_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([img_name, "0", "", "", ""])
-            return
-
-        # Check if image exists in CSV
-        found = False
-        rows = []
-        with open(self.csv_file, 'r', newline='') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if row[0] == img_name:
-                    found = True
-                rows.append(row)
-        
         # Add image if not found
-        if not found:
-            with open(self.csv_file, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([img_name, "0", "", "", ""])
+        if img_name not in self.labels:
+            self.labels.set(img_name, ["0", "", "", ""])
 
     def load_first_index(self):
         """Load the first image in the directory"""
@@ -365,4 +357,7 @@ if __name__ == "__main__":
     args = parse_arguments()
     root = tk.Tk()
     app = ImageLabelingApp(root, args.image_dir, args.csv_file)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        app.labels.close()
@@ -1,5 +1,4 @@
 import os
-import csv
 import tkinter as tk
 from tkinter import ttk
 from PIL import Image, ImageTk
@@ -7,6 +6,19 @@ from tkinter import messagebox
 import argparse
 import sys
 
+# Shared utilities live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities_images import load_image_for_display
+from utilities_images import rotate_to_fit
+from utilities_labels import LabelStore
+from utilities_labels import list_images
+from utilities_ocr_store import OcrStore
+from utilities_phash import CLUSTERS_FILE
+from utilities_phash import load_clusters
+
+# Interval between flushes of label updates to disk (milliseconds)
+FLUSH_INTERVAL_MS = 2000
+
 # Replace the hardcoded configuration with command line argument parsing
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Image Labeling Tool - Phase 2')
@@ -14,97 +26,57 @@ def parse_arguments():
                       help='Directory containing the images to label')
     parser.add_argument('-csv', '--csv_file', required=True,
                       help='Path to the CSV file for storing labels (must exist)')
+    parser.add_argument('-clu', '--clusters_file', default=None,
+                      help=f'Near-duplicate clusters (default: {CLUSTERS_FILE} in the image directory, if any); '
+                           'unlabeled near-duplicates start with the labels of their representative')
     return parser.parse_args()
 
-def validate_csv_with_image_dir(csv_file, image_dir):
+def validate_csv_with_image_dir(labels, image_files):
     """
     Validates that the CSV file contains only images that exist in the image directory.
     Returns a tuple (is_valid, missing_images) where missing_images is a list of images in the CSV
     that don't exist in the image directory.
     """
-    if not os.path.exists(csv_file):
-        return False, ["CSV file does not exist"]
-    
-    # Get list of images in the directory
-    image_files = set([f for f in os.listdir(image_dir) if f.lower().endswith(('png', 'jpg', 'jpeg'))])
-    
-    # Check images in CSV
-    missing_images = []
-    with open(csv_file, newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if row and row[0] not in image_files:
-                missing_images.append(row[0])
+    # Check images in CSV against the (already listed) images in the directory
+    image_set = set(image_files)
+    missing_images = [f for f in labels.filenames() if f not in image_set]
     
     return len(missing_images) == 0, missing_images
 
-def ensure_csv_format(csv_file):
+def ensure_csv_format(labels):
     """
     Ensures the CSV file has consistent line endings and format.
     Removes duplicate entries and fixes any formatting issues.
+    Skipped when the checksum of the CSV file shows it was last written by the labeler.
     """
-    if not os.path.exists(csv_file):
+    if labels.verified:
         return
     
-    # Read all entries from CSV
+    # Read all entries from CSV (duplicates were already merged by the label store)
     entries = {}
-    with open(csv_file, 'r', newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if not row:
-                continue
-            # Use the filename as key to avoid duplicates
-            filename = row[0]
-            # Store the rest of the data
-            rotation = row[1] if len(row) > 1 else "0"
-            group_a = row[2] if len(row) > 2 else ""
-            group_b = row[3] if len(row) > 3 else ""
-            group_c = row[4] if len(row) > 4 else ""
-            group_d = row[5] if len(row) > 5 else ""
-            
-            # Fix quoted comma-separated values in group_c
-            if group_c and group_c.startswith('"') and group_c.endswith('"'):
-                group_c = group_c[1:-1]  # Remove quotes
-            
-            entries[filename] = [rotation, group_a, group_b, group_c, group_d]
+    for filename in labels.filenames():
+        row = labels.get(filename)
+        # Store the rest of the data
+        rotation = row[0] if len(row) > 0 else "0"
+        group_a = row[1] if len(row) > 1 else ""
+        group_b = row[2] if len(row) > 2 else ""
+        group_c = row[3] if len(row) > 3 else ""
+        group_d = row[4] if len(row) > 4 else ""
+        
+        # Fix quoted comma-separated values in group_c
+        if group_c and group_c.startswith('"') and group_c.endswith('"'):
+            group_c = group_c[1:-1]  # Remove quotes
+        
+        entries[filename] = [rotation, group_a, group_b, group_c, group_d]
     
-    # Write back with consistent format
-    with open(csv_file, 'w', newline='') as f:
-        writer = csv.writer(f)
-        for filename, data in sorted(entries.items()):
-            writer.writerow([filename] + data)
+    # Write back with consistent format (atomically, so a crash cannot corrupt the file)
+    labels.replace_all(dict(sorted(entries.items())))
     
     return entries
 
-def update_csv_entry(csv_file, img_name, new_data):
-    """
-    Updates a specific entry in the CSV file for the given image name.
-    """
-    updated = False
-    rows = []
-
-    # Read all entries from CSV
-    with open(csv_file, 'r', newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if row and row[0] == img_name:
-                rows.append([img_name] + new_data)
-                updated = True
-            else:
-                rows.append(row)
-
-    # If the image was not found, add it
-    if not updated:
-        rows.append([img_name] + new_data)
-
-    # Write back to CSV
-    with open(csv_file, 'w', newline='') as f:
-        writer = csv.writer(f, lineterminator='\n')
-        writer.writerows(rows)
-
 # Image Labeling App
 class ImageLabelingApp:
-    def __init__(self, root, image_dir, csv_file):
+    def __init__(self, root, image_dir, csv_file, labels=None, image_files=None, clusters_file=None):
         self.root = root
         self.root.title("Image Labeling Tool - Phase 2")
         self.root.configure(bg='black')
@@ -112,10 +84,17 @@ class ImageLabelingApp:
         # Replace hardcoded paths with parameters
         self.image_dir = image_dir
         self.csv_file = csv_file
+        # Labels indexed by filename
+        self.labels = labels if labels is not None else LabelStore(csv_file)
         
-        # Update image loading to use the new path
-        self.image_files = sorted([f for f in os.listdir(self.image_dir) if f.lower().endswith(('png', 'jpg', 'jpeg'))])
+        # Update image loading to use the new path (unless already listed)
+        self.image_files = image_files if image_files is not None else list_images(self.image_dir)
+        self.image_index = {name: i for i, name in enumerate(self.image_files)}
         self.current_index = 0
+        
+        # Near-duplicates (see cluster_duplicates.py): shown like any image, unlabeled ones
+        # with the labels of the representative of their cluster, for the user to check
+        self.representatives = load_clusters(clusters_file or os.path.join(self.image_dir, CLUSTERS_FILE))
 
         # Configure grid spacing
         root.grid_rowconfigure(0, weight=10)  # Top spacing
@@ -177,6 +156,12 @@ class ImageLabelingApp:
             btn.grid(row=row, column=col)
             self.label_buttons[label] = btn
 
+        # Stored OCR text of the image on display (if the error screen selector has run)
+        self.ocr_store = OcrStore.open_if_exists()
+        self.ocr_text = tk.Label(root, text="", bg='black', fg='white', justify='left',
+                                 anchor='nw', wraplength=300)
+        self.ocr_text.grid(row=7, column=3, columnspan=3, rowspan=3, sticky='nw')
+
         # Key bindings
         self.root.bind("<Left>", lambda e: self.previous_image())
         self.root.bind("<Right>", lambda e: self.next_image())
@@ -194,7 +179,11 @@ class ImageLabelingApp:
         self.root.bind("<KP_5>", lambda e: self.label_image("T50", "B"))
         self.root.bind("<KP_6>", lambda e: self.label_image("BATT", "C"))
 
-        self.load_first_csv_image()
+        self.load_cursor_index()
+
+        # Flush label updates in batches and save all labels upon closing the window
+        self.root.after(FLUSH_INTERVAL_MS, self.flush_labels)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         
         # Only call it once at the end of initialization
         # self.setup_key_bindings()
@@ -203,23 +192,28 @@ class ImageLabelingApp:
         if not self.image_files:
             return
         img_path = os.path.join(self.image_dir, self.image_files[self.current_index])
-        self.image = Image.open(img_path)
+        self.labels.cursor = self.image_files[self.current_index]
+        notice = self.prefill_duplicate(self.image_files[self.current_index])
+        
+        # Get saved rotation
+        rotation = 0
+        row = self.labels.get(self.image_files[self.current_index])
+        if row:  # If rotation data exists
+            try:
+                rotation = int(row[0])  # rotation is in column 1
+            except ValueError:
+                # If rotation can't be parsed, assume 0
+                pass
         
-        # Apply saved rotation
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row[0] == self.image_files[self.current_index]:
-                        if len(row) > 1:  # If rotation data exists
-                            try:
-                                rotation = int(row[1])  # rotation is in column 1
-                                if rotation != 0:
-                                    self.image = self.image.rotate(rotation, expand=True)
-                            except ValueError:
-                                # If rotation can't be parsed, assume 0
-                                pass
-                        break
+        # Decode at display resolution and apply the saved rotation to the display buffer
+        self.image_base = load_image_for_display(img_path, (800, 600))
+        self.rotation = rotation % 360
+        self.image = rotate_to_fit(self.image_base, self.rotation, (800, 600))
+        
+        # Show the stored OCR text (the hash of the file is already cached by the loader)
+        ocr = self.ocr_store.lookup(img_path) if self.ocr_store is not None else None
+        text = ocr['text'][:500] if ocr and ocr['status'] in ('ocr', 'duplicate') and ocr['text'] else ""
+        self.ocr_text.config(text="\n\n".join(part for part in (notice, text) if part))
         
         self.display_image()
         self.update_button_states()
@@ -239,8 +233,10 @@ class ImageLabelingApp:
             new_height = 600
             new_width = int(600 * img_ratio)
 
-        # Resize image maintaining aspect ratio
-        img_resized = self.image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Resize image maintaining aspect ratio (display buffers usually fit already)
+        img_resized = self.image
+        if self.image.size != (new_width, new_height):
+            img_resized = self.image.resize((new_width, new_height), Image.Resampling.LANCZOS)
         self.tk_image = ImageTk.PhotoImage(img_resized)
         # Center the image on canvas
         x = 400  # canvas center x
@@ -248,6 +244,16 @@ class ImageLabelingApp:
         self.canvas.delete("all")  # Clear previous image
         self.canvas.create_image(x, y, image=self.tk_image)
     
+    def flush_labels(self):
+        """Write pending label updates to disk (runs periodically)"""
+        self.labels.flush()
+        self.root.after(FLUSH_INTERVAL_MS, self.flush_labels)
+    
+    def close(self):
+        """Save all labels and close the window"""
+        self.labels.close()
+        self.root.destroy()
+    
     def next_image(self):
         if self.current_index < len(self.image_files) - 1:
             # Check if both groups have labels
@@ -258,14 +264,10 @@ class ImageLabelingApp:
             # Ensure current image is in CSV before moving on
             self.ensure_image_in_csv(img_name)
             
-            if os.path.exists(self.csv_file):
-                with open(self.csv_file, newline='') as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if row[0] == img_name:
-                            has_group_a = bool(row[2]) if len(row) > 2 else False
-                            has_group_b = bool(row[3]) if len(row) > 3 else False
-                            break
+            row = self.labels.get(img_name)
+            if row:
+                has_group_a = bool(row[1]) if len(row) > 1 else False
+                has_group_b = bool(row[2]) if len(row) > 2 else False
 
             # Warn if only one group is labeled
             if (has_group_a and not has_group_b) or (not has_group_a and has_group_b):
@@ -280,38 +282,40 @@ class ImageLabelingApp:
             self.current_index -= 1
             self.load_image()
     
+    def prefill_duplicate(self, img_name):
+        """
+        Give an unlabeled near-duplicate the labels of its representative (keeping its own
+        rotation). Returns a notice for the user (empty if not a near-duplicate).
+        """
+        representative = self.representatives.get(img_name, img_name)
+        if representative == img_name or representative not in self.image_index:
+            return ""
+        notice = f"Near-duplicate of {representative}"
+        rep_row = self.labels.get(representative)
+        row = self.labels.get(img_name)
+        if rep_row and any(rep_row[1:]) and not (row and any(row[1:])):
+            self.labels.set(img_name, [row[0] if row else "0"] + rep_row[1:])
+            notice += ": its labels were copied, check them"
+        return notice
+    
+    def rotate_display(self, angle_change):
+        # Transpose the display buffer only (the full image is rotated when exported)
+        self.rotation = (self.rotation + angle_change) % 360
+        self.image = rotate_to_fit(self.image_base, self.rotation, (800, 600))
+    
     def rotate_left(self):
-        self.image = self.image.rotate(90, expand=True)
+        self.rotate_display(90)
         self.save_rotation(90)
         self.display_image()
     
     def rotate_right(self):
-        self.image = self.image.rotate(-90, expand=True)
+        self.rotate_display(-90)
         self.save_rotation(-90)
         self.display_image()
     
     def update_csv(self, img_name, new_values):
         """Update the CSV file with new values for a given image."""
-        updated = False
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, 'r', newline='') as f:
-                reader = csv.reader(f)
-                rows = list(reader)
-
-            with open(self.csv_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                for row in rows:
-                    if row and row[0] == img_name:
-                        # Update the row with new values
-                        row[1:] = new_values
-                        updated = True
-                    writer.writerow(row)
-
-            if not updated:
-                # If the image was not found, append it
-                with open(self.csv_file, 'a', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow([img_name] + new_values)
+        self.labels.set(img_name, new_values)
 
     def label_image(self, label, group):
         """Label the image with the given label and group."""
@@ -321,88 +325,64 @@ class ImageLabelingApp:
         print(f"Debug: Current image name: {img_name}")
         
         try:
-            # Read the entire file into memory
-            with open(self.csv_file, 'r', newline='') as f:
-                lines = f.readlines()
-            
-            # Find the line for this image
-            found = False
+            # Find the row for this image
+            row = self.labels.get(img_name)
             modified = False
-            new_lines = []
             
-            for line in lines:
-                line = line.rstrip('\r\n')  # Remove trailing newlines
-                parts = line.split(',')
+            if row is not None:
+                # Get current values
+                rotation = row[0] if len(row) > 0 else "0"
+                group_a = row[1] if len(row) > 1 else ""
+                group_b = row[2] if len(row) > 2 else ""
+                
+                # Get group C labels (all elements after index 3)
+                group_c_labels = [p for c in row[3:] for p in c.split(',') if p.strip()]
                 
-                if parts and parts[0] == img_name:
-                    found = True
-                    # Get current values
-                    rotation = parts[1] if len(parts) > 1 else "0"
-                    group_a = parts[2] if len(parts) > 2 else ""
-                    group_b = parts[3] if len(parts) > 3 else ""
-                    
-                    # Get group C labels (all elements after index 3)
-                    group_c_labels = [p for p in parts[4:] if p.strip()]
-                    
-                    # Update based on the group
-                    original_line = line
-                    if group == "A":
-                        # Toggle label for group A
-                        if group_a == label:
-                            group_a = ""  # Remove label if it's already set
-                        else:
-                            group_a = label  # Set new label
-                        modified = True
-                    elif group == "B":
-                        # Toggle label for group B
-                        if group_b == label:
-                            group_b = ""  # Remove label if it's already set
-                        else:
-                            group_b = label  # Set new label
-                        modified = True
-                    elif group == "C" and group_a == "RC":
-                        # Toggle label for group C
-                        if label in group_c_labels:
-                            group_c_labels.remove(label)  # Remove label if it exists
-                        else:
-                            group_c_labels.append(label)  # Add label if it doesn't exist
-                        modified = True
-                    
-                    # Create new line only if modified
-                    if modified:
-                        new_line = f"{img_name},{rotation},{group_a},{group_b}"
-                        if group_c_labels:
-                            for c_label in group_c_labels:
-                                if c_label.strip():
-                                    new_line += f",{c_label}"
-                        print(f"Debug: Original line: {original_line}")
-                        print(f"Debug: New line: {new_line}")
-                        new_lines.append(new_line)
+                # Update based on the group
+                original_values = [img_name] + row
+                if group == "A":
+                    # Toggle label for group A
+                    if group_a == label:
+                        group_a = ""  # Remove label if it's already set
+                    else:
+                        group_a = label  # Set new label
+                    modified = True
+                elif group == "B":
+                    # Toggle label for group B
+                    if group_b == label:
+                        group_b = ""  # Remove label if it's already set
                     else:
-                        new_lines.append(line)
-                else:
-                    new_lines.append(line)
+                        group_b = label  # Set new label
+                    modified = True
+                elif group == "C" and group_a == "RC":
+                    # Toggle label for group C
+                    if label in group_c_labels:
+                        group_c_labels.remove(label)  # Remove label if it exists
+                    else:
+                        group_c_labels.append(label)  # Add label if it doesn't exist
+                    modified = True
+                
+                # Create new row only if modified
+                if modified:
+                    new_values = [rotation, group_a, group_b] + group_c_labels
+                    print(f"Debug: Original line: {','.join(original_values)}")
+                    print(f"Debug: New line: {','.join([img_name] + new_values)}")
             
-            # If image not found, add a new line
-            if not found:
+            # If image not found, add a new row
+            else:
                 rotation = "0"
                 group_a = label if group == "A" else "RC" if group == "C" else ""
                 group_b = label if group == "B" else ""
                 group_c = label if group == "C" else ""
                 
-                new_line = f"{img_name},{rotation},{group_a},{group_b}"
+                new_values = [rotation, group_a, group_b]
                 if group_c:
-                    new_line += f",{group_c}"
-                
-                new_lines.append(new_line)
+                    new_values.append(group_c)
                 modified = True
             
             # Only write back if something changed
             if modified:
-                with open(self.csv_file, 'w', newline='') as f:
-                    for line in new_lines:
-                        f.write(line + '\n')
-                
+                self.labels.set(img_name, new_values)
                 print(f"Debug: File updated")
                 print(f"Labeled {img_name} with {label} in group {group}")
             else:
@@ -417,13 +397,9 @@ class ImageLabelingApp:
             traceback.print_exc()
     
     def load_last_index(self):
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = list(csv.reader(f))
-                if reader:
-                    last_image = reader[-1][0]
-                    if last_image in self.image_files:
-                        self.current_index = self.image_files.index(last_image)
+        last_image = self.labels.last()
+        if last_image in self.image_index:
+            self.current_index = self.image_index[last_image]
         self.load_image()
         self.update_button_states()
     
@@ -434,52 +410,32 @@ class ImageLabelingApp:
             
         # Check current image label
         img_name = self.image_files[self.current_index]
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, 'r', newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row and row[0] == img_name:
-                        # Check group A label
-                        if len(row) > 2 and row[2] in self.label_buttons:
-                            self.label_buttons[row[2]].state(['selected'])
-                        
-                        # Check group B label
-                        if len(row) > 3 and row[3] in self.label_buttons:
-                            self.label_buttons[row[3]].state(['selected'])
-                        
-                        # Check group C labels (may have multiple values)
-                        if len(row) > 4 and row[4]:
-                            group_c_labels = row[4].split(',')
-                            for label in group_c_labels:
-                                if label and label in self.label_buttons:
-                                    self.label_buttons[label].state(['selected'])
-                        
-                        # Check group D label (for backward compatibility)
-                        if len(row) > 5 and row[5] in self.label_buttons:
-                            self.label_buttons[row[5]].state(['selected'])
-                        break
+        row = self.labels.get(img_name)
+        if row:
+            # Check group A label
+            if len(row) > 1 and row[1] in self.label_buttons:
+                self.label_buttons[row[1]].state(['selected'])
+            
+            # Check group B label
+            if len(row) > 2 and row[2] in self.label_buttons:
+                self.label_buttons[row[2]].state(['selected'])
+            
+            # Check group C labels (may have multiple values)
+            if len(row) > 3 and row[3]:
+                group_c_labels = row[3].split(',')
+                for label in group_c_labels:
+                    if label and label in self.label_buttons:
+                        self.label_buttons[label].state(['selected'])
+            
+            # Check group D label (for backward compatibility)
+            if len(row) > 4 and row[4] in self.label_buttons:
+                self.label_buttons[row[4]].state(['selected'])
 
     def save_rotation(self, angle_change):
         img_name = self.image_files[self.current_index]
         
-        # Read all entries from CSV
-        entries = {}
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, 'r', newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if not row:
-                        continue
-                    filename = row[0]
-                    rotation = row[1] if len(row) > 1 else "0"
-                    group_a = row[2] if len(row) > 2 else ""
-                    group_b = row[3] if len(row) > 3 else ""
-                    group_c = row[4] if len(row) > 4 else ""
-                    group_d = row[5] if len(row) > 5 else ""
-                    entries[filename] = [rotation, group_a, group_b, group_c, group_d]
-        
         # Get current values for this image
-        current_values = entries.get(img_name, ["0", "", "", "", ""])
+        current_values = self.labels.get(img_name) or ["0", "", "", "", ""]
         try:
             current_rotation = int(current_values[0])
         except ValueError:
@@ -490,41 +446,13 @@ class ImageLabelingApp:
         
         # Update the rotation value
         current_values[0] = str(new_rotation)
-        entries[img_name] = current_values
-        
-        # Write all entries back to CSV
-        with open(self.csv_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            for filename, data in sorted(entries.items()):
-                writer.writerow([filename] + data)
+        self.labels.set(img_name, current_values)
 
     def ensure_image_in_csv(self, img_name):
         """Ensures the current image is in the CSV file with at least rotation data"""
-        # Read all entries from CSV
-        entries = {}
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, 'r', newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if not row:
-                        continue
-                    filename = row[0]
-                    rotation = row[1] if len(row) > 1 else "0"
-                    group_a = row[2] if len(row) > 2 else ""
-                    group_b = row[3] if len(row) > 3 else ""
-                    group_c = row[4] if len(row) > 4 else ""
-                    group_d = row[5] if len(row) > 5 else ""
-                    entries[filename] = [rotation, group_a, group_b, group_c, group_d]
-        
         # Add image if not found
-        if img_name not in entries:
-            entries[img_name] = ["0", "", "", "", ""]
-            
-            # Write all entries back to CSV
-            with open(self.csv_file, 'w', newline='') as f:
-                writer = csv.writer(f)
-                for filename, data in sorted(entries.items()):
-                    writer.writerow([filename] + data)
+        if img_name not in self.labels:
+            self.labels.set(img_name, ["0", "", "", "", ""])
 
     def load_first_index(self):
         """Load the first image in the directory"""
@@ -533,33 +461,36 @@ class ImageLabelingApp:
             self.load_image()
             self.update_button_states()
 
+    def load_cursor_index(self):
+        """Load the image on display when the labeler was last closed (if any)"""
+        if self.labels.cursor in self.image_index:
+            self.current_index = self.image_index[self.labels.cursor]
+            self.load_image()
+            self.update_button_states()
+        else:
+            self.load_first_csv_image()
+
     def load_first_csv_image(self):
         """Load the first image found in the CSV file"""
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row and row[0] in self.image_files:
-                        self.current_index = self.image_files.index(row[0])
-                        break
+        for filename in self.labels.filenames():
+            if filename in self.image_index:
+                self.current_index = self.image_index[filename]
+                break
         self.load_image()
         self.update_button_states()
 
     def get_current_csv_values(self, img_name):
         """Returns the current values for an image from the CSV file"""
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, 'r', newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row and row[0] == img_name:
-                        # Return rotation, group_a, group_b, group_c, group_d
-                        return [
-                            row[1] if len(row) > 1 else "0",    # rotation
-                            row[2] if len(row) > 2 else "",     # group_a
-                            row[3] if len(row) > 3 else "",     # group_b
-                            row[4] if len(row) > 4 else "",     # group_c
-                            row[5] if len(row) > 5 else ""      # group_d
-                        ]
+        row = self.labels.get(img_name)
+        if row:
+            # Return rotation, group_a, group_b, group_c, group_d
+            return [
+                row[0] if len(row) > 0 else "0",    # rotation
+                row[1] if len(row) > 1 else "",     # group_a
+                row[2] if len(row) > 2 else "",     # group_b
+                row[3] if len(row) > 3 else "",     # group_c
+                row[4] if len(row) > 4 else ""      # group_d
+            ]
         # Return default values if image not found in CSV
         return ["0", "", "", "", ""]
 
@@ -577,30 +508,26 @@ class ImageLabelingApp:
             
         # Check current image label
         img_name = self.get_current_image_name()
-        if os.path.exists(self.csv_file):
-            with open(self.csv_file, 'r', newline='') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row and row[0] == img_name:
-                        # Check group A label
-                        if len(row) > 2 and row[2] in self.label_buttons:
-                            self.label_buttons[row[2]].state(['selected'])
-                        
-                        # Check group B label
-                        if len(row) > 3 and row[3] in self.label_buttons:
-                            self.label_buttons[row[3]].state(['selected'])
-                        
-                        # Check group C labels (may have multiple values)
-                        if len(row) > 4 and row[4]:
-                            group_c_labels = row[4].split(',')
-                            for label in group_c_labels:
-                                if label and label in self.label_buttons:
-                                    self.label_buttons[label].state(['selected'])
-                        
-                        # Check group D label (for backward compatibility)
-                        if len(row) > 5 and row[5] in self.label_buttons:
-                            self.label_buttons[row[5]].state(['selected'])
-                        break
+        row = self.labels.get(img_name)
+        if row:
+            # Check group A label
+            if len(row) > 1 and row[1] in self.label_buttons:
+                self.label_buttons[row[1]].state(['selected'])
+            
+            # Check group B label
+            if len(row) > 2 and row[2] in self.label_buttons:
+                self.label_buttons[row[2]].state(['selected'])
+            
+            # Check group C labels (may have multiple values)
+            if len(row) > 3 and row[3]:
+                group_c_labels = row[3].split(',')
+                for label in group_c_labels:
+                    if label and label in self.label_buttons:
+                        self.label_buttons[label].state(['selected'])
+            
+            # Check group D label (for backward compatibility)
+            if len(row) > 4 and row[4] in self.label_buttons:
+                self.label_buttons[row[4]].state(['selected'])
 
 if __name__ == "__main__":
     args = parse_arguments()
@@ -610,11 +537,15 @@ if __name__ == "__main__":
         print(f"Error: CSV file '{args.csv_file}' does not exist. Please provide an existing CSV file.")
         sys.exit(1)
     
-    # Fix CSV format before validation
-    ensure_csv_format(args.csv_file)
+    # Load labels and list images only once
+    labels = LabelStore(args.csv_file)
+    image_files = list_images(args.image_dir)
+    
+    # Fix CSV format before validation (only if modified by something else)
+    ensure_csv_format(labels)
     
     # Validate that CSV file matches images in directory
-    is_valid, missing_images = validate_csv_with_image_dir(args.csv_file, args.image_dir)
+    is_valid, missing_images = validate_csv_with_image_dir(labels, image_files)
     if not is_valid:
         print(f"Error: CSV file contains images that don't exist in the image directory:")
         for img in missing_images[:10]:  # Show first 10 missing images
@@ -622,8 +553,12 @@ if __name__ == "__main__":
         if len(missing_images) > 10:
             print(f"  ... and {len(missing_images) - 10} more.")
         print("Please ensure the CSV file matches the images in the directory.")
+        labels.close()
         sys.exit(1)
         
     root = tk.Tk()
-    app = ImageLabelingApp(root, args.image_dir, args.csv_file)
-    root.mainloop()
+    app = ImageLabelingApp(root, args.image_dir, args.csv_file, labels, image_files, args.clusters_file)
+    try:
+        root.mainloop()
+    finally:
+        app.labels.close()
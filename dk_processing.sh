@@ -9,7 +9,8 @@ if [ -d "$DIR_NAME" ]; then
     rm -v "$DIR_NAME"/*.md
 fi
 
-# Run expansions and compute paths
-python3 dka_parse_placeholders.py
-python3 dkb_compute_paths.py
+# Run expansions and compute paths (each stage prints its timings and counters;
+# options such as --timings or --profile are passed on, reports go to DIR_PROFILES)
+python3 dka_parse_placeholders.py "$@"
+python3 dkb_compute_paths.py "$@"
 # python3 dkb_publish_errors_list.py
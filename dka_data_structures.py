@@ -9,6 +9,7 @@ from re import findall
 from re import search
 from typing import Callable
 from utilities_io import load_json_file
+from utilities_profiling import PROFILER
 
 class BuiltInFunction(dict) :
     def __init__( self, function : Callable[ [str], str]) :
@@ -288,6 +289,7 @@ def load_placeholders( placeholder_path : str) -> PlaceHolderDatabase:
 
 def contains_placeholders( data : str | list | dict) -> bool :
     if isinstance( data, str) :
+        PROFILER.count('placeholder_scans')
         match = search( phrx.RX_SET, data)
         if match :
             if match.group(1) not in phrx.IGNORE :
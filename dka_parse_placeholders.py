@@ -3,18 +3,23 @@
 Parsing functions for placeholder substitution
 """
 
+import argparse
 import os
 import shutil
 from abc_project_vars import DIR_DKA
 from abc_project_vars import DIR_DKB
+from abc_project_vars import DIR_PROFILES
 from collections import OrderedDict
 from dka_data_structures import PlaceHolderDatabase
 from dka_data_structures import contains_placeholders
 from dka_data_structures import load_placeholders
 from utilities_io import ensure_dir
-from utilities_io import load_json_file
-from utilities_io import save_to_json_file
 from utilities_printing import print_ind
+from utilities_profiling import PROFILER
+from utilities_profiling import add_profiling_arguments
+from utilities_profiling import finish_profiling
+from utilities_profiling import profiled_load_json
+from utilities_profiling import profiled_save_json
 
 def parse_dict( data : OrderedDict, phDB : PlaceHolderDatabase) -> OrderedDict :
     
@@ -96,10 +101,26 @@ def parse_signals( data : list,
     
     return result
 
+def count_entries( data : OrderedDict | list) -> int :
+    """
+    Number of entries of a DK file (keys of dicts, items of lists)
+    """
+    return len(data) if isinstance( data, ( dict, list)) else 0
+
+def parse_arguments() -> argparse.Namespace :
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser( description = 'Expand the placeholders of the DK files')
+    add_profiling_arguments(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__" :
     
+    args       = parse_arguments()
     dir_input  = DIR_DKA
     dir_output = DIR_DKB
+    PROFILER.configure( 'dka_parse_placeholders', args.profile)
 
     print_ind(f'Expanding domain knowledge from: {dir_input}')
     ensure_dir(dir_output)
@@ -110,7 +131,8 @@ if __name__ == "__main__" :
 
     # Load the placeholder database
     path_placeholders = os.path.join( dir_input, 'placeholders.json')
-    placeholderDB     = load_placeholders(path_placeholders)
+    with PROFILER.stage('load_placeholders') :
+        placeholderDB = load_placeholders(path_placeholders)
     
     # List all files in the input directory
     dir_input_filenames = os.listdir(dir_input)
@@ -129,32 +151,43 @@ if __name__ == "__main__" :
         # If file is not in batch and not in exceptions then copy
         if not filename.startswith(batch) :
             if not filename.startswith(exceptions) :
-                shutil.copy (path_input, path_output)
+                with PROFILER.stage('copy') :
+                    shutil.copy (path_input, path_output)
+                PROFILER.count('files_copied')
+                PROFILER.count( 'bytes_copied', os.path.getsize(path_output))
                 print_ind( f'File is neither expandable nor in exceptions. Copied.', 1)
             else :
                 print_ind( f'File is in exceptions. Skipped.', 1)
             continue
         
         # Load the JSON file
-        file_data   = load_json_file(path_input)
+        file_data   = profiled_load_json(path_input)
         parsed_data = None
+        PROFILER.count( 'entries_read', count_entries(file_data))
         
         # Parse according to batch type
-        if filename.startswith(('components_','problems_')) :
-            parsed_data = parse_dict( file_data, placeholderDB)
-        elif filename.startswith('connections') :
-            parsed_data = parse_connections( file_data, placeholderDB)
-        elif filename.startswith('messages_') :
-            parsed_data = parse_messages( file_data, placeholderDB)
-        elif filename.startswith('signals_') :
-            parsed_data = parse_signals( file_data, placeholderDB)
-        else :
-            raise ValueError( f'Unknown batch: {filename}')
+        with PROFILER.stage('expand') :
+            if filename.startswith(('components_','problems_')) :
+                parsed_data = parse_dict( file_data, placeholderDB)
+            elif filename.startswith('connections') :
+                parsed_data = parse_connections( file_data, placeholderDB)
+            elif filename.startswith('messages_') :
+                parsed_data = parse_messages( file_data, placeholderDB)
+            elif filename.startswith('signals_') :
+                parsed_data = parse_signals( file_data, placeholderDB)
+            else :
+                raise ValueError( f'Unknown batch: {filename}')
+        PROFILER.count('files_expanded')
+        PROFILER.count( 'entries_expanded', count_entries(parsed_data))
         
         # Write the parsed data as JSON to the output directory
-        save_to_json_file( parsed_data, path_output)
+        profiled_save_json( parsed_data, path_output)
         print_ind( f'File data expanded.', 1)
         
         # Warn of leftover placeholders
-        if contains_placeholders(parsed_data) :
+        with PROFILER.stage('check_placeholders') :
+            leftover = contains_placeholders(parsed_data)
+        if leftover :
             print_ind(f'⚠️ WARNING: Post-processing found leftover placeholders!')
+    
+    finish_profiling( args, DIR_PROFILES)
@@ -3,12 +3,17 @@
 Parsing functions for placeholder substitution
 """
 
+import argparse
 import os
 from abc_project_vars import DIR_DKB as dir_input
+from abc_project_vars import DIR_PROFILES
 from collections import OrderedDict
-from utilities_io import load_json_file
 from utilities_io import list_files_starting_with
 from utilities_printing import print_ind
+from utilities_profiling import PROFILER
+from utilities_profiling import add_profiling_arguments
+from utilities_profiling import finish_profiling
+from utilities_profiling import profiled_load_json
 
 def check_components( data : OrderedDict) -> None :
     for comp_key, comp_dict in data.items() :
@@ -127,9 +132,19 @@ def check_messages( data : OrderedDict,
     
     return
 
+def parse_arguments() -> argparse.Namespace :
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser( description = 'Check the consistency of the DK files')
+    add_profiling_arguments(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__" :
     
     # dir_input = DIR_DKA
+    args = parse_arguments()
+    PROFILER.configure( 'dkb_checkers', args.profile)
     print_ind(f'Checking domain knowledge in: {dir_input}')
 
     # Check components
@@ -138,8 +153,10 @@ if __name__ == "__main__" :
     print_ind(f'Checking components...')
     for filename in filenames :
         print_ind(f'Processing file: {filename}')
-        data = load_json_file(filename)
-        check_components(data)
+        data = profiled_load_json(filename)
+        with PROFILER.stage('check_components') :
+            check_components(data)
+        PROFILER.count( 'components_checked', len(data))
         for comp_key in data :
             if comp_key in components :
                 print_ind( f'⚠️ Found repeated component key: {comp_key}', 1)
@@ -151,8 +168,10 @@ if __name__ == "__main__" :
     print_ind(f'Checking problems...')
     for filename in filenames :
         print_ind(f'Processing file: {filename}')
-        data = load_json_file(filename)
-        check_problems(data)
+        data = profiled_load_json(filename)
+        with PROFILER.stage('check_problems') :
+            check_problems(data)
+        PROFILER.count( 'problems_checked', len(data))
         for message_key in data :
             if message_key in problems :
                 print_ind( f'⚠️ Found repeated problem key: {message_key}', 1)
@@ -164,8 +183,10 @@ if __name__ == "__main__" :
     print_ind(f'Checking signals...')
     for filename in filenames :
         print_ind(f'Processing file: {filename}')
-        data = load_json_file(filename)
-        data_signals = check_signals( data, components)
+        data = profiled_load_json(filename)
+        with PROFILER.stage('check_signals') :
+            data_signals = check_signals( data, components)
+        PROFILER.count( 'signals_checked', len(data))
         for sig in data_signals :
             if sig in signals :
                 print_ind( f'⚠️ Found repeated signal: {sig}', 1)
@@ -177,9 +198,13 @@ if __name__ == "__main__" :
     print_ind(f'Checking messages...')
     for filename in filenames :
         print_ind(f'Processing file: {filename}')
-        data = load_json_file(filename)
-        check_messages( data, components, problems, signals)
+        data = profiled_load_json(filename)
+        with PROFILER.stage('check_messages') :
+            check_messages( data, components, problems, signals)
+        PROFILER.count( 'messages_checked', len(data))
         for message_key in data :
             if message_key in messages :
                 print_ind( f'⚠️ Found repeated message key: {message_key}', 1)
         messages.update(data)
+    
+    finish_profiling( args, DIR_PROFILES)
@@ -3,12 +3,17 @@
 Compute paths between components
 """
 
+import argparse
 import networkx as nx
 import os
 from abc_project_vars import DIR_DKB
-from utilities_io import load_json_file
-from utilities_io import save_to_json_file
+from abc_project_vars import DIR_PROFILES
 from utilities_printing import print_ind
+from utilities_profiling import PROFILER
+from utilities_profiling import add_profiling_arguments
+from utilities_profiling import finish_profiling
+from utilities_profiling import profiled_load_json
+from utilities_profiling import profiled_save_json
 
 def build_graph( dir_data : str):
     # Load all component files
@@ -23,18 +28,18 @@ def build_graph( dir_data : str):
     # Load all component files
     for filename in component_files:
         data_path = os.path.join( dir_data, filename)
-        data      = load_json_file(data_path)
+        data      = profiled_load_json(data_path)
         for key, value in data.items():
             # Handle references to other files
             if isinstance(value, dict) and 'file' in value:
                 ref_data_path = os.path.join( dir_data, value['file'])
-                ref_data      = load_json_file(ref_data_path)
+                ref_data      = profiled_load_json(ref_data_path)
                 components[key] = ref_data[value['id']]
             else:
                 components[key] = value
 
     # Load connections
-    connections = load_json_file(os.path.join( dir_data, 'connections.json'))
+    connections = profiled_load_json(os.path.join( dir_data, 'connections.json'))
 
     # Create undirected graph
     G = nx.Graph()
@@ -50,6 +55,12 @@ def build_graph( dir_data : str):
     return G, components
 
 def get_path(G, start, end, avoid_edges=None):
+    with PROFILER.stage('shortest_path'):
+        path = find_path(G, start, end, avoid_edges)
+    PROFILER.count('paths_computed' if path else 'paths_not_found')
+    return path
+
+def find_path(G, start, end, avoid_edges=None):
     if avoid_edges:
         # Create a copy of the graph without the edges to avoid
         H = G.copy()
@@ -62,13 +73,16 @@ def get_path(G, start, end, avoid_edges=None):
 
 def compute_paths( dir_data : str):
     
-    G, components = build_graph( dir_data)
+    with PROFILER.stage('build_graph') :
+        G, components = build_graph( dir_data)
+    PROFILER.count( 'graph_nodes', G.number_of_nodes())
+    PROFILER.count( 'graph_edges', G.number_of_edges())
     paths = {}
 
     # Paths from avionics to propulsion components
     paths['board_avionics_to_propulsion'] = {}
     data_json = os.path.join( dir_data, 'components_propulsion.json')
-    propulsion_components = load_json_file(data_json)
+    propulsion_components = profiled_load_json(data_json)
     for component_id, data in components.items():
         if component_id in propulsion_components:
             path = get_path( G, 'board_avionics', component_id)
@@ -78,7 +92,7 @@ def compute_paths( dir_data : str):
     # Paths from avionics to sensors (except antennas)
     paths['board_avionics_to_sensors'] = {}
     data_json = os.path.join( dir_data, 'components_sensors.json')
-    sensors_data = load_json_file(data_json)
+    sensors_data = profiled_load_json(data_json)
     for component_id, data in sensors_data.items():
         if data.get('type') != 'antenna':
             path = get_path( G, 'board_avionics', component_id)
@@ -95,7 +109,7 @@ def compute_paths( dir_data : str):
 
     # Paths from spray_board to spraying components
     data_json = os.path.join( dir_data, 'components_spraying.json')
-    spraying_components = load_json_file(data_json)
+    spraying_components = profiled_load_json(data_json)
     paths['board_spray_to_spraying'] = {}
     # Avoid cable_signal_r when going from cdb to pdb
     avoid_edges = [ ( 'cable_signal_r', 'cdb'),
@@ -108,7 +122,7 @@ def compute_paths( dir_data : str):
     # Paths from avionics to accessories
     paths['board_avionics_to_accessories'] = {}
     data_json = os.path.join( dir_data, 'components_accessories.json')
-    accessories_components = load_json_file(data_json)
+    accessories_components = profiled_load_json(data_json)
     for component_id, data in components.items():
         if component_id in accessories_components:
             path = get_path( G, 'board_avionics', component_id)
@@ -116,12 +130,23 @@ def compute_paths( dir_data : str):
                 paths['board_avionics_to_accessories'][component_id] = path
     
     # Save paths to file
-    save_to_json_file( paths, os.path.join( dir_data, 'paths.json'))
+    profiled_save_json( paths, os.path.join( dir_data, 'paths.json'))
+
+def parse_arguments() -> argparse.Namespace :
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser( description = 'Compute the paths between DK components')
+    add_profiling_arguments(parser)
+    return parser.parse_args()
 
 if __name__ == '__main__':
     
+    args     = parse_arguments()
     dir_data = DIR_DKB
+    PROFILER.configure( 'dkb_compute_paths', args.profile)
     print_ind(f'Computing component paths from: {dir_data}')
     compute_paths(dir_data)
     print_ind( f'Saved component paths to:', 1)
     print_ind( f'{dir_data}/paths.json', 1)
+    finish_profiling( args, DIR_PROFILES)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Headless batch job: links the OCRed screens of the OCR results store to the DKB
+messages they show, and queries the links (screens of a message, message frequencies)
+"""
+
+import argparse
+import re
+from collections import defaultdict
+from dkb_matcher import MIN_MATCH_SCORE
+from dkb_matcher import DomainKnowledgeMatcher
+from dkb_retriever import DomainKnowledgeRetriever
+from utilities_ocr_store import OCR_DB
+from utilities_ocr_store import OcrStore
+from utilities_ocr_store import phrase_query
+from utilities_printing import print_ind
+
+# Shortest OCR line (normalized characters) matched against the message names
+MIN_LINE_CHARS = 8
+# Shortest OCR line relative to the matched name: token set scores reach 100 for lines
+# holding only a few words of a name, which must not count as showing the message
+MIN_LENGTH_RATIO = 0.6
+# Whole numbers of a text: messages often differ only by one (e.g. pump 1 and pump 2)
+NUMBER_PATTERN = re.compile(r'\b\d+\b')
+
+def numbers_agree( line : str, name : str) -> bool :
+    """
+    Check that an OCR line does not contradict the numbers of a message name (lines
+    without numbers, e.g. misread ones, do not contradict any)
+    """
+    line_numbers = set(NUMBER_PATTERN.findall(line))
+    name_numbers = set(NUMBER_PATTERN.findall(name))
+    return not line_numbers or not name_numbers or name_numbers <= line_numbers
+
+def link_exact( store : OcrStore,
+                matcher : DomainKnowledgeMatcher,
+                hashes : set[str]) -> dict :
+    """
+    Link screens whose OCR text holds a message name as a phrase (one full-text query
+    per English and Spanish name).
+    Returns { hash : { message_key : ( language, score, line ) } }
+    """
+    links = defaultdict(dict)
+    for message_key, language, name in zip( matcher.keys, matcher.langs, matcher.names) :
+        for record in store.search(phrase_query(name)) :
+            if record['hash'] in hashes :
+                links[record['hash']][message_key] = ( language, 100.0, name )
+    return links
+
+def link_fuzzy( records : list[dict],
+                matcher : DomainKnowledgeMatcher,
+                min_score : float,
+                links : dict,
+                workers : int = -1) -> None :
+    """
+    Link screens whose OCR lines match a message name with at least min_score (OCR
+    errors and partial names), unless already linked to that message by a better match.
+    Each line links only to its best matches (ties at the top score), whose numbers
+    must agree with the line.
+    """
+    languages = dict( zip( matcher.names, matcher.langs))
+    lines     = [] # ( hash, line )
+    for record in records :
+        for line in record['text'].splitlines() :
+            if len(matcher.normalize(line)) >= MIN_LINE_CHARS :
+                lines.append( ( record['hash'], line.strip()) )
+    matches = matcher.match_batch( [ line for _, line in lines ], limit = 3,
+                                   workers = workers)
+    for ( file_hash, line ), line_matches in zip( lines, matches) :
+        line_chars = len(matcher.normalize(line))
+        candidates = [ ( message_key, name, score ) for message_key, name, score in line_matches
+                       if score >= min_score and numbers_agree( line, name) and
+                          line_chars >= MIN_LENGTH_RATIO * len(matcher.normalize(name)) ]
+        if not candidates :
+            continue
+        best_score = max( score for _, _, score in candidates )
+        for message_key, name, score in candidates :
+            if score < best_score :
+                continue
+            previous = links[file_hash].get(message_key)
+            if previous is None or previous[1] < score :
+                links[file_hash][message_key] = ( languages[name], score, line )
+    return
+
+def link_screens( store : OcrStore,
+                  matcher : DomainKnowledgeMatcher,
+                  min_score : float,
+                  relink : bool = False,
+                  workers : int = -1) -> tuple[ int, int] :
+    """
+    Link the screens not linked yet (all of them with relink) to DKB messages and save
+    the links. Returns the number of screens processed and of links found.
+    """
+    records = store.screens_to_link(relink)
+    if not records :
+        return 0, 0
+    links = link_exact( store, matcher, set( record['hash'] for record in records ))
+    link_fuzzy( records, matcher, min_score, links, workers)
+    store.save_links( { record['hash'] : [ ( key, *link )
+                                           for key, link in links[record['hash']].items() ]
+                        for record in records } )
+    return len(records), sum( len(screen_links) for screen_links in links.values() )
+
+def parse_arguments() -> argparse.Namespace :
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser( description = 'Link OCRed screens to DKB messages')
+    parser.add_argument( '-db', '--database', default = OCR_DB,
+                         help = 'OCR results database')
+    parser.add_argument( '-s', '--min_score', type = float, default = MIN_MATCH_SCORE,
+                         help = 'Lowest fuzzy match score of a link')
+    parser.add_argument( '-r', '--relink', action = 'store_true',
+                         help = 'Link all screens again (e.g. after DKB changes)')
+    parser.add_argument( '-w', '--workers', type = int, default = -1,
+                         help = 'Number of scorer threads (default: all cores)')
+    parser.add_argument( '-m', '--message', default = None,
+                         help = 'Only list the screens linked to a DKB message key')
+    parser.add_argument( '-q', '--query', default = None,
+                         help = 'Only list the screens whose OCR text matches a query')
+    parser.add_argument( '-f', '--frequencies', action = 'store_true',
+                         help = 'Only list the number of screens of each DKB message')
+    return parser.parse_args()
+
+if __name__ == "__main__" :
+
+    args  = parse_arguments()
+    store = OcrStore(args.database)
+
+    if args.message :
+        records = store.screens_for_message(args.message)
+        print_ind(f'Screens linked to {args.message}: {len(records)}')
+        for record in records :
+            print_ind( f"{record['score']:6.1f}  {record['path'] or record['filename']}"
+                       f"  ({record['line']})", 1)
+    elif args.query :
+        records = store.search(phrase_query(args.query))
+        print_ind(f'Screens matching "{args.query}": {len(records)}')
+        for record in records :
+            print_ind( f"{record['path'] or record['filename']}: {record['snippet']!r}", 1)
+    elif args.frequencies :
+        frequencies = store.message_frequencies()
+        print_ind(f'DKB messages linked to screens: {len(frequencies)}')
+        for message_key, count in frequencies.items() :
+            print_ind( f'{count:6d}  {message_key}', 1)
+    else :
+        print_ind('Building DKB match index...')
+        retriever = DomainKnowledgeRetriever()
+        matcher   = DomainKnowledgeMatcher( retriever.data['messages'],
+                                            retriever.data['synonyms'])
+        print_ind(f'Linking screens of: {args.database}')
+        num_screens, num_links = link_screens( store, matcher, args.min_score,
+                                               args.relink, args.workers)
+        print_ind( f'Linked {num_screens} screens: {num_links} links', 1)
+
+    store.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Fuzzy matching of extracted messages against the messages of the DKB
+"""
+
+import numpy as np
+from collections import defaultdict
+from rapidfuzz import process
+from rapidfuzz.fuzz import token_set_ratio
+from re import compile as re_compile
+from re import escape
+from unicodedata import category
+from unicodedata import normalize
+
+# Message name field of each language
+NAME_FIELDS = { 'English' : 'name', 'Spanish' : 'name_spanish' }
+# Lowest score (token set ratio, 0 to 100) of a match taken as the DKB message of a text
+MIN_MATCH_SCORE = 90.0
+# Anything that is not a letter or a digit
+RX_NON_ALNUM = re_compile(r'[^0-9a-z]+')
+
+def normalize_text( text : str) -> str :
+    """
+    Normalize text for matching: no accents, lowercase, alphanumeric tokens only
+    """
+    text = normalize( 'NFKD', str(text))
+    text = ''.join( c for c in text if category(c) != 'Mn' )
+    text = RX_NON_ALNUM.sub( ' ', text.lower())
+    return ' '.join(text.split())
+
+def get_ngrams( text : str, n : int = 3) -> set :
+    """
+    Get the set of character n-grams of the (space-padded) tokens of a text
+    """
+    result = set()
+    for token in text.split() :
+        padded = f' {token} '
+        if len(padded) <= n :
+            result.add(padded)
+        for i in range( len(padded) - n + 1) :
+            result.add( padded[ i : i + n ] )
+    return result
+
+class TextNormalizer :
+    """
+    Normalizes text (see normalize_text) and replaces every synonym phrase by the
+    canonical (first) phrase of its class. Longer phrases take precedence, so that
+    multi-word synonyms like 'delivery pump' are replaced as a whole.
+    """
+
+    def __init__( self, synonyms : list | None = None) -> None :
+        self.canonical = {} # normalized_phrase : normalized_canonical_phrase
+        for synonym_class in ( synonyms or [] ) :
+            phrases = [ normalize_text(phrase) for phrase in synonym_class ]
+            phrases = [ phrase for phrase in phrases if phrase ]
+            if len(phrases) < 2 :
+                continue
+            for phrase in phrases[1:] :
+                if phrase in self.canonical :
+                    print(f"Warning: Synonym '{phrase}' appears in more than one class")
+                self.canonical[phrase] = phrases[0]
+        self.rx_synonyms = None
+        if self.canonical :
+            phrases = sorted( self.canonical, key = lambda p : ( -len(p), p))
+            pattern = '|'.join( escape(phrase) for phrase in phrases )
+            self.rx_synonyms = re_compile( fr'(?<![0-9a-z])(?:{pattern})(?![0-9a-z])')
+        return
+
+    def __call__( self, text : str) -> str :
+        text = normalize_text(text)
+        if self.rx_synonyms :
+            text = self.rx_synonyms.sub( lambda m : self.canonical[m.group(0)], text)
+        return text
+
+class DomainKnowledgeMatcher :
+    """
+    Index of the English and Spanish message names of the DKB.
+    Names are normalized (synonyms included) and split into n-grams once. Queries are
+    scored only against a shortlist of candidates sharing n-grams with them, in batches
+    with a native (multi-threaded) scorer (a single query is a batch of one).
+    """
+
+    def __init__( self,
+                  messages : dict,
+                  synonyms : list | None = None,
+                  shortlist_size : int = 32) -> None :
+        """
+        Build the index from a dict mapping message keys to message dicts and an
+        optional list of synonym classes
+        """
+        self.normalize      = TextNormalizer(synonyms)
+        self.shortlist_size = shortlist_size
+
+        self.keys       = [] # message key of each entry
+        self.langs      = [] # language of each entry
+        self.names      = [] # message name of each entry
+        self.names_norm = [] # normalized message name of each entry
+
+        index = defaultdict(list) # ngram : list_entry_ids
+        sizes = []                # number of ngrams of each entry
+        for message_key, inner_dict in messages.items() :
+            for language, name_field in NAME_FIELDS.items() :
+                name = inner_dict.get(name_field)
+                if not name :
+                    continue
+                entry_id  = len(self.names)
+                name_norm = self.normalize(name)
+                ngrams    = get_ngrams(name_norm)
+                for ngram in ngrams :
+                    index[ngram].append(entry_id)
+                sizes.append(len(ngrams))
+                self.keys.append(message_key)
+                self.langs.append(language)
+                self.names.append(name)
+                self.names_norm.append(name_norm)
+
+        self.index = { ngram : np.array( ids, dtype = np.int32)
+                       for ngram, ids in index.items() }
+        self.sizes = np.array( sizes, dtype = np.float32)
+        self.lang_ids = { language : np.array( [ i for i, lang in enumerate(self.langs)
+                                                 if lang == language ], dtype = np.int32)
+                          for language in NAME_FIELDS }
+        return
+
+    def __len__(self) -> int :
+        return len(self.names)
+
+    def get_names( self, language : str) -> list :
+        """
+        Get the message names of a language
+        """
+        if language not in NAME_FIELDS :
+            raise ValueError( f"Invalid language: {language}")
+        return [ self.names[i] for i in self.lang_ids[language] ]
+
+    def shortlist( self, query_norm : str, language : str | None = None) -> np.ndarray :
+        """
+        Get the ids of the entries sharing the most n-grams with a normalized query
+        (relative to the number of n-grams of both)
+        """
+        ngrams = get_ngrams(query_norm)
+        shared = np.zeros( len(self.names), dtype = np.float32)
+        for ngram in ngrams :
+            ids = self.index.get(ngram)
+            if ids is not None :
+                shared[ids] += 1.0
+        if language :
+            mask = np.zeros( len(self.names), dtype = bool)
+            mask[self.lang_ids[language]] = True
+            shared[~mask] = 0.0
+        num_hits = int(np.count_nonzero(shared))
+        if num_hits == 0 :
+            return np.empty( 0, dtype = np.int32)
+        dice = 2.0 * shared / ( self.sizes + len(ngrams) )
+        size = min( self.shortlist_size, num_hits)
+        return np.sort( np.argpartition( -dice, size - 1)[:size] )
+
+    def match( self,
+               query : str,
+               limit : int = 5,
+               language : str | None = None) -> list[tuple[ str, str, float]] :
+        """
+        Get the best matches of a query as tuples (message_key, message_name, score)
+        """
+        return self.match_batch( [ query ], limit, language, workers = 1)[0]
+
+    def match_batch( self,
+                     queries : list[str],
+                     limit : int = 1,
+                     language : str | None = None,
+                     workers : int = -1) -> list[list[tuple[ str, str, float]]] :
+        """
+        Get the best matches of each query (see match) among its shortlist, scoring all
+        queries at once. Empty or blank queries get no matches, and names scoring 0 are
+        left out.
+        """
+        if not queries :
+            return []
+        # Shortlist each distinct (non-blank) normalized query only once
+        queries_norm = [ self.normalize(q) for q in queries ]
+        unique_norm  = list(dict.fromkeys( q for q in queries_norm if q ))
+        shortlists   = [ self.shortlist( q, language) for q in unique_norm ]
+        entry_ids    = np.unique(np.concatenate( shortlists + [ np.empty( 0, np.int32) ] ))
+        matches      = { query_norm : [] for query_norm in [ '' ] + unique_norm }
+        if len(entry_ids) == 0 :
+            return [ matches[query_norm] for query_norm in queries_norm ]
+        # Score the queries against the union of their shortlists, then leave out the
+        # entries outside the shortlist of each query
+        choices = [ self.names_norm[i] for i in entry_ids ]
+        scores  = process.cdist( unique_norm, choices,
+                                 scorer = token_set_ratio,
+                                 processor = None,
+                                 dtype = np.float32,
+                                 workers = workers )
+        listed  = np.zeros( scores.shape, dtype = bool)
+        for row, candidates in enumerate(shortlists) :
+            listed[ row, np.searchsorted( entry_ids, candidates) ] = True
+        scores[~listed] = -1.0
+        # Keep the top matches of each distinct query (ties broken by entry order)
+        top = np.argsort( -scores, axis = 1, kind = 'stable')[ :, :limit ]
+        for row, query_norm in enumerate(unique_norm) :
+            for j in top[row] :
+                if scores[ row, j ] <= 0 :
+                    break
+                entry_id = int(entry_ids[j])
+                score    = round( float(scores[ row, j ]), 2)
+                matches[query_norm].append( ( self.keys[entry_id],
+                                              self.names[entry_id], score) )
+        return [ matches[query_norm] for query_norm in queries_norm ]
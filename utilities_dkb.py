@@ -3,12 +3,33 @@
 Functions for loading data after expansion
 """
 
+from collections import OrderedDict
 from utilities_io import load_json_files_starting_with
 
+def load_merged_json_files_starting_with( directory : str, prefix : str) -> OrderedDict :
+    """
+    Load all JSON files in a directory starting with a given prefix and merge their
+    top-level dicts into a single dict
+    """
+    result = OrderedDict()
+    for file_contents in load_json_files_starting_with( directory, prefix) :
+        result.update(file_contents)
+    return result
+
+def load_synonyms( directory : str) -> list :
+    """
+    Load the synonym classes (lists of equivalent phrases) of all synonyms files
+    """
+    result = []
+    for file_contents in load_json_files_starting_with( directory, 'synonyms') :
+        result.extend(file_contents)
+    return result
+
 def load_domain_knowledge( directory : str) -> dict :
     result = {}
-    result['messages']   = load_json_files_starting_with( directory, 'messages_')
-    result['diagnoses']  = load_json_files_starting_with( directory, 'diagnoses_')
-    result['components'] = load_json_files_starting_with( directory, 'components_')
-    result['problems']   = load_json_files_starting_with( directory, 'problems_')
+    result['messages']   = load_merged_json_files_starting_with( directory, 'messages_')
+    result['diagnoses']  = load_merged_json_files_starting_with( directory, 'diagnoses_')
+    result['components'] = load_merged_json_files_starting_with( directory, 'components_')
+    result['problems']   = load_merged_json_files_starting_with( directory, 'problems_')
+    result['synonyms']   = load_synonyms(directory)
     return result
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Utilities for loading images for display.
+Stored rotations apply to the pixels as stored in the file (the EXIF orientation is
+ignored), as in the labelers where they were chosen and in the routing of the images.
+"""
+
+import os
+import threading
+from hashlib import file_digest
+from PIL import Image
+from utilities_io import ensure_dir
+from utilities_io import exists_file
+
+# Directory of cached thumbnails
+THUMBNAIL_DIR = os.path.join( os.path.expanduser('~'), '.cache', 'kgraphs', 'thumbnails')
+THUMBNAIL_QUALITY = 90
+# Directory of rotated copies of images exported for processing
+EXPORT_DIR = os.path.join( os.path.expanduser('~'), '.cache', 'kgraphs', 'rotated')
+EXPORT_QUALITY = 95
+
+# Counter-clockwise rotations that can be done with (lossless) transposes
+TRANSPOSES = { 90  : Image.Transpose.ROTATE_90,
+               180 : Image.Transpose.ROTATE_180,
+               270 : Image.Transpose.ROTATE_270 }
+
+# Cache of file hashes: { filepath : ( mtime_ns, size, hash ) }
+hash_cache      = {}
+hash_cache_lock = threading.Lock()
+
+def fit_size( width : int,
+              height : int,
+              max_width : int,
+              max_height : int) -> tuple[ int, int] :
+    """
+    Largest size with the aspect ratio of (width, height) that fits in the bounding box
+    """
+    ratio = width / height
+    # Case 1: Image is wider relative to height
+    if ratio > max_width / max_height :
+        return max_width, max( 1, int( max_width / ratio ))
+    # Case 2: Image is taller relative to width
+    return max( 1, int( max_height * ratio )), max_height
+
+def hash_file( filepath : str) -> str :
+    """
+    SHA-1 of the contents of a file (memoized while its modification time and size
+    remain unchanged)
+    """
+    stat = os.stat(filepath)
+    with hash_cache_lock :
+        cached = hash_cache.get(filepath)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size :
+        return cached[2]
+    with open( filepath, 'rb') as f :
+        digest = file_digest( f, 'sha1').hexdigest()
+    with hash_cache_lock :
+        hash_cache[filepath] = ( stat.st_mtime_ns, stat.st_size, digest )
+    return digest
+
+def rotate_image( image : Image.Image, angle : int) -> Image.Image :
+    """
+    Rotate image counter-clockwise by angle degrees, expanding it to fit.
+    Multiples of 90 degrees use transposes, which are lossless and much faster.
+    """
+    angle = int(angle) % 360
+    if angle == 0 :
+        return image
+    if angle in TRANSPOSES :
+        return image.transpose(TRANSPOSES[angle])
+    return image.rotate( angle, expand = True)
+
+def rotate_to_fit( image : Image.Image,
+                   angle : int,
+                   max_size : tuple[ int, int]) -> Image.Image :
+    """
+    Rotate a display buffer counter-clockwise by angle degrees and, only if the result
+    no longer fits in max_size, downscale it. Always rotate the same (unrotated) buffer
+    so that repeated rotations do not accumulate resampling losses.
+    """
+    image = rotate_image( image, angle)
+    if image.width <= max_size[0] and image.height <= max_size[1] :
+        return image
+    new_size = fit_size( image.width, image.height, *max_size)
+    return image.resize( new_size, Image.Resampling.LANCZOS)
+
+def save_image_atomically( image : Image.Image, filepath : str, **params) -> None :
+    """
+    Save image as JPEG via a temporary file, as several threads may save the same file
+    """
+    tmp_path = f'{filepath}.{os.getpid()}.{threading.get_ident()}.tmp'
+    image.save( tmp_path, 'JPEG', **params)
+    os.replace( tmp_path, filepath)
+    return
+
+def export_rotated_image( filepath : str,
+                          rotation : int,
+                          export_dir : str = EXPORT_DIR) -> str :
+    """
+    Get the path of a copy of an image rotated counter-clockwise by the given angle.
+    The full resolution image is rotated only
+    once per rotation: copies are kept on disk keyed by the hash of the file.
+    Returns the original path when there is nothing to rotate.
+    """
+    rotation = int(rotation) % 360
+    if rotation == 0 :
+        return filepath
+    export_path = os.path.join( export_dir, f'{hash_file(filepath)}_r{rotation}.jpg')
+    if not exists_file(export_path) :
+        ensure_dir(export_dir)
+        with Image.open(filepath) as image :
+            image = rotate_image( image, rotation)
+            save_image_atomically( image.convert('RGB'), export_path,
+                                   quality = EXPORT_QUALITY)
+    return export_path
+
+def load_image_for_display( filepath : str,
+                            max_size : tuple[ int, int] = ( 800, 600),
+                            rotation : int = 0,
+                            cache_dir : str | None = THUMBNAIL_DIR) -> Image.Image :
+    """
+    Load an image downscaled to fit in max_size, applying the stored (counter-clockwise)
+    rotation.
+    JPEGs are decoded in draft mode, i.e. DCT-scaled to the smallest size that is still
+    larger than needed. Thumbnails are cached on disk keyed by the hash of the file.
+    """
+    rotation = int(rotation) % 360
+    max_width, max_height = max_size
+
+    # Return cached thumbnail if available
+    cache_path = None
+    if cache_dir :
+        cache_name = f'{hash_file(filepath)}_{max_width}x{max_height}_r{rotation}.jpg'
+        cache_path = os.path.join( cache_dir, cache_name)
+        if exists_file(cache_path) :
+            try :
+                image = Image.open(cache_path)
+                image.load()
+                return image
+            except OSError as e :
+                print(f"Error loading thumbnail {cache_path}: {e}")
+
+    with Image.open(filepath) as image :
+        # Displayed size, taking into account the rotation
+        swap = rotation in ( 90, 270)
+        width, height = ( image.height, image.width ) if swap else image.size
+        new_size      = fit_size( width, height, max_width, max_height)
+        # Decode at reduced resolution (in the axes of the stored image)
+        image.draft( 'RGB', new_size[::-1] if swap else new_size)
+        image = rotate_image( image, rotation)
+        image = image.convert('RGB').resize( new_size, Image.Resampling.LANCZOS)
+
+    # Save thumbnail
+    if cache_path :
+        try :
+            ensure_dir(cache_dir)
+            save_image_atomically( image, cache_path, quality = THUMBNAIL_QUALITY)
+        except OSError as e :
+            print(f"Error saving thumbnail {cache_path}: {e}")
+
+    return image
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Label dataset: all label CSV files as one typed columnar table
+"""
+
+import csv
+import os
+import sys
+import numpy as np
+import pandas as pd
+from glob import glob
+from utilities_printing import print_sep
+
+# Columns of the label table: one row per (label file, image)
+COLUMNS = [ 'source', 'filename', 'rotation', 'group_a', 'group_b', 'group_c' ]
+# Group C holds any number of labels, stored as a single comma-separated string
+GROUP_C_SEP = ','
+# Columns of a label CSV row besides its group C labels (filename, rotation, A, B)
+NUM_FIXED_COLUMNS = 4
+
+def get_source( csv_path : str) -> str :
+    """
+    Name of a label file without directory, 'labels_' prefix and extension
+    (e.g. 'DAL_rc_t40_t50' for labels_DAL_rc_t40_t50.csv)
+    """
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return name.removeprefix('labels_')
+
+def make_table( data : dict) -> pd.DataFrame :
+    """
+    Build a label table with the column order and types of COLUMNS
+    """
+    df = pd.DataFrame(data)[COLUMNS]
+    df['rotation'] = df['rotation'].astype(np.int16)
+    for column in ( 'source', 'group_a', 'group_b' ) :
+        df[column] = df[column].astype('category')
+    return df.reset_index( drop = True)
+
+def count_csv_columns( csv_path : str) -> int :
+    """
+    Number of columns of the widest row of a CSV file
+    """
+    with open( csv_path, 'r', newline = '', encoding = 'utf-8') as f :
+        return max( ( len(row) for row in csv.reader(f) ), default = 0)
+
+def read_label_csv( csv_path : str, source : str | None = None) -> pd.DataFrame :
+    """
+    Read a label CSV file (rows: filename, rotation, group A, group B, group C labels...)
+    into a label table. Rows may have any number of columns; missing values are empty.
+    """
+    num_columns = max( count_csv_columns(csv_path), NUM_FIXED_COLUMNS + 1)
+    raw = pd.read_csv( csv_path, header = None, names = range(num_columns),
+                       dtype = str, keep_default_na = False, skip_blank_lines = True,
+                       engine = 'c')
+    # Group C: all columns after group B, without empty labels
+    group_c = raw[NUM_FIXED_COLUMNS].str.cat( [ raw[i] for i in range( NUM_FIXED_COLUMNS + 1,
+                                                                         num_columns) ],
+                                              sep = GROUP_C_SEP)
+    group_c = group_c.str.replace( r',{2,}', GROUP_C_SEP, regex = True) \
+                     .str.strip(GROUP_C_SEP)
+    rotation = pd.to_numeric( raw[1], errors = 'coerce').fillna(0).astype(np.int64) % 360
+    return make_table( { 'source'   : source or get_source(csv_path),
+                         'filename' : raw[0].str.strip(),
+                         'rotation' : rotation,
+                         'group_a'  : raw[2].str.strip(),
+                         'group_b'  : raw[3].str.strip(),
+                         'group_c'  : group_c } )
+
+def load_label_files( directory : str, pattern : str = 'labels_*.csv') -> pd.DataFrame :
+    """
+    Read all label CSV files of a directory into a single label table
+    """
+    csv_paths = sorted(glob(os.path.join( directory, pattern)))
+    if not csv_paths :
+        return make_table( { column : [] for column in COLUMNS } | { 'rotation' : [] } )
+    tables = [ read_label_csv(csv_path) for csv_path in csv_paths ]
+    df = pd.concat( tables, ignore_index = True)
+    return make_table(df.astype( { 'source' : str, 'group_a' : str, 'group_b' : str } ))
+
+def write_label_csv( df : pd.DataFrame, csv_path : str, pad : bool = False) -> None :
+    """
+    Write a label table in the label CSV format (group C labels in separate columns,
+    at least one). Fields holding commas or quotes are quoted. With pad, all rows have
+    as many columns as the widest one.
+    """
+    rows = [ [ filename, rotation, group_a, group_b, *group_c.split(GROUP_C_SEP) ]
+             for filename, rotation, group_a, group_b, group_c
+             in zip( df['filename'], df['rotation'].astype(str), df['group_a'].astype(str),
+                     df['group_b'].astype(str), df['group_c'] ) ]
+    if pad and rows :
+        num_columns = max( len(row) for row in rows )
+        rows        = [ row + [ '' ] * ( num_columns - len(row) ) for row in rows ]
+    with open( csv_path, 'w', newline = '', encoding = 'utf-8') as f :
+        writer = csv.writer( f, quoting = csv.QUOTE_MINIMAL, lineterminator = '\n')
+        writer.writerows(rows)
+    return
+
+def save_dataset( df : pd.DataFrame, filepath : str) -> None :
+    """
+    Save a label table in binary form (keeps column types, loads much faster than CSV)
+    """
+    df.to_pickle(filepath)
+    return
+
+def load_dataset( filepath : str) -> pd.DataFrame :
+    """
+    Load a label table saved with save_dataset
+    """
+    return pd.read_pickle(filepath)
+
+def has_label( df : pd.DataFrame, label : str) -> pd.Series :
+    """
+    Mask of the rows carrying a label in any group
+    """
+    in_group_c = ( GROUP_C_SEP + df['group_c'] + GROUP_C_SEP ) \
+                 .str.contains( GROUP_C_SEP + label + GROUP_C_SEP, regex = False)
+    return ( df['group_a'] == label ) | ( df['group_b'] == label ) | in_group_c
+
+def filter_labels( df : pd.DataFrame,
+                   source : str | None = None,
+                   group_a : str | None = None,
+                   group_b : str | list | None = None,
+                   labels : list | None = None) -> pd.DataFrame :
+    """
+    Rows of a label table matching all given conditions: label file, group A label,
+    group B label (or any of a list of them) and labels (in any group)
+    """
+    mask = pd.Series( True, index = df.index)
+    if source is not None :
+        mask &= df['source'] == source
+    if group_a is not None :
+        mask &= df['group_a'] == group_a
+    if group_b is not None :
+        group_b = [ group_b ] if isinstance( group_b, str) else group_b
+        mask &= df['group_b'].isin(group_b)
+    for label in ( labels or [] ) :
+        mask &= has_label( df, label)
+    return df[mask]
+
+def index_by_filename( df : pd.DataFrame) -> pd.DataFrame :
+    """
+    Label table indexed by filename (the last row of each filename wins)
+    """
+    return df.drop_duplicates( 'filename', keep = 'last').set_index('filename')
+
+def join_labels( left : pd.DataFrame,
+                 right : pd.DataFrame,
+                 how : str = 'inner',
+                 suffixes : tuple[ str, str] = ( '_left', '_right')) -> pd.DataFrame :
+    """
+    Join two label tables on filename (e.g. a master label file with a subset file)
+    """
+    return index_by_filename(left).join( index_by_filename(right), how = how,
+                                         lsuffix = suffixes[0], rsuffix = suffixes[1])
+
+def count_labels( df : pd.DataFrame, by : str | list = 'source') -> pd.DataFrame :
+    """
+    Number of rows per group A and group B label (columns) for each value of by (rows)
+    """
+    labels = df['group_a'].astype(str).str.cat( df['group_b'].astype(str), sep = ' ')
+    labels = labels.str.strip().replace( '', '(empty)')
+    by     = [ by ] if isinstance( by, str) else by
+    return pd.crosstab( [ df[column] for column in by ], labels)
+
+if __name__ == "__main__" :
+    # Report label counts of all label files of a directory (current one by default)
+    directory = os.getcwd() if len(sys.argv) < 2 else sys.argv[1]
+    df = load_label_files(directory)
+    print_sep()
+    print(f"Label files in: {directory}")
+    print_sep()
+    with pd.option_context( 'display.max_rows', None, 'display.max_columns', None,
+                            'display.width', 200) :
+        print(count_labels(df))
+    print_sep()
+    print(f"Total rows: {len(df)}    Distinct images: {df['filename'].nunique()}")
+    print_sep()
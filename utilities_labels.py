@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Label store: label CSV files with an in-memory index keyed by filename
+"""
+
+import csv
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from io import StringIO
+from json import JSONDecodeError
+from json import dumps
+from utilities_io import exists_file
+from utilities_io import load_json_file
+
+# Suffixes of the journal, state and temporary files kept next to each label CSV file
+JOURNAL_SUFFIX = '.journal'
+STATE_SUFFIX   = '.state'
+TMP_SUFFIX     = '.tmp'
+
+# Image file extensions (lowercase)
+IMAGE_FORMATS = ( 'png', 'jpg', 'jpeg')
+
+def list_images( image_dir : str) -> list[str] :
+    """
+    Sorted list of the image files of a directory (single directory scan)
+    """
+    with os.scandir(image_dir) as entries :
+        return sorted( entry.name for entry in entries
+                       if entry.name.lower().endswith(IMAGE_FORMATS) and entry.is_file() )
+
+def fsync_dir( dirpath : str) -> None :
+    """
+    Flush a directory entry to disk (so that a rename survives a crash)
+    """
+    try :
+        fd = os.open( dirpath or '.', os.O_RDONLY)
+    except OSError :
+        return
+    try :
+        os.fsync(fd)
+    except OSError :
+        pass
+    finally :
+        os.close(fd)
+    return
+
+def save_bytes_atomically( data : bytes, filepath : str) -> None :
+    """
+    Write a file via a temporary file, fsync and rename, so that the file is either the
+    old or the new version even if the process or machine crashes
+    """
+    tmp_file = filepath + TMP_SUFFIX
+    with open( tmp_file, 'wb') as f :
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace( tmp_file, filepath)
+    fsync_dir(os.path.dirname(filepath))
+    return
+
+def save_rows_to_csv_atomically( rows : list[list[str]], csv_file : str) -> str :
+    """
+    Write rows to a CSV file atomically (see save_bytes_atomically).
+    Returns the checksum (SHA-1) of the file contents.
+    """
+    buffer = StringIO()
+    csv.writer( buffer, lineterminator = '\n').writerows(rows)
+    data = buffer.getvalue().encode('utf-8')
+    save_bytes_atomically( data, csv_file)
+    return sha1(data).hexdigest()
+
+def read_journal( journal_file : str) -> list[list[str]] :
+    """
+    Read the records of a journal file, dropping a last record torn by a crash
+    (i.e. one without its line terminator)
+    """
+    with open( journal_file, 'r', newline = '') as f :
+        text = f.read()
+    if text and not text.endswith('\n') :
+        print(f"Warning: Dropping incomplete last record of {journal_file}")
+        text = text[ : text.rfind('\n') + 1 ]
+    return [ row for row in csv.reader(text.splitlines()) if row ]
+
+class LabelStore :
+    """
+    Label CSV file (rows: filename, rotation, group labels...) held in memory as an
+    ordered dict mapping filenames to the rest of their row.
+    Updates are coalesced in memory and flushed in batches (see flush) to a write-ahead
+    journal, so that their cost does not depend on the number of rows. The journal is
+    compacted back into the CSV file (atomically) every compact_every records and upon
+    closing. Upon opening, a journal left behind by a crash is replayed.
+    A state file keeps the checksum of the CSV file as last written by the store (so
+    that callers can skip format checks when it was not modified by anything else) and
+    a cursor (e.g. the last image on display).
+    """
+
+    def __init__( self,
+                  csv_file : str,
+                  move_on_update : bool = False,
+                  compact_every : int = 500) -> None :
+        """
+        Load a label CSV file and recover the updates of its journal (if any). With
+        move_on_update, updated rows are moved to the end (i.e. the last row is the last
+        labeled image).
+        """
+        self.csv_file       = csv_file
+        self.journal_file   = csv_file + JOURNAL_SUFFIX
+        self.move_on_update = move_on_update
+        self.compact_every  = compact_every
+        self.rows           = OrderedDict() # filename : [ rotation, group_a, ... ]
+        self.pending        = OrderedDict() # filename : values (not yet journaled)
+        self.num_journaled  = 0
+        self.state_file     = csv_file + STATE_SUFFIX
+        self.checksum       = None  # checksum of the CSV file as last written
+        self.cursor         = None
+        self.saved_cursor   = None
+        self.verified       = False # CSV file unchanged since last written by the store
+
+        # A temporary file is left behind only by an interrupted compaction
+        for tmp_file in ( self.csv_file + TMP_SUFFIX, self.state_file + TMP_SUFFIX) :
+            if exists_file(tmp_file) :
+                os.remove(tmp_file)
+        if exists_file(self.state_file) :
+            try :
+                state = load_json_file(self.state_file)
+                self.checksum     = state.get('checksum')
+                self.cursor       = state.get('cursor')
+                self.saved_cursor = self.cursor
+            except ( OSError, JSONDecodeError) as e :
+                print(f"Error loading label store state {self.state_file}: {e}")
+        if exists_file(self.csv_file) :
+            # Read the file once for both the checksum and the rows
+            with open( self.csv_file, 'rb') as f :
+                data = f.read()
+            self.verified = sha1(data).hexdigest() == self.checksum
+            for row in csv.reader(StringIO(data.decode('utf-8'), newline = '')) :
+                if row :
+                    self.rows[row[0]] = row[1:]
+        self.journal = None
+        if exists_file(self.journal_file) :
+            records = read_journal(self.journal_file)
+            for row in records :
+                self.apply( row[0], row[1:])
+            # Make the recovered updates durable in the CSV file right away
+            if records :
+                print(f"Recovered {len(records)} label updates from {self.journal_file}")
+                self.num_journaled = len(records)
+                self.compact()
+        self.journal = open( self.journal_file, 'w', newline = '')
+        self.journal_writer = csv.writer( self.journal, lineterminator = '\n')
+        return
+
+    def __contains__( self, filename : str) -> bool :
+        return filename in self.rows
+
+    def __len__(self) -> int :
+        return len(self.rows)
+
+    def filenames(self) -> list[str] :
+        """
+        Get the filenames in row order
+        """
+        return list(self.rows)
+
+    def get( self, filename : str) -> list[str] | None :
+        """
+        Get a copy of the row of a filename (without the filename) or None
+        """
+        values = self.rows.get(filename)
+        return list(values) if values is not None else None
+
+    def last(self) -> str | None :
+        """
+        Get the filename of the last row
+        """
+        return next( reversed(self.rows), None)
+
+    def apply( self, filename : str, values : list[str]) -> None :
+        """
+        Update the row of a filename in memory
+        """
+        self.rows[filename] = list(values)
+        if self.move_on_update :
+            self.rows.move_to_end(filename)
+        return
+
+    def set( self, filename : str, values : list[str]) -> None :
+        """
+        Update (or add) the row of a filename. The update is journaled by the next flush;
+        repeated updates of the same row in between are coalesced into one record.
+        """
+        values = [ str(v) for v in values ]
+        self.apply( filename, values)
+        self.pending[filename] = values
+        self.pending.move_to_end(filename)
+        return
+
+    def replace_all( self, rows : dict) -> None :
+        """
+        Replace all rows (e.g. after repairing their format) and write them to the CSV file
+        """
+        self.rows = OrderedDict( ( filename, list(values) )
+                                 for filename, values in rows.items() )
+        self.pending.clear()
+        self.compact()
+        self.verified = True
+        return
+
+    def flush(self) -> None :
+        """
+        Append the pending updates to the journal with a single write and fsync, and
+        compact the journal if it has grown long enough
+        """
+        if not self.pending :
+            if self.cursor != self.saved_cursor :
+                self.save_state()
+            return
+        self.journal_writer.writerows( [ filename ] + values
+                                       for filename, values in self.pending.items() )
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.num_journaled += len(self.pending)
+        self.pending.clear()
+        if self.num_journaled >= self.compact_every :
+            self.compact()
+        elif self.cursor != self.saved_cursor :
+            self.save_state()
+        return
+
+    def compact(self) -> None :
+        """
+        Write all rows to the CSV file atomically and truncate the journal
+        """
+        self.checksum = save_rows_to_csv_atomically( ( [ filename ] + values
+                                                       for filename, values
+                                                       in self.rows.items() ),
+                                                     self.csv_file)
+        self.save_state()
+        if self.journal :
+            self.journal.truncate(0)
+            self.journal.seek(0)
+            os.fsync(self.journal.fileno())
+        self.num_journaled = 0
+        return
+
+    def save_state(self) -> None :
+        """
+        Save the checksum of the CSV file and the cursor to the state file
+        """
+        state = { 'checksum' : self.checksum, 'cursor' : self.cursor }
+        save_bytes_atomically( dumps( state, indent = 4).encode('utf-8'), self.state_file)
+        self.saved_cursor = self.cursor
+        return
+
+    def close(self) -> None :
+        """
+        Flush pending updates, compact the journal into the CSV file and remove it
+        """
+        if self.journal.closed :
+            return
+        self.flush()
+        if self.num_journaled :
+            self.compact()
+        self.journal.close()
+        if exists_file(self.journal_file) :
+            os.remove(self.journal_file)
+        return
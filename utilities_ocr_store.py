@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+OCR results store: SQLite database of the OCR of images keyed by the hash of their
+contents, written by the error screen selector and queried by the labelers and the
+evaluators (so that no image is OCRed twice), with a full-text index of the OCR text
+and the links of screens to DKB message keys
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from json import dumps
+from json import loads
+from utilities_images import hash_file
+from utilities_io import ensure_dir
+
+# Default database file
+OCR_DB = os.path.join( os.path.expanduser('~'), '.cache', 'kgraphs', 'ocr_results.sqlite')
+
+# Columns of the results table (timings, scores and thresholds are JSON objects)
+COLUMNS = [ 'hash', 'filename', 'path', 'size', 'mtime_ns', 'status', 'rejected_by',
+            'rotation', 'text', 'text_length', 'is_screen', 'timings', 'scores',
+            'processed_at', 'duplicate_of', 'thresholds' ]
+JSON_COLUMNS = ( 'timings', 'scores', 'thresholds')
+# Columns added after the first release of the table (added to older databases)
+ADDED_COLUMNS = [ 'duplicate_of', 'thresholds' ]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_results (
+    hash         TEXT PRIMARY KEY,  -- SHA-1 of the file contents
+    filename     TEXT NOT NULL,
+    path         TEXT,
+    size         INTEGER,
+    mtime_ns     INTEGER,
+    status       TEXT NOT NULL,     -- ocr, rejected, skipped, error, timeout, crashed, imported,
+                                    -- duplicate
+    rejected_by  TEXT,              -- prefilter stage that rejected the image
+    rotation     INTEGER,           -- counter-clockwise rotation making the text upright
+    text         TEXT,
+    text_length  INTEGER,
+    is_screen    INTEGER,           -- 1 if enough text was found
+    timings      TEXT,              -- { stage : milliseconds }
+    scores       TEXT,              -- { prefilter feature : value }
+    processed_at REAL,
+    duplicate_of TEXT,              -- filename of the screen it duplicates (confirmed by text)
+    thresholds   TEXT               -- { prefilter stage : [ low, high ] } a rejection was made under
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_results_path     ON ocr_results (path);
+CREATE INDEX IF NOT EXISTS idx_ocr_results_filename ON ocr_results (filename);
+CREATE INDEX IF NOT EXISTS idx_ocr_results_screen   ON ocr_results (is_screen, status);
+
+-- Full-text index of the OCR text (kept in sync by triggers); accents are ignored
+CREATE VIRTUAL TABLE IF NOT EXISTS ocr_fts USING fts5 (
+    text, content = 'ocr_results', content_rowid = 'rowid',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS ocr_results_ai AFTER INSERT ON ocr_results BEGIN
+    INSERT INTO ocr_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS ocr_results_ad AFTER DELETE ON ocr_results BEGIN
+    INSERT INTO ocr_fts (ocr_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS ocr_results_au AFTER UPDATE ON ocr_results BEGIN
+    INSERT INTO ocr_fts (ocr_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    INSERT INTO ocr_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+
+-- Candidate DKB messages shown by each screen (see dkb_link_screens)
+CREATE TABLE IF NOT EXISTS message_links (
+    hash         TEXT NOT NULL,
+    message_key  TEXT NOT NULL,
+    language     TEXT,
+    score        REAL,              -- 100 for exact phrase matches
+    line         TEXT,              -- OCR text that matched
+    PRIMARY KEY (hash, message_key)
+);
+CREATE INDEX IF NOT EXISTS idx_message_links_key ON message_links (message_key, score);
+-- Screens already processed by the linking job (with or without links)
+CREATE TABLE IF NOT EXISTS linked_screens (
+    hash         TEXT PRIMARY KEY,
+    linked_at    REAL
+);
+"""
+
+def phrase_query( text : str) -> str :
+    """
+    Full-text query matching text as a phrase (its words in sequence, regardless of
+    case, accents and punctuation)
+    """
+    return '"' + text.replace( '"', '""') + '"'
+
+def row_to_record( row : sqlite3.Row | None) -> dict | None :
+    """
+    Record (dict) of a table row, with its JSON columns decoded
+    """
+    if row is None :
+        return None
+    record = dict(row)
+    for column in JSON_COLUMNS :
+        record[column] = loads(record[column]) if record[column] else {}
+    return record
+
+def confirmed_duplicates( a : dict | None, b : dict | None) -> bool :
+    """
+    Check whether the records of two images show the same screen: one was confirmed as
+    a near-duplicate of the other, or both of the same screen
+    """
+    if not a or not b :
+        return False
+    return a['duplicate_of'] == b['filename'] or b['duplicate_of'] == a['filename'] or \
+           ( a['duplicate_of'] is not None and a['duplicate_of'] == b['duplicate_of'] )
+
+class OcrStore :
+    """
+    OCR results database. Records are added in batches (see flush): a single writer
+    (e.g. the parent of a worker pool) commits one transaction per batch. Lookups may
+    come from several threads.
+    """
+
+    def __init__( self,
+                  db_file : str = OCR_DB,
+                  batch_size : int = 100,
+                  flush_interval : float = 5.0) -> None :
+        ensure_dir(os.path.dirname(db_file))
+        self.db_file        = db_file
+        self.batch_size     = batch_size
+        self.flush_interval = flush_interval
+        self.pending        = []
+        self.last_flush     = time.monotonic()
+        self.lock           = threading.Lock()
+        self.conn           = sqlite3.connect( db_file, check_same_thread = False)
+        self.conn.row_factory = sqlite3.Row
+        # Write-ahead log: readers (e.g. the labelers) are not blocked by the writer
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        # Replaced rows must fire the delete trigger that updates the full-text index
+        self.conn.execute('PRAGMA recursive_triggers = ON')
+        has_fts = self.conn.execute( "SELECT 1 FROM sqlite_master WHERE name = 'ocr_fts'"
+                                   ).fetchone() is not None
+        self.conn.executescript(SCHEMA)
+        columns = [ row[1] for row in self.conn.execute('PRAGMA table_info(ocr_results)') ]
+        for column in ADDED_COLUMNS :
+            if column not in columns :
+                # Databases created before the column
+                with self.conn :
+                    self.conn.execute(f'ALTER TABLE ocr_results ADD COLUMN {column} TEXT')
+        if not has_fts :
+            # Index the text of databases created before the full-text index
+            with self.conn :
+                self.conn.execute("INSERT INTO ocr_fts (ocr_fts) VALUES ('rebuild')")
+        return
+
+    @classmethod
+    def open_if_exists( cls, db_file : str = OCR_DB) -> 'OcrStore | None' :
+        """
+        Open the database for lookups, or None if it has not been created yet
+        """
+        if not os.path.exists(db_file) :
+            return None
+        try :
+            return cls(db_file)
+        except sqlite3.Error as e :
+            print(f"Error opening OCR results database {db_file}: {e}")
+            return None
+
+    def __len__(self) -> int :
+        with self.lock :
+            return self.conn.execute('SELECT COUNT(*) FROM ocr_results').fetchone()[0]
+
+    def add( self, record : dict) -> None :
+        """
+        Add (or replace) the record of an image. Records are written by the next flush,
+        which happens automatically every batch_size records or flush_interval seconds.
+        """
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size or \
+           time.monotonic() - self.last_flush > self.flush_interval :
+            self.flush()
+        return
+
+    def flush(self) -> None :
+        """
+        Write the pending records in a single transaction
+        """
+        self.last_flush = time.monotonic()
+        if not self.pending :
+            return
+        rows = []
+        for record in self.pending :
+            record = { 'processed_at' : time.time() } | record
+            for column in JSON_COLUMNS :
+                record[column] = dumps(record.get(column) or {})
+            rows.append( [ record.get(column) for column in COLUMNS ] )
+        placeholders = ', '.join( '?' for _ in COLUMNS )
+        with self.lock, self.conn :
+            self.conn.executemany( f'INSERT OR REPLACE INTO ocr_results ({", ".join(COLUMNS)}) '
+                                   f'VALUES ({placeholders})', rows)
+        self.pending = []
+        return
+
+    def signatures(self) -> dict :
+        """
+        Get { path : ( size, mtime_ns, hash ) } of all records, to tell unchanged files
+        without hashing them
+        """
+        with self.lock :
+            rows = self.conn.execute('SELECT path, size, mtime_ns, hash FROM ocr_results '
+                                     'WHERE path IS NOT NULL').fetchall()
+        return { path : ( size, mtime_ns, file_hash ) for path, size, mtime_ns, file_hash in rows }
+
+    def hashes( self, exclude_status : tuple[str, ...] = ()) -> set[str] :
+        """
+        Get the hashes of all images with a record (except records with the given status)
+        """
+        placeholders = ', '.join( '?' for _ in exclude_status )
+        with self.lock :
+            rows = self.conn.execute( f'SELECT hash FROM ocr_results '
+                                      f'WHERE status NOT IN ({placeholders})',
+                                      exclude_status)
+            return set( row[0] for row in rows )
+
+    def stale_rejections( self, thresholds : dict) -> set[str] :
+        """
+        Get the hashes of the images rejected by the prefilter under thresholds other than
+        the given ones (e.g. before a tuning run), to be processed again
+        """
+        thresholds = loads(dumps(thresholds))
+        with self.lock :
+            rows = self.conn.execute( "SELECT hash, thresholds FROM ocr_results "
+                                      "WHERE status = 'rejected'").fetchall()
+        return set( file_hash for file_hash, used in rows
+                    if ( loads(used) if used else {} ) != thresholds )
+
+    def get_by_hash( self, file_hash : str) -> dict | None :
+        """
+        Get the record of an image by the hash of its contents
+        """
+        with self.lock :
+            row = self.conn.execute( 'SELECT * FROM ocr_results WHERE hash = ?',
+                                     ( file_hash, )).fetchone()
+        return row_to_record(row)
+
+    def get_by_filename( self, filename : str) -> list[dict] :
+        """
+        Get the records of the images with a filename (in any directory)
+        """
+        with self.lock :
+            rows = self.conn.execute( 'SELECT * FROM ocr_results WHERE filename = ?',
+                                      ( filename, )).fetchall()
+        return [ row_to_record(row) for row in rows ]
+
+    def lookup( self, filepath : str) -> dict | None :
+        """
+        Get the record of an image file (found by the hash of its contents, so copies
+        and renamed files are found too)
+        """
+        try :
+            return self.get_by_hash(hash_file(filepath))
+        except OSError :
+            return None
+
+    def screens(self) -> list[dict] :
+        """
+        Get the records of the images where enough text was found (near-duplicates of
+        other screens left out)
+        """
+        with self.lock :
+            rows = self.conn.execute( 'SELECT * FROM ocr_results WHERE is_screen = 1 '
+                                      "AND status != 'duplicate' "
+                                      'ORDER BY filename').fetchall()
+        return [ row_to_record(row) for row in rows ]
+
+    def count_by( self, column : str = 'status') -> dict :
+        """
+        Number of records per value of a column (e.g. status, rejected_by)
+        """
+        if column not in COLUMNS :
+            raise ValueError(f"Unknown column: {column}")
+        with self.lock :
+            rows = self.conn.execute( f'SELECT {column}, COUNT(*) FROM ocr_results '
+                                      f'WHERE {column} IS NOT NULL '
+                                      f'GROUP BY {column} ORDER BY {column}').fetchall()
+        return dict(rows)
+
+    def search( self, query : str, limit : int | None = None) -> list[dict] :
+        """
+        Get the records whose OCR text matches a full-text query (FTS5 syntax, see
+        phrase_query), best matches first, with a snippet of the matching text
+        """
+        sql = 'SELECT r.*, snippet( ocr_fts, 0, \'[\', \']\', \'...\', 12) AS snippet ' \
+              'FROM ocr_fts JOIN ocr_results r ON r.rowid = ocr_fts.rowid ' \
+              'WHERE ocr_fts MATCH ? ORDER BY rank'
+        params = [ query ]
+        if limit :
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self.lock :
+            rows = self.conn.execute( sql, params).fetchall()
+        return [ row_to_record(row) for row in rows ]
+
+    def screens_to_link( self, relink : bool = False) -> list[dict] :
+        """
+        Get the records of the OCRed images with text (confirmed near-duplicates included,
+        see select_error_screens) not yet processed by the linking job (all of them with
+        relink)
+        """
+        sql = "SELECT * FROM ocr_results WHERE status IN ( 'ocr', 'duplicate') AND text != ''"
+        if not relink :
+            sql += ' AND hash NOT IN ( SELECT hash FROM linked_screens )'
+        with self.lock :
+            rows = self.conn.execute(sql).fetchall()
+        return [ row_to_record(row) for row in rows ]
+
+    def save_links( self, links : dict) -> None :
+        """
+        Replace the message links of screens in a single transaction.
+        links: { hash : [ ( message_key, language, score, line ), ... ] }
+        """
+        now = time.time()
+        with self.lock, self.conn :
+            self.conn.executemany( 'DELETE FROM message_links WHERE hash = ?',
+                                   ( ( file_hash, ) for file_hash in links ))
+            self.conn.executemany( 'INSERT INTO message_links '
+                                   '( hash, message_key, language, score, line) '
+                                   'VALUES ( ?, ?, ?, ?, ?)',
+                                   ( ( file_hash, *link ) for file_hash, screen_links
+                                     in links.items() for link in screen_links ))
+            self.conn.executemany( 'INSERT OR REPLACE INTO linked_screens VALUES ( ?, ?)',
+                                   ( ( file_hash, now ) for file_hash in links ))
+        return
+
+    def screens_for_message( self, message_key : str, min_score : float = 0.0) -> list[dict] :
+        """
+        Get the records of the screens linked to a DKB message, best links first
+        """
+        with self.lock :
+            rows = self.conn.execute( 'SELECT r.*, l.language, l.score, l.line '
+                                      'FROM message_links l '
+                                      'JOIN ocr_results r ON r.hash = l.hash '
+                                      'WHERE l.message_key = ? AND l.score >= ? '
+                                      'ORDER BY l.score DESC, r.filename',
+                                      ( message_key, min_score)).fetchall()
+        return [ row_to_record(row) for row in rows ]
+
+    def message_frequencies( self, min_score : float = 0.0) -> dict :
+        """
+        Number of distinct screens linked to each DKB message (most frequent first; near-
+        duplicates of a screen are not counted again)
+        """
+        with self.lock :
+            rows = self.conn.execute( 'SELECT l.message_key, COUNT(*) AS n FROM message_links l '
+                                      'JOIN ocr_results r ON r.hash = l.hash '
+                                      "WHERE l.score >= ? AND r.status != 'duplicate' "
+                                      'GROUP BY l.message_key '
+                                      'ORDER BY n DESC, l.message_key',
+                                      ( min_score, )).fetchall()
+        return dict(rows)
+
+    def close(self) -> None :
+        """
+        Write pending records and close the database
+        """
+        self.flush()
+        self.conn.close()
+        return
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Perceptual hashes (pHash, dHash) of images and clustering of near-duplicates (e.g. the
+same screen photographed several times). Clusters are candidates only: different
+messages on one screen layout hash alike, so results are shared within a cluster once
+confirmed (e.g. by the OCR text, see select_error_screens.py)
+"""
+
+import csv
+import os
+import re
+from datetime import datetime
+import numpy as np
+from PIL import Image
+from PIL import ImageOps
+from utilities_io import exists_file
+
+# Name of the clusters file written into each clustered image directory
+CLUSTERS_FILE = 'clusters.csv'
+# Side (pixels) of the grayscale thumbnail transformed by pHash (8x8 low frequencies kept)
+PHASH_SIZE = 32
+# Largest Hamming distances (of 64 bits) between near-duplicates: candidates are found
+# by pHash and confirmed by dHash, which reacts to other changes (local gradients)
+PHASH_RADIUS = 10
+DHASH_RADIUS = 10
+# Largest time between the shots of near-duplicates (seconds, from their filenames):
+# different messages on the same screen layout may hash alike (the text is a small part
+# of the photo), but repeated shots of one message are taken within seconds
+MAX_TIME_GAP = 120
+# Timestamp in the filenames of the photos (e.g. 2023-05-06_07-18-22_i0.jpg)
+TIMESTAMP_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})')
+
+def dct_matrix( size : int) -> np.ndarray :
+    """
+    Orthonormal DCT-II matrix (the DCT of x is M @ x)
+    """
+    k = np.arange(size)[ :, None]
+    n = np.arange(size)[ None, :]
+    matrix     = np.cos( np.pi * ( 2 * n + 1 ) * k / ( 2 * size ))
+    matrix[0]  *= np.sqrt( 1 / size)
+    matrix[1:] *= np.sqrt( 2 / size)
+    return matrix
+
+DCT_MATRIX = dct_matrix(PHASH_SIZE)
+
+def bits_to_int( bits : np.ndarray) -> int :
+    """
+    Integer with one bit per element of a boolean array (first element highest)
+    """
+    value = 0
+    for bit in bits.flatten() :
+        value = ( value << 1 ) | int(bit)
+    return value
+
+def phash( gray : Image.Image) -> int :
+    """
+    64-bit perceptual hash: sign of the 8x8 lowest frequencies of the DCT of a 32x32
+    thumbnail relative to their median (the DC term is left out of the median)
+    """
+    pixels = np.asarray( gray.resize( ( PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS),
+                         dtype = np.float64)
+    low    = ( DCT_MATRIX @ pixels @ DCT_MATRIX.T )[ :8, :8]
+    return bits_to_int( low > np.median(low.flatten()[1:]) )
+
+def dhash( gray : Image.Image) -> int :
+    """
+    64-bit difference hash: whether each pixel of a 9x8 thumbnail is brighter than its
+    left neighbor
+    """
+    pixels = np.asarray( gray.resize( ( 9, 8), Image.Resampling.LANCZOS), dtype = np.int16)
+    return bits_to_int( pixels[ :, 1:] > pixels[ :, :-1] )
+
+def image_hashes( image_path : str) -> tuple[ int, int] :
+    """
+    pHash and dHash of an image, from a single decode at reduced resolution (JPEG draft
+    mode) in its upright orientation (EXIF)
+    """
+    with Image.open(image_path) as image :
+        image.draft( 'L', ( 4 * PHASH_SIZE, 4 * PHASH_SIZE))
+        gray = ImageOps.exif_transpose(image).convert('L')
+    return phash(gray), dhash(gray)
+
+def hamming( a : int, b : int) -> int :
+    """
+    Number of differing bits of two hashes
+    """
+    return ( a ^ b ).bit_count()
+
+class BKTree :
+    """
+    Burkhard-Keller tree of hashes under the Hamming distance: finds all hashes within
+    a radius of a query without comparing it to every hash (the triangle inequality
+    prunes the subtrees that cannot hold matches)
+    """
+
+    def __init__(self) -> None :
+        self.root = None    # node: [ hash, items, { distance : child node } ]
+        return
+
+    def add( self, value : int, item) -> None :
+        """
+        Add an item under its hash
+        """
+        if self.root is None :
+            self.root = [ value, [ item ], {} ]
+            return
+        node = self.root
+        while True :
+            distance = hamming( value, node[0])
+            if distance == 0 :
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None :
+                node[2][distance] = [ value, [ item ], {} ]
+                return
+            node = child
+
+    def query( self, value : int, radius : int) -> list[tuple] :
+        """
+        Get the ( item, distance ) of all items whose hash is within radius of value
+        """
+        matches = []
+        stack   = [ self.root ] if self.root is not None else []
+        while stack :
+            node     = stack.pop()
+            distance = hamming( value, node[0])
+            if distance <= radius :
+                matches.extend( ( item, distance ) for item in node[1] )
+            for child_distance, child in node[2].items() :
+                if distance - radius <= child_distance <= distance + radius :
+                    stack.append(child)
+        return matches
+
+def parse_timestamp( filename : str) -> float | None :
+    """
+    Time (POSIX seconds) a photo was shot, from its filename (None if not found)
+    """
+    match = TIMESTAMP_PATTERN.search(filename)
+    if not match :
+        return None
+    try :
+        return datetime.strptime( match.group(1), '%Y-%m-%d_%H-%M-%S').timestamp()
+    except ValueError :
+        return None
+
+def cluster_images( hashes : dict,
+                    priority : dict | None = None,
+                    phash_radius : int = PHASH_RADIUS,
+                    dhash_radius : int = DHASH_RADIUS,
+                    max_time_gap : float | None = MAX_TIME_GAP) -> dict :
+    """
+    Cluster near-duplicate images. hashes: { filename : ( phash, dhash ) }.
+    Images are taken in order of priority (highest first, e.g. file size, so that the
+    best shot stands for its cluster): each image not clustered yet becomes the
+    representative of the unclustered images within both radii of it (and, if both
+    filenames have timestamps, shot within max_time_gap seconds). Every member is thus
+    close to its representative; chains of small changes are not merged.
+    Returns { representative : [ ( member, phash distance ), ... ] } (representative
+    first, with distance 0).
+    """
+    tree = BKTree()
+    for filename, ( p_hash, _ ) in hashes.items() :
+        tree.add( p_hash, filename)
+    priority = priority or {}
+    order    = sorted( hashes, key = lambda f : ( -priority.get( f, 0), f))
+    times    = { filename : parse_timestamp(filename) for filename in hashes }
+    assigned = set()
+    clusters = {}
+    for representative in order :
+        if representative in assigned :
+            continue
+        assigned.add(representative)
+        p_hash, d_hash = hashes[representative]
+        members = [ ( representative, 0 ) ]
+        for filename, distance in sorted( tree.query( p_hash, phash_radius),
+                                          key = lambda m : ( m[1], m[0])) :
+            if filename in assigned :
+                continue
+            if hamming( d_hash, hashes[filename][1]) > dhash_radius :
+                continue
+            if max_time_gap and times[representative] is not None \
+                            and times[filename] is not None \
+                            and abs( times[representative] - times[filename]) > max_time_gap :
+                continue
+            assigned.add(filename)
+            members.append( ( filename, distance) )
+        clusters[representative] = members
+    return clusters
+
+def save_clusters( clusters : dict, csv_path : str) -> None :
+    """
+    Save the clusters with more than one image as rows of filename, representative and
+    pHash distance (images absent from the file stand for themselves); atomically
+    """
+    tmp_path = csv_path + '.tmp'
+    with open( tmp_path, 'w', newline = '') as f :
+        writer = csv.writer(f)
+        writer.writerow( [ 'filename', 'representative', 'distance' ] )
+        for representative, members in sorted(clusters.items()) :
+            if len(members) > 1 :
+                for filename, distance in members :
+                    writer.writerow( [ filename, representative, distance ] )
+    os.replace( tmp_path, csv_path)
+    return
+
+def load_clusters( csv_path : str) -> dict :
+    """
+    Load { filename : representative } of the clustered images (empty if the file does
+    not exist: every image stands for itself)
+    """
+    if not csv_path or not exists_file(csv_path) :
+        return {}
+    try :
+        with open( csv_path, 'r', newline = '') as f :
+            return { row['filename'] : row['representative'] for row in csv.DictReader(f) }
+    except ( OSError, KeyError, csv.Error) as e :
+        print(f"Error loading clusters {csv_path}: {e}")
+        return {}
+
+def cluster_members( representatives : dict) -> dict :
+    """
+    Invert { filename : representative } into { representative : [ filenames ] }
+    """
+    members = {}
+    for filename, representative in representatives.items() :
+        members.setdefault( representative, []).append(filename)
+    return members
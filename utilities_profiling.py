@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Instrumentation of batch jobs: per-stage timers (context managers) and counters, with
+an optional JSON timing report and cProfile output per stage
+"""
+
+import cProfile
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from utilities_io import ensure_dir
+from utilities_io import load_json_file
+from utilities_io import save_to_json_file
+from utilities_printing import print_ind
+
+class Profiler :
+    """
+    Timers and counters of a job. Stages may nest (their times are inclusive); with
+    profiling enabled, each top-level stage accumulates its own cProfile statistics
+    (nested stages are part of the statistics of their top-level stage, as only one
+    profiler can be active at a time).
+    """
+
+    def __init__( self, job : str = 'job') -> None :
+        self.configure(job)
+        return
+
+    def configure( self, job : str, profile : bool = False) -> None :
+        """
+        Reset the timers and counters for a job (profile: collect cProfile statistics)
+        """
+        self.job       = job
+        self.profile   = profile
+        self.stages    = OrderedDict()   # stage : { 'seconds', 'calls' }
+        self.counters  = OrderedDict()   # counter : value
+        self.profilers = OrderedDict()   # top-level stage : cProfile.Profile
+        self.depth     = 0
+        self.started   = time.perf_counter()
+        return
+
+    @contextmanager
+    def stage( self, name : str) :
+        """
+        Time a stage of the job (context manager)
+        """
+        profiler = None
+        if self.profile and self.depth == 0 :
+            profiler = self.profilers.setdefault( name, cProfile.Profile())
+            profiler.enable()
+        self.depth += 1
+        start = time.perf_counter()
+        try :
+            yield
+        finally :
+            elapsed = time.perf_counter() - start
+            self.depth -= 1
+            if profiler :
+                profiler.disable()
+            stats = self.stages.setdefault( name, { 'seconds' : 0.0, 'calls' : 0 })
+            stats['seconds'] += elapsed
+            stats['calls']   += 1
+        return
+
+    def count( self, counter : str, amount : int = 1) -> None :
+        """
+        Add to a counter (e.g. entries expanded, bytes read)
+        """
+        self.counters[counter] = self.counters.get( counter, 0) + amount
+        return
+
+    def summary(self) -> dict :
+        """
+        Timing report: total time, time and calls per stage, and counters
+        """
+        return { 'job'           : self.job,
+                 'total_seconds' : round( time.perf_counter() - self.started, 6),
+                 'stages'        : { name : { 'seconds' : round( stats['seconds'], 6),
+                                              'calls'   : stats['calls'] }
+                                     for name, stats in self.stages.items() },
+                 'counters'      : dict(self.counters) }
+
+    def print_summary(self) -> None :
+        """
+        Print the time of each stage and the counters
+        """
+        summary = self.summary()
+        print_ind(f"Timings of {self.job}: {summary['total_seconds']:.3f} s")
+        for name, stats in summary['stages'].items() :
+            print_ind( f"{name:<24} {stats['seconds']:9.3f} s  ({stats['calls']} calls)", 1)
+        for name, value in summary['counters'].items() :
+            print_ind( f'{name:<24} {value:>11}', 1)
+        return
+
+    def save_report( self, dir_output : str) -> str :
+        """
+        Save the timing report (JSON) and the cProfile statistics of each top-level
+        stage (if profiled; view them with pstats or snakeviz) to a directory.
+        Returns the path of the report.
+        """
+        ensure_dir(dir_output)
+        for name, profiler in self.profilers.items() :
+            profiler.dump_stats(os.path.join( dir_output, f'{self.job}.{name}.prof'))
+        path_report = os.path.join( dir_output, f'{self.job}_timings.json')
+        save_to_json_file( self.summary(), path_report)
+        return path_report
+
+# Profiler of the running job (configured by its main block)
+PROFILER = Profiler()
+
+def profiled_load_json( filepath : str) :
+    """
+    Load a JSON file, timing it and counting the bytes read
+    """
+    with PROFILER.stage('load_json') :
+        PROFILER.count( 'bytes_read', os.path.getsize(filepath))
+        return load_json_file(filepath)
+
+def profiled_save_json( data, filepath : str) -> None :
+    """
+    Save data to a JSON file, timing it and counting the bytes written
+    """
+    with PROFILER.stage('save_json') :
+        save_to_json_file( data, filepath)
+        PROFILER.count( 'bytes_written', os.path.getsize(filepath))
+    return
+
+def add_profiling_arguments( parser) -> None :
+    """
+    Add the instrumentation options of the DK build jobs to an argument parser
+    """
+    parser.add_argument( '-t', '--timings', action = 'store_true',
+                         help = 'Save a JSON timing report')
+    parser.add_argument( '-p', '--profile', action = 'store_true',
+                         help = 'Save cProfile output per stage (and the timing report)')
+    return
+
+def finish_profiling( args, dir_output : str) -> None :
+    """
+    Print the timings of the job and save its report if requested
+    """
+    PROFILER.print_summary()
+    if args.timings or args.profile :
+        path_report = PROFILER.save_report(dir_output)
+        print_ind( f'Saved timing report to: {path_report}', 1)
+    return
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Routing of labeled images into category directories: plan first, then link, copy or
+rotate in parallel, skipping targets that are already up to date
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from json import JSONDecodeError
+from PIL import Image
+from tqdm import tqdm
+from utilities_images import hash_file
+from utilities_images import rotate_image
+from utilities_io import ensure_dir
+from utilities_io import exists_file
+from utilities_io import load_json_file
+from utilities_io import save_to_json_file
+
+# Linux ioctl that clones a file's extents (reflink) on filesystems supporting it
+FICLONE = 0x40049409
+# Seconds between saves of the routing manifest (progress record)
+MANIFEST_SAVE_INTERVAL = 5.0
+
+def make_route( source : str, dest : str, rotation : int = 0) -> tuple[ str, str, int] :
+    """
+    Route of one image: source path, destination path and counter-clockwise rotation
+    to apply (0 to link or copy the file as is)
+    """
+    return source, dest, int(rotation) % 360
+
+def make_fanout_routes( source : str,
+                        dests : list[str],
+                        rotation : int = 0) -> list[tuple[ str, str, int]] :
+    """
+    Routes of one image into several destinations: the first one from the source (read
+    once, rotated if needed), the others linked to the first one
+    """
+    if not dests :
+        return []
+    return [ make_route( source, dests[0], rotation) ] + \
+           [ make_route( dests[0], dest) for dest in dests[1:] ]
+
+def get_signature( path : str) -> list[int] | None :
+    """
+    Size and modification time of a file (None if it does not exist)
+    """
+    try :
+        stat = os.stat(path)
+    except OSError :
+        return None
+    return [ stat.st_size, stat.st_mtime_ns ]
+
+def make_record( route : tuple[ str, str, int]) -> dict :
+    """
+    Manifest record of a route: its source and rotation, and the size and modification
+    time of source and destination
+    """
+    source, dest, rotation = route
+    return { 'source'     : source,
+             'rotation'   : rotation,
+             'source_sig' : get_signature(source),
+             'dest_sig'   : get_signature(dest) }
+
+def is_up_to_date( route : tuple[ str, str, int], record : dict | None) -> bool :
+    """
+    Check whether the destination of a route is up to date: either the manifest record
+    of its last routing still matches source and destination (size and modification
+    time), or both are the same file, or (if not rotated) they have the same contents
+    """
+    source, dest, rotation = route
+    dest_sig = get_signature(dest)
+    if dest_sig is None :
+        return False
+    source_sig = get_signature(source)
+    if source_sig is None :
+        return False
+    if record and record.get('source') == source \
+              and record.get('rotation') == rotation \
+              and record.get('source_sig') == source_sig \
+              and record.get('dest_sig') == dest_sig :
+        return True
+    if rotation :
+        return False
+    if os.path.samefile( source, dest) :
+        return True
+    return source_sig[0] == dest_sig[0] and hash_file(source) == hash_file(dest)
+
+def clone_file( source : str, dest : str) -> None :
+    """
+    Clone a file (reflink): the copy shares data blocks until either file is modified
+    """
+    with open( source, 'rb') as fsrc, open( dest, 'wb') as fdst :
+        fcntl.ioctl( fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat( source, dest)
+    return
+
+def link_or_copy( source : str, dest : str) -> str :
+    """
+    Place a file at dest as a hardlink, else as a reflink, else as a copy.
+    Returns the method used.
+    """
+    tmp_dest = f'{dest}.{os.getpid()}.tmp'
+    if os.path.lexists(tmp_dest) :
+        os.remove(tmp_dest)
+    try :
+        os.link( source, tmp_dest)
+        method = 'linked'
+    except OSError :
+        try :
+            clone_file( source, tmp_dest)
+            method = 'cloned'
+        except OSError as e :
+            if e.errno not in ( errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                                errno.EINVAL, errno.EBADF ) :
+                raise
+            shutil.copy2( source, tmp_dest)
+            method = 'copied'
+    os.replace( tmp_dest, dest)
+    return method
+
+def execute_route( route : tuple[ str, str, int]) -> tuple[ str, str, dict | None] :
+    """
+    Execute one route (runs in worker processes).
+    Returns the destination, the outcome (linked, cloned, copied, rotated, missing or
+    failed) and the manifest record of the route (None unless it succeeded).
+    """
+    source, dest, rotation = route
+    if not exists_file(source) :
+        return dest, 'missing', None
+    try :
+        if rotation :
+            # Rotate the stored pixels (as displayed by load_image_for_display)
+            tmp_dest = f'{dest}.{os.getpid()}.tmp'
+            with Image.open(source) as image :
+                image_format = image.format
+                image = rotate_image( image, rotation)
+                image.save( tmp_dest, format = image_format)
+            os.replace( tmp_dest, dest)
+            method = 'rotated'
+        else :
+            method = link_or_copy( source, dest)
+    except Exception as e :
+        print(f"Error routing {source} to {dest}: {e}")
+        return dest, 'failed', None
+    return dest, method, make_record(route)
+
+def load_manifest( manifest_path : str) -> dict :
+    """
+    Load the routing manifest: { destination : record of its last routing }
+    """
+    if manifest_path and exists_file(manifest_path) :
+        try :
+            return load_json_file(manifest_path)
+        except ( OSError, JSONDecodeError) as e :
+            print(f"Error loading routing manifest {manifest_path}: {e}")
+    return {}
+
+def save_manifest( manifest : dict, manifest_path : str) -> None :
+    """
+    Save the routing manifest atomically
+    """
+    tmp_path = manifest_path + '.tmp'
+    save_to_json_file( manifest, tmp_path)
+    os.replace( tmp_path, manifest_path)
+    return
+
+def route_images( routes : list[tuple[ str, str, int]],
+                  manifest_path : str | None = None,
+                  num_workers : int | None = None,
+                  desc : str = 'Routing images') -> dict :
+    """
+    Execute routes in a pool of worker processes, skipping destinations already up to
+    date (routes whose source is the destination of another route run after it).
+    Progress is recorded in the manifest as routes complete, so that interrupted runs
+    resume where they left off and re-runs only touch changed images.
+    Returns a dict mapping each destination to the outcome of its route.
+    """
+    manifest = load_manifest(manifest_path)
+    outcomes = {}
+    pending  = []
+    # Routes from the destination of another route (e.g. the hardlinks of one image into
+    # several category directories) are planned after it: when that destination is
+    # routed again (replaced by a new file), they are too, up to date or not
+    routed = set( route[1] for route in routes )
+    dests  = set()    # destinations to route
+    for route in [ route for route in routes if route[0] not in routed ] + \
+                 [ route for route in routes if route[0] in routed ] :
+        dest = route[1]
+        if route[0] not in dests and is_up_to_date( route, manifest.get(dest)) :
+            outcomes[dest] = 'skipped'
+            # Record destinations found up to date by contents too (cheaper next time)
+            manifest[dest] = make_record(route)
+        else :
+            pending.append(route)
+            dests.add(dest)
+    for dest_dir in set( os.path.dirname(route[1]) for route in pending ) :
+        ensure_dir(dest_dir)
+
+    # Those routes run once their source is in place, so that the source is read only
+    # once and the other destinations link to the first one
+    waves = [ [ route for route in pending if route[0] not in dests ],
+              [ route for route in pending if route[0] in dests ] ]
+    last_save = time.monotonic()
+    for wave in waves :
+        if not wave :
+            continue
+        num_chunks = 4 * ( num_workers or os.cpu_count() or 1 )
+        chunksize  = min( max( 1, len(wave) // num_chunks), 64)
+        with ProcessPoolExecutor( max_workers = num_workers) as executor :
+            results = executor.map( execute_route, wave, chunksize = chunksize)
+            for dest, outcome, record in tqdm( results, total = len(wave), desc = desc) :
+                outcomes[dest] = outcome
+                if record :
+                    manifest[dest] = record
+                if manifest_path and time.monotonic() - last_save > MANIFEST_SAVE_INTERVAL :
+                    save_manifest( manifest, manifest_path)
+                    last_save = time.monotonic()
+    if manifest_path :
+        save_manifest( manifest, manifest_path)
+    return outcomes
+
+def count_outcomes( outcomes : dict) -> dict :
+    """
+    Number of routes per outcome
+    """
+    counts = {}
+    for outcome in outcomes.values() :
+        counts[outcome] = counts.get( outcome, 0) + 1
+    return dict(sorted(counts.items()))
@@ -6,45 +6,151 @@ Count tokens in JSON files
 import os
 import sys
 import tiktoken
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from json import JSONDecodeError
+from tempfile import gettempdir
+from utilities_io import exists_file
 from utilities_io import load_file_as_string
+from utilities_io import load_json_file
+from utilities_io import save_to_json_file
 from utilities_printing import print_sep
 
+DATA_FORMATS = ( '.json', '.md')
+NUM_THREADS  = min( 32, ( os.cpu_count() or 1 ) + 4 )
+
+# Cache of token counts per encoding:
+# { encoding_name : { absolute filepath : [ mtime_ns, size, num_tokens ] } }
+token_cache = {}
+
+@lru_cache( maxsize = None)
+def get_encoding( encoding_name : str = "cl100k_base") -> tiktoken.Encoding :
+    """
+    Returns the tiktoken encoder for the given encoding (loaded once per name).
+    """
+    return tiktoken.get_encoding(encoding_name)
+
 def count_tokens_in_string( string : str, encoding_name : str = "cl100k_base") -> int :
     """Returns the number of tokens in a text string."""
-    encoding   = tiktoken.get_encoding(encoding_name)
+    encoding   = get_encoding(encoding_name)
     num_tokens = len( encoding.encode(string) )
     return num_tokens
 
-def count_tokens_in_files( directory : str) -> dict :
+def count_tokens_in_strings( strings : list[str],
+                             encoding_name : str = "cl100k_base",
+                             num_threads : int = NUM_THREADS) -> list[int] :
+    """
+    Returns the number of tokens in each of the given strings.
+    Uses tiktoken batch encoding, which runs the encoder in native threads.
+    """
+    if not strings :
+        return []
+    encoding = get_encoding(encoding_name)
+    encoded  = encoding.encode_batch( list(strings), num_threads = num_threads)
+    return [ len(tokens) for tokens in encoded ]
+
+def list_token_files( directory : str) -> list[str] :
+    """
+    Lists all JSON and Markdown files in the given directory and its subdirectories.
+    """
+    result = []
+    for dir_path, dir_names, filenames in os.walk(directory) :
+        dir_names.sort()
+        for filename in sorted(filenames) :
+            if filename.endswith(DATA_FORMATS) :
+                result.append( os.path.join( dir_path, filename) )
+    return result
+
+def load_token_cache( cache_path : str) -> None :
     """
-    Analyzes all JSON and Markdown files in the given directory and returns token counts.
-    Returns a dictionary with filenames as keys and token counts as values.
+    Load the token count cache from a JSON file (if it exists).
+    """
+    if exists_file(cache_path) :
+        try :
+            # Caches of former versions (keyed by path only) are left out
+            cached = load_json_file(cache_path)
+            token_cache.update( { encoding_name : counts
+                                  for encoding_name, counts in cached.items()
+                                  if isinstance( counts, dict) } )
+        except ( OSError, JSONDecodeError) as e :
+            print(f"Error loading token cache {cache_path}: {str(e)}")
+    return
+
+def save_token_cache( cache_path : str) -> None :
+    """
+    Save the token count cache to a JSON file.
+    """
+    save_to_json_file( token_cache, cache_path)
+    return
+
+def count_tokens_in_files( directory : str,
+                           encoding_name : str = "cl100k_base",
+                           num_threads : int = NUM_THREADS) -> dict :
+    """
+    Analyzes all JSON and Markdown files in the given directory (recursively) and
+    returns token counts.
+    Returns a dictionary with file paths relative to the directory as keys and token
+    counts as values. Files whose modification time and size did not change since the
+    last count are served from the token cache.
     """
-    data_formats = ( '.json', '.md')
     token_counts = {}
-    for filename in os.listdir(directory):
-        if filename.endswith(data_formats):
-            filepath = os.path.join( directory, filename)
-            try:
-                content_string = load_file_as_string(filepath)
-                token_counts[filename] = count_tokens_in_string(content_string)
-            except Exception as e:
-                print(f"Error processing {filename}: {str(e)}")
+    stale_paths  = []
+    stale_stats  = []
+    cache        = token_cache.setdefault( encoding_name, {})
+    for filepath in list_token_files(os.path.abspath(directory)) :
+        filename = os.path.relpath( filepath, directory)
+        try :
+            stat = os.stat(filepath)
+        except OSError as e :
+            print(f"Error processing {filename}: {str(e)}")
+            continue
+        cached = cache.get(filepath)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size :
+            token_counts[filename] = cached[2]
+        else :
+            stale_paths.append(filepath)
+            stale_stats.append(stat)
+
+    # Read stale files in parallel
+    def read_file( filepath : str) -> str | None :
+        try :
+            return load_file_as_string(filepath)
+        except Exception as e :
+            print(f"Error processing {os.path.relpath( filepath, directory)}: {str(e)}")
+            return None
+    with ThreadPoolExecutor( max_workers = num_threads) as executor :
+        contents = list( executor.map( read_file, stale_paths) )
+
+    # Count tokens of all stale files in one batch
+    loaded   = [ i for i, content in enumerate(contents) if content is not None ]
+    counts   = count_tokens_in_strings( [ contents[i] for i in loaded ],
+                                        encoding_name, num_threads)
+    for i, num_tokens in zip( loaded, counts) :
+        filepath = stale_paths[i]
+        stat     = stale_stats[i]
+        cache[filepath] = [ stat.st_mtime_ns, stat.st_size, num_tokens ]
+        token_counts[os.path.relpath( filepath, directory)] = num_tokens
+
     return token_counts
 
 if __name__ == "__main__" :
-    # Analyze current directory unless a directory is specified
-    directory = os.getcwd() if len(sys.argv) < 2 else sys.argv[1]
-    # Analyze files
-    token_counts = count_tokens_in_files(directory)
-    # Print token counts for each file (sorted alphabetically)
-    print_sep()
-    print("Token counts per file:")
-    print_sep()
+    # Analyze current directory unless one or more directories are specified
+    directories = [ os.getcwd() ] if len(sys.argv) < 2 else sys.argv[1:]
+    # Load token count cache from previous runs
+    cache_path = os.path.join( gettempdir(), 'kgraphs_token_counts.json')
+    load_token_cache(cache_path)
     total_tokens = 0
-    for filename, count in sorted(token_counts.items()) :
-        print(f"{filename:<40}{count:>8} tokens")
-        total_tokens += count
+    for directory in directories :
+        # Analyze files
+        token_counts = count_tokens_in_files(directory)
+        # Print token counts for each file (sorted alphabetically)
+        print_sep()
+        print(f"Token counts per file in: {directory}")
+        print_sep()
+        for filename, count in sorted(token_counts.items()) :
+            print(f"{filename:<40}{count:>8} tokens")
+            total_tokens += count
+    save_token_cache(cache_path)
     print_sep()
     # Print total token count
     msg = "Total tokens across all files:"
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Process pool with per-task deadlines enforced by the parent, recycling of workers and
+adaptive chunk sizes, for long batch runs (e.g. OCR) that must never hang
+"""
+
+import math
+import multiprocessing as mp
+import os
+import signal
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+# Seconds between checks of the deadlines when no result arrives
+POLL_INTERVAL = 0.5
+# Weight of the last task duration in the running estimate of the task duration
+DURATION_SMOOTHING = 0.2
+
+def worker_loop( func, conn) -> None :
+    """
+    Worker process: receive chunks of (task id, item) and send back one
+    (task id, status, result, duration) per task (status: done or error), until None is
+    received.
+    Interrupts are left to the parent, which shuts down the workers. Each worker leads
+    its own process group, so that killing it also kills its subprocesses (e.g. the
+    tesseract executable).
+    """
+    os.setpgid( 0, 0)
+    signal.signal( signal.SIGINT, signal.SIG_IGN)
+    signal.signal( signal.SIGTERM, signal.SIG_DFL)
+    while True :
+        try :
+            chunk = conn.recv()
+        except EOFError :
+            break
+        if chunk is None :
+            break
+        for task_id, item in chunk :
+            start = time.perf_counter()
+            try :
+                status, result = 'done', func(item)
+            except Exception as e :
+                status, result = 'error', f'{type(e).__name__}: {e}'
+            conn.send( ( task_id, status, result, time.perf_counter() - start ) )
+    conn.close()
+    return
+
+def kill_group( pid : int) -> None :
+    """
+    Kill a worker process and its subprocesses
+    """
+    try :
+        os.killpg( pid, signal.SIGKILL)
+    except ( ProcessLookupError, PermissionError) :
+        # Not (yet or any longer) a group leader: kill the process alone
+        try :
+            os.kill( pid, signal.SIGKILL)
+        except ProcessLookupError :
+            pass
+    return
+
+class Worker :
+    """
+    Worker process and the parent's view of it: its connection, the tasks of the chunk
+    it is working on and when the current one started
+    """
+
+    def __init__( self, func) -> None :
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process( target = worker_loop, args = ( func, child_conn),
+                                   daemon = True)
+        self.process.start()
+        child_conn.close()
+        self.chunk      = deque()   # ( task id, item ) not yet answered, current first
+        self.started_at = None      # start of the current task (parent's clock)
+        self.num_tasks  = 0
+        return
+
+    def assign( self, chunk : list) -> None :
+        """
+        Send a chunk of tasks to the worker
+        """
+        self.chunk.extend(chunk)
+        self.started_at = time.monotonic()
+        self.conn.send(chunk)
+        return
+
+    def stop( self, kill : bool = False) -> None :
+        """
+        Stop the worker: ask it to exit once idle, or kill it
+        """
+        if kill :
+            kill_group(self.process.pid)
+        else :
+            try :
+                self.conn.send(None)
+            except OSError :
+                pass
+        self.process.join( None if kill else 5.0)
+        if self.process.is_alive() :
+            kill_group(self.process.pid)
+            self.process.join()
+        self.conn.close()
+        return
+
+class DeadlinePool :
+    """
+    Pool of worker processes running func over items, yielding (item, status, result)
+    as tasks complete, in any order. Status is done, error (func raised; result is the
+    message), timeout (the task ran past its deadline) or crashed (the worker died).
+    The parent enforces the deadlines: a worker whose current task runs for more than
+    timeout seconds is killed and replaced, and the rest of its chunk is rescheduled.
+    Workers are replaced after max_tasks tasks (to contain leaks). Chunk sizes adapt to
+    the running estimate of the task duration so that each chunk takes about
+    chunk_seconds, which keeps scheduling overhead low for fast tasks while balancing
+    slow ones.
+    """
+
+    def __init__( self,
+                  func,
+                  num_workers : int | None = None,
+                  timeout : float = 30.0,
+                  max_tasks : int | None = 200,
+                  chunk_seconds : float = 2.0,
+                  max_chunksize : int = 32) -> None :
+        self.func          = func
+        self.num_workers   = num_workers or max( 1, mp.cpu_count() - 1)
+        self.timeout       = timeout
+        self.max_tasks     = max_tasks
+        self.chunk_seconds = chunk_seconds
+        self.max_chunksize = max_chunksize
+        self.duration      = None    # running estimate of the task duration (seconds)
+        self.workers       = []
+        self.counts        = { 'done' : 0, 'error' : 0, 'timeout' : 0, 'crashed' : 0 }
+        return
+
+    def __enter__(self) :
+        return self
+
+    def __exit__( self, *exc) -> None :
+        self.shutdown( kill = exc[0] is not None)
+        return
+
+    def chunksize( self, num_pending : int) -> int :
+        """
+        Number of tasks of the next chunk: about chunk_seconds of work, but no more than
+        a fair share of the pending tasks
+        """
+        size = self.max_chunksize if self.duration is None else \
+               round( self.chunk_seconds / max( self.duration, 1e-6))
+        fair = math.ceil( num_pending / self.num_workers)
+        return max( 1, min( size, fair, self.max_chunksize))
+
+    def record_duration( self, duration : float) -> None :
+        """
+        Update the running estimate of the task duration
+        """
+        if self.duration is None :
+            self.duration = duration
+        else :
+            self.duration += DURATION_SMOOTHING * ( duration - self.duration )
+        return
+
+    def replace( self, worker : Worker, kill : bool) -> Worker :
+        """
+        Stop a worker and start a new one in its place
+        """
+        worker.stop( kill = kill)
+        new_worker = Worker(self.func)
+        self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
+
+    def imap_unordered( self, items) :
+        """
+        Run func over items, yielding (item, status, result) as tasks complete
+        """
+        pending = deque(enumerate(items))
+        if not pending :
+            return
+        self.workers = [ Worker(self.func)
+                         for _ in range(min( self.num_workers, len(pending))) ]
+        while pending or any( worker.chunk for worker in self.workers ) :
+            # Keep every idle worker busy (recycling the ones that did enough tasks)
+            for worker in list(self.workers) :
+                if worker.chunk or not pending :
+                    continue
+                if self.max_tasks and worker.num_tasks >= self.max_tasks :
+                    worker = self.replace( worker, kill = False)
+                size = self.chunksize(len(pending))
+                worker.assign( [ pending.popleft() for _ in range(min( size, len(pending))) ])
+
+            busy  = [ worker for worker in self.workers if worker.chunk ]
+            ready = wait( [ worker.conn for worker in busy ] +
+                          [ worker.process.sentinel for worker in busy ], POLL_INTERVAL)
+            now   = time.monotonic()
+            for worker in busy :
+                if worker.conn in ready :
+                    # Results of completed tasks (all that have arrived)
+                    try :
+                        while worker.conn.poll() :
+                            _, status, result, duration = worker.conn.recv()
+                            _, item = worker.chunk.popleft()
+                            self.record_duration(duration)
+                            worker.started_at = now
+                            worker.num_tasks += 1
+                            self.counts[status] += 1
+                            yield item, status, result
+                        continue
+                    except ( EOFError, OSError) :
+                        pass    # the worker died: handled below
+                if worker.process.sentinel in ready or not worker.process.is_alive() :
+                    status = 'crashed'
+                elif now - worker.started_at > self.timeout :
+                    status = 'timeout'
+                else :
+                    continue
+                # Give up on the current task and reschedule the rest of the chunk
+                _, item = worker.chunk.popleft()
+                pending.extendleft(reversed(worker.chunk))
+                worker.chunk.clear()
+                self.replace( worker, kill = True)
+                self.counts[status] += 1
+                yield item, status, None
+        self.shutdown()
+        return
+
+    def shutdown( self, kill : bool = False) -> None :
+        """
+        Stop all workers (kill them, e.g. upon an interrupt)
+        """
+        for worker in self.workers :
+            worker.stop( kill = kill or bool(worker.chunk))
+        self.workers = []
+        return
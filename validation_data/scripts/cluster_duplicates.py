@@ -0,0 +1,102 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+# Shared utilities live in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utilities_phash import CLUSTERS_FILE
+from utilities_phash import DHASH_RADIUS
+from utilities_phash import MAX_TIME_GAP
+from utilities_phash import PHASH_RADIUS
+from utilities_phash import cluster_images
+from utilities_phash import image_hashes
+from utilities_phash import save_clusters
+from utilities_routing import load_manifest
+from utilities_routing import save_manifest
+
+# Constants
+JPG_DIR = "/home/luis/DAL/JPG"
+HASHES_FILE = "phash_cache.json"  # Kept in the image directory: { filename : [size, mtime_ns, phash, dhash] }
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def hash_image(image_path):
+    """Perceptual hashes of one image (runs in worker processes); None if unreadable."""
+    try:
+        return image_hashes(image_path)
+    except Exception as e:
+        print(f"\nError hashing {image_path}: {str(e)}")
+        return None
+
+def compute_hashes(image_dir, num_workers=None):
+    """
+    Perceptual hashes of all images of a directory. Only new or changed images (by size
+    and modification time) are decoded, in parallel; the others come from the cache.
+    Returns ({ filename : (phash, dhash) }, { filename : size }).
+    """
+    cache_path = os.path.join(image_dir, HASHES_FILE)
+    cache = load_manifest(cache_path)
+    hashes, sizes, to_hash = {}, {}, []
+    with os.scandir(image_dir) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            sizes[entry.name] = stat.st_size
+            cached = cache.get(entry.name)
+            if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+                hashes[entry.name] = tuple(cached[2:])
+            else:
+                to_hash.append((entry.name, stat))
+    to_hash.sort()
+
+    if to_hash:
+        print(f"Hashing {len(to_hash)} new images ({len(hashes)} cached)")
+        paths = [os.path.join(image_dir, name) for name, _ in to_hash]
+        chunksize = min(max(1, len(paths) // (8 * (num_workers or os.cpu_count() or 1))), 64)
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = executor.map(hash_image, paths, chunksize=chunksize)
+            for (name, stat), result in tqdm(zip(to_hash, results), total=len(to_hash), desc="Hashing images"):
+                if result is not None:
+                    hashes[name] = result
+                    cache[name] = [stat.st_size, stat.st_mtime_ns, *result]
+
+    # Forget images no longer in the directory
+    cache = {name: entry for name, entry in cache.items() if name in sizes}
+    save_manifest(cache, cache_path)
+    return hashes, sizes
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate photos by perceptual hashes')
+    parser.add_argument('-d', '--image_dir', default=JPG_DIR,
+                        help=f'Directory of the images (default: {JPG_DIR})')
+    parser.add_argument('-p', '--phash_radius', type=int, default=PHASH_RADIUS,
+                        help='Largest pHash distance (bits) between near-duplicates')
+    parser.add_argument('-r', '--dhash_radius', type=int, default=DHASH_RADIUS,
+                        help='Largest dHash distance (bits) between near-duplicates')
+    parser.add_argument('-t', '--max_time_gap', type=float, default=MAX_TIME_GAP,
+                        help='Largest time between the shots of near-duplicates (seconds, 0: any)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of hashing processes (default: all cores)')
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    hashes, sizes = compute_hashes(args.image_dir, args.workers)
+    if not hashes:
+        print("No images to cluster.")
+        return
+
+    # The largest file of each cluster (most detail) stands for it
+    clusters = cluster_images(hashes, sizes, args.phash_radius, args.dhash_radius, args.max_time_gap)
+    clusters_path = os.path.join(args.image_dir, CLUSTERS_FILE)
+    save_clusters(clusters, clusters_path)
+
+    duplicated = [members for members in clusters.values() if len(members) > 1]
+    print(f"Images: {len(hashes)}, clusters: {len(clusters)} "
+          f"({len(duplicated)} with near-duplicates, {len(hashes) - len(clusters)} images to skip)")
+    print(f"Clusters saved to {clusters_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,263 @@
 import os
-import shutil
+import sys
 import time
+import argparse
+import hashlib
+import threading
 from pathlib import Path
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
+# Shared utilities live in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utilities_images import hash_file
+from utilities_routing import load_manifest
+from utilities_routing import save_manifest
+
 # Constants
 SOURCE_DIR = "/media/luis/FAA47057A47017F9/DJI_AGRAS_LATINO"
 BASE_DIR = "/home/luis/DAL"
-COPIED_FILE = os.path.join(SOURCE_DIR, "copied.txt")
-WINDOW_SIZE = 20
+MANIFEST_FILE = os.path.join(BASE_DIR, "ingest_manifest.json")  # Kept on the destination
+COPIED_FILE = os.path.join(SOURCE_DIR, "copied.txt")  # Progress file of former versions
+MANIFEST_SAVE_INTERVAL = 5.0  # Seconds between saves of the manifest
+COPY_CHUNK = 8 * 1024 * 1024  # Bytes per read of a copy (hashed on the way)
+WORKERS_ROTATIONAL = 2  # Parallel copies on spinning disks (more would only add seeks)
+WORKERS_SOLID_STATE = 8  # Parallel copies on flash media and SSDs
 
 def ensure_directories():
     """Create necessary directories if they don't exist."""
     for dir_name in [BASE_DIR, os.path.join(BASE_DIR, "JPG"), os.path.join(BASE_DIR, "PNG")]:
         Path(dir_name).mkdir(parents=True, exist_ok=True)
 
-def get_copied_files():
-    """Read the list of already copied files or create an empty set."""
+def is_rotational(path):
+    """Check whether a path lives on a spinning disk (None if unknown)."""
+    try:
+        dev = os.stat(path).st_dev
+        sys_dir = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+        # Partitions have the queue attributes of their parent device
+        for queue_dir in (os.path.join(sys_dir, "queue"),
+                          os.path.join(sys_dir, "..", "queue")):
+            flag_file = os.path.join(queue_dir, "rotational")
+            if os.path.exists(flag_file):
+                with open(flag_file, 'r') as f:
+                    return f.read().strip() == '1'
+    except OSError:
+        pass
+    return None
+
+def default_workers(source_dir, dest_dir):
+    """Number of parallel copies suited to the slowest of source and destination media."""
+    rotational = [is_rotational(source_dir), is_rotational(dest_dir)]
+    if any(rotational):
+        return WORKERS_ROTATIONAL
+    if all(flag is False for flag in rotational):
+        return WORKERS_SOLID_STATE
+    return (WORKERS_ROTATIONAL + WORKERS_SOLID_STATE) // 2
+
+def dest_subdir(file):
+    """Subdirectory of the destination storing a file (by its type)."""
+    return "JPG" if file.lower().endswith(('.jpg', '.jpeg')) else "PNG"
+
+def copy_and_hash(source_path, dest_path):
+    """
+    Copy a file with large buffered reads, hashing its contents on the way (the source
+    is read once), and keep its timestamps. Returns the hash (as hash_file).
+    """
+    digest = hashlib.sha1()
+    with open(source_path, 'rb') as fsrc, open(dest_path, 'wb') as fdst:
+        while chunk := fsrc.read(COPY_CHUNK):
+            digest.update(chunk)
+            fdst.write(chunk)
+        st = os.fstat(fsrc.fileno())
+    os.utime(dest_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return digest.hexdigest()
+
+class Ingest:
+    """
+    Ingest of the photos of a source directory into the destination, deduplicated by
+    content hash. The manifest (on the destination) maps each source file to its size,
+    modification time and hash, and each hash to the one file storing it.
+    """
+
+    def __init__(self, manifest_file=MANIFEST_FILE):
+        self.manifest_file = manifest_file
+        manifest = load_manifest(manifest_file)
+        self.files = manifest.get('files', {})  # source path : { size, mtime_ns, hash }
+        # (hash None: listed in the copied.txt of former versions, see import_copied)
+        # hash : destination (relative to BASE_DIR)
+        self.hashes = manifest.get('hashes', {})
+        self.dests = set(self.hashes.values())  # destinations stored or being copied
+        self.claimed = set()  # hashes being copied
+        self.lock = threading.Lock()
+        self.last_save = time.monotonic()
+
+    def is_done(self, source_path, stat):
+        """Check whether a source file was ingested and has not changed since."""
+        entry = self.files.get(source_path)
+        if not entry or entry['size'] != stat.st_size \
+                     or entry['mtime_ns'] != stat.st_mtime_ns:
+            return False
+        if entry['hash'] is None:
+            # Copied by a former version (the copy may have been moved since)
+            return True
+        dest = self.hashes.get(entry['hash'])
+        return dest is not None and os.path.exists(os.path.join(BASE_DIR, dest))
+
+    def import_copied(self, source_path, stat):
+        """
+        Record a file listed in copied.txt (copied by a former version of this script) as
+        ingested, without reading it again. Returns whether it was not recorded yet.
+        """
+        if source_path in self.files:
+            return False
+        self.files[source_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                   'hash': None}
+        return True
+
+    def reserve(self, dest, file_hash):
+        """
+        Reserve a destination (relative to BASE_DIR), suffixed with the hash of the
+        contents if already taken. Call with the lock held.
+        """
+        if dest in self.dests:
+            stem, ext = os.path.splitext(dest)
+            dest = f"{stem}_{file_hash[:8]}{ext}"
+        self.dests.add(dest)
+        return dest
+
+    def claim(self, file, file_hash):
+        """
+        Claim the storage of some contents, choosing their destination (relative to
+        BASE_DIR): the file name, unless already taken by other contents.
+        Returns None if the contents are already stored or being stored.
+        """
+        with self.lock:
+            if file_hash in self.hashes or file_hash in self.claimed:
+                return None
+            self.claimed.add(file_hash)
+            return self.reserve(os.path.join(dest_subdir(file), file), file_hash)
+
+    def ingest_file(self, source_path, stat):
+        """
+        Ingest one file (runs in worker threads): copy it to a temporary file, hashing it
+        on the way, and keep the copy unless its contents are already stored. Returns the
+        outcome: copied, present (found at the destination, e.g. copied by a former
+        version of this script) or duplicate.
+        """
+        file = os.path.basename(source_path)
+        tmp_name = f".{file}.{threading.get_ident()}.tmp"
+        tmp_path = os.path.join(BASE_DIR, dest_subdir(file), tmp_name)
+        try:
+            file_hash = copy_and_hash(source_path, tmp_path)
+            dest = self.claim(file, file_hash)
+            outcome = 'duplicate'
+            if dest is not None:
+                try:
+                    dest_path = os.path.join(BASE_DIR, dest)
+                    if os.path.exists(dest_path) and hash_file(dest_path) == file_hash:
+                        outcome = 'present'
+                    else:
+                        if os.path.exists(dest_path):
+                            # Other contents under this name, not in the manifest: keep them
+                            with self.lock:
+                                dest = self.reserve(dest, file_hash)
+                            dest_path = os.path.join(BASE_DIR, dest)
+                        os.replace(tmp_path, dest_path)
+                        outcome = 'copied'
+                    with self.lock:
+                        self.hashes[file_hash] = dest
+                finally:
+                    with self.lock:
+                        self.claimed.discard(file_hash)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self.lock:
+            self.files[source_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                       'hash': file_hash}
+        return outcome
+
+    def save(self, force=False):
+        """
+        Save the manifest atomically (at most every MANIFEST_SAVE_INTERVAL seconds unless
+        forced).
+        """
+        if force or time.monotonic() - self.last_save > MANIFEST_SAVE_INTERVAL:
+            with self.lock:
+                manifest = {'files': dict(self.files), 'hashes': dict(self.hashes)}
+            save_manifest(manifest, self.manifest_file)
+            self.last_save = time.monotonic()
+
+def copy_files(num_workers=None):
+    """Copy new files in parallel and record them in the manifest."""
+    ingest = Ingest()
+    copied = set()
     if os.path.exists(COPIED_FILE):
         with open(COPIED_FILE, 'r') as f:
-            return set(line.strip() for line in f)
-    return set()
-
-def copy_files():
-    """Copy files and track progress."""
-    # Get list of already copied files
-    copied_files = get_copied_files()
+            copied = set(line.strip() for line in f)
     
-    # Get all JPG and PNG files
+    # Get all JPG and PNG files not ingested yet (single directory scan); files listed in
+    # copied.txt are recorded as ingested the first time, so that they are not copied again
     files_to_copy = []
-    for file in sorted(os.listdir(SOURCE_DIR)):
-        if file.lower().endswith(('.jpg', '.jpeg', '.png')) and file not in copied_files:
-            files_to_copy.append(file)
+    imported = 0
+    with os.scandir(SOURCE_DIR) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(('.jpg', '.jpeg', '.png')) and entry.is_file():
+                stat = entry.stat()
+                if entry.name in copied and ingest.import_copied(entry.path, stat):
+                    imported += 1
+                elif not ingest.is_done(entry.path, stat):
+                    files_to_copy.append((entry.path, stat))
+    files_to_copy.sort()
+    if imported:
+        ingest.save(force=True)
+        print(f"Imported {imported} files copied by former runs from {COPIED_FILE}")
     
     if not files_to_copy:
         print("No new files to copy.")
         return
     
-    # Initialize progress bar and timing variables
-    pbar = tqdm(total=len(files_to_copy), desc="Copying files")
-    times = deque(maxlen=WINDOW_SIZE)
+    num_workers = num_workers or default_workers(SOURCE_DIR, BASE_DIR)
+    print(f"Copying {len(files_to_copy)} files with {num_workers} threads")
+    outcomes = {'copied': 0, 'present': 0, 'duplicate': 0, 'failed': 0}
     
+    # Progress and ETA by bytes, i.e. by disk bandwidth
+    pbar = tqdm(total=sum(stat.st_size for _, stat in files_to_copy), desc="Copying files",
+                unit='B', unit_scale=True, unit_divisor=1024)
+    executor = ThreadPoolExecutor(max_workers=num_workers)
     try:
-        with open(COPIED_FILE, 'a') as copied_log:
-            for file in files_to_copy:
-                start_time = time.time()
-                
-                # Determine destination directory based on file extension
-                ext = file.lower()
-                if ext.endswith(('.jpg', '.jpeg')):
-                    dest_dir = os.path.join(BASE_DIR, "JPG")
-                else:
-                    dest_dir = os.path.join(BASE_DIR, "PNG")
-                
-                # Copy file
-                shutil.copy2(os.path.join(SOURCE_DIR, file), os.path.join(dest_dir, file))
-                
-                # Log copied file
-                copied_log.write(f"{file}\n")
-                copied_log.flush()
-                
-                # Update timing and progress
-                elapsed = time.time() - start_time
-                times.append(elapsed)
-                avg_time = sum(times) / len(times)
-                remaining = avg_time * (len(files_to_copy) - pbar.n - 1)
-                
-                # Update progress bar
-                pbar.set_postfix({'ETA': f'{remaining:.1f}s'})
-                pbar.update(1)
-                
+        futures = {executor.submit(ingest.ingest_file, path, stat): (path, stat)
+                   for path, stat in files_to_copy}
+        for future in as_completed(futures):
+            path, stat = futures[future]
+            try:
+                outcomes[future.result()] += 1
+            except OSError as e:
+                print(f"\nError copying {path}: {str(e)}")
+                outcomes['failed'] += 1
+            pbar.update(stat.st_size)
+            ingest.save()
     except KeyboardInterrupt:
         print("\nOperation interrupted by user. Progress has been saved.")
+        executor.shutdown(wait=True, cancel_futures=True)
     finally:
+        executor.shutdown(wait=True)
+        ingest.save(force=True)
         pbar.close()
+    print(", ".join(f"{outcome}: {count}" for outcome, count in outcomes.items()))
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Copy the photos of a card or drive, deduplicated by contents')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of parallel copies (default: by storage medium)')
+    return parser.parse_args()
 
 def main():
+    args = parse_arguments()
     try:
         ensure_directories()
-        copy_files()
+        copy_files(args.workers)
     except Exception as e:
         print(f"\nAn error occurred: {str(e)}")
 
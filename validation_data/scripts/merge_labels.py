@@ -1,93 +1,159 @@
-import csv
-import subprocess
-import tempfile
+import argparse
 import os
+import sys
+import pandas as pd
+
+# Shared utilities live in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utilities_label_dataset import read_label_csv
+from utilities_label_dataset import write_label_csv
 
 # Configuration
 ORIGINAL_CSV = "/home/luis/kgraphs/labels_DAL.csv"
 POSITIVE_CSV = "/home/luis/kgraphs/labels_DAL_positive.csv"
 EMPTY_CSV = "/home/luis/kgraphs/labels_DAL_empty.csv"
 
-def load_csv(filename):
-    """Load CSV file into a dictionary"""
-    data = {}
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) >= 2:
-                    data[row[0]] = row[1:]
-    except FileNotFoundError:
-        print(f"Warning: {filename} not found")
-    return data
-
-def reconcile_rotation(original_rotation, new_rotation):
-    """Reconcile rotation between original and new states"""
-    orig = int(original_rotation) if original_rotation else 0
-    new = int(new_rotation) if new_rotation else 0
-    
-    if new == 0:
-        return orig
-    return (orig + new) % 360
+# Conflict policies (for images whose labels or rotations differ between update files)
+POLICIES = {
+    'last': "the last update file listing the image wins",
+    'first': "the first update file listing the image wins",
+    'original': "keep the original labels of conflicting images",
+    'error': "report conflicts and do not write anything",
+}
+LABEL_COLUMNS = ['group_a', 'group_b', 'group_c']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Merge reviewed label files into the original label file')
+    parser.add_argument('-orig', '--original', default=ORIGINAL_CSV,
+                        help='Original label CSV file')
+    parser.add_argument('-upd', '--updates', nargs='+', default=[POSITIVE_CSV, EMPTY_CSV],
+                        help='Reviewed label CSV files, in order of precedence (lowest first)')
+    parser.add_argument('-p', '--policy', choices=list(POLICIES), default='last',
+                        help='Conflict policy: ' + '; '.join(f'{k}: {v}' for k, v in POLICIES.items()))
+    parser.add_argument('-r', '--rotation', choices=['compose', 'replace'], default='compose',
+                        help='compose: add the rotation of the winning update to the original one '
+                             '(mod 360); replace: take the rotation of the winning update')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Merged label CSV file (default: overwrite the original file)')
+    parser.add_argument('-d', '--diff', default=None,
+                        help='CSV file for the report of changed rows')
+    parser.add_argument('-n', '--dry_run', action='store_true',
+                        help='Only report the changes')
+    return parser.parse_args()
+
+def load_updates(csv_paths):
+    """Load update CSV files into one table, with the position of each file as priority"""
+    tables = []
+    for priority, csv_path in enumerate(csv_paths):
+        if not os.path.exists(csv_path):
+            print(f"Warning: {csv_path} not found")
+            continue
+        table = read_label_csv(csv_path)
+        table['priority'] = priority
+        tables.append(table.astype({'source': str, 'group_a': str, 'group_b': str}))
+    if not tables:
+        return None
+    return pd.concat(tables, ignore_index=True)
+
+def label_key(df):
+    """Labels of each row as a single string (for comparisons)"""
+    return df['group_a'].astype(str).str.cat([df['group_b'].astype(str), df['group_c']], sep='|')
+
+def merge_labels(original, updates, policy='last', rotation='compose'):
+    """
+    Merge any number of update tables into the original table in one vectorized pass.
+    Returns (merged table, mask of changed rows, filenames with conflicts, number of
+    update rows of images not in the original table).
+    """
+    merged = original.astype({'group_a': str, 'group_b': str}).reset_index(drop=True)
+    known = updates['filename'].isin(merged['filename'])
+    num_unknown = int((~known).sum())
+    updates = updates[known].sort_values('priority', kind='stable')
+    updates = updates.assign(labels=label_key(updates).str.cat(updates['rotation'].astype(str), sep='|'))
+
+    # Images whose labels or rotations differ between update files
+    num_labels = updates.groupby('filename', sort=False)['labels'].nunique()
+    conflicts = num_labels.index[num_labels > 1]
+
+    # Winning update of each image
+    keep = 'first' if policy == 'first' else 'last'
+    winners = updates.drop_duplicates('filename', keep=keep).set_index('filename')
+    if policy == 'original':
+        winners = winners.drop(index=conflicts)
+
+    # Align updates with the original rows by filename
+    position = pd.Series(merged.index, index=merged['filename']).groupby(level=0).last()
+    rows = position.reindex(winners.index).to_numpy()
+    for column in LABEL_COLUMNS:
+        merged.loc[rows, column] = winners[column].to_numpy()
+    # Rotation of the winning update only (the update files are alternatives, not steps)
+    rotations = merged['rotation'].to_numpy().astype(int)
+    if rotation == 'compose':
+        rotations[rows] += winners['rotation'].to_numpy().astype(int)
+    else:
+        rotations[rows] = winners['rotation'].to_numpy()
+    merged['rotation'] = (rotations % 360).astype(original['rotation'].dtype)
+
+    original_keys = label_key(original.astype({'group_a': str, 'group_b': str}).reset_index(drop=True))
+    changed = (label_key(merged) != original_keys) | (merged['rotation'].to_numpy() != original['rotation'].to_numpy())
+    return merged, changed, conflicts, num_unknown
+
+def diff_report(original, merged, changed):
+    """Table of changed rows with their values before and after merging"""
+    before = original.reset_index(drop=True)[changed]
+    after = merged[changed]
+    return pd.DataFrame({
+        'filename': after['filename'],
+        'rotation_before': before['rotation'],
+        'rotation_after': after['rotation'],
+        'labels_before': label_key(before.astype({'group_a': str, 'group_b': str})),
+        'labels_after': label_key(after),
+    })
 
 def main():
+    args = parse_arguments()
+    output = args.output or args.original
+
     # Load data from all CSV files
-    original_data = load_csv(ORIGINAL_CSV)
-    positive_data = load_csv(POSITIVE_CSV)
-    empty_data = load_csv(EMPTY_CSV)
-    
-    # Create a dictionary of changes to apply
-    changes = {}
-    
-    # Process positive data
-    for filename, new_row in positive_data.items():
-        if filename in original_data:
-            original_row = original_data[filename]
-            rotation = reconcile_rotation(original_row[0], new_row[0])
-            merged_row = [str(rotation)] + new_row[1:]
-            if merged_row != original_row:
-                changes[filename] = merged_row
-    
-    # Process empty data
-    for filename, new_row in empty_data.items():
-        if filename in original_data:
-            original_row = original_data[filename]
-            rotation = reconcile_rotation(original_row[0], new_row[0])
-            merged_row = [str(rotation), "", "", ""]
-            if merged_row != original_row:
-                changes[filename] = merged_row
-    
+    original = read_label_csv(args.original)
+    updates = load_updates(args.updates)
+    if updates is None:
+        print("No update files found.")
+        return
+
+    merged, changed, conflicts, num_unknown = merge_labels(original, updates, args.policy, args.rotation)
+    report = diff_report(original, merged, changed)
+
     # Print changes that will be made
     print("\nChanges to be applied:")
     print("-" * 80)
-    for filename, new_row in changes.items():
-        original_row = original_data.get(filename, ["0", "", "", ""])
-        print(f"{filename},{','.join(original_row)} ->")
-        print(f"{filename},{','.join(new_row)}")
-    
-    if not changes:
+    for row in report.itertuples(index=False):
+        print(f"{row.filename},{row.rotation_before},{row.labels_before.replace('|', ',')} ->")
+        print(f"{row.filename},{row.rotation_after},{row.labels_after.replace('|', ',')}")
+    print("-" * 80)
+    print(f"Update rows: {len(updates)} ({num_unknown} of images not in {args.original})")
+    print(f"Images with conflicting labels or rotations: {len(conflicts)} (policy: {args.policy})")
+    for filename in conflicts[:10]:
+        print(f"  - {filename}")
+
+    if args.diff:
+        report.to_csv(args.diff, index=False)
+        print(f"Diff report written to {args.diff}")
+
+    if args.policy == 'error' and len(conflicts):
+        print("Error: Conflicting labels found. Nothing written.")
+        sys.exit(1)
+    if not changed.any():
         print("No changes to apply.")
         return
-    
-    # Create a sed script to apply the changes
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as sed_script:
-        for filename, new_row in changes.items():
-            # Escape special characters in the filename for sed
-            escaped_filename = filename.replace('/', '\\/').replace('.', '\\.').replace('_', '\\_')
-            # Create the replacement line
-            new_line = f"{filename},{','.join(new_row)}"
-            # Write the sed command - note the correct syntax
-            sed_script.write(f"s/^{escaped_filename},.*/{new_line}/\n")
-    
-    # Apply the changes using sed
-    try:
-        subprocess.run(["sed", "-i", "-f", sed_script.name, ORIGINAL_CSV], check=True)
-        print(f"\nSuccessfully applied {len(changes)} changes to {ORIGINAL_CSV}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error applying changes: {e}")
-    finally:
-        # Clean up the temporary file
-        os.unlink(sed_script.name)
+    if args.dry_run:
+        return
+
+    # Write the merged table in one pass and replace the output file atomically
+    tmp_output = output + '.tmp'
+    write_label_csv(merged, tmp_output)
+    os.replace(tmp_output, output)
+    print(f"\nSuccessfully applied {int(changed.sum())} changes to {output}")
 
 if __name__ == "__main__":
     main()
@@ -1,132 +1,108 @@
 import os
+import re
 import csv
-import shutil
-from PIL import Image
-from tqdm import tqdm
+import sys
 import datetime
 
+# Shared utilities live in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utilities_routing import count_outcomes
+from utilities_routing import make_fanout_routes
+from utilities_routing import route_images
+
 # Configuration
 BASE_DIR = "/home/luis/DJI_AGRAS_LATINO"
 RC_T40_T50_DIR = os.path.join(BASE_DIR, "rc", "t40_t50")
 CSV_DIR = "/home/luis/kgraphs/labels"
 INPUT_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_t40_t50.csv")
 LOG_FILE = os.path.join(CSV_DIR, "process-labels-rc.log")
+MANIFEST_FILE = os.path.join(RC_T40_T50_DIR, "routing_manifest.json")  # Progress of routing
+NUM_WORKERS = None  # Number of worker processes (None: all cores)
 
-# Output CSV files
-SPRAY_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_t40_t50_spray.csv")
-PROP_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_t40_t50_prop.csv")
-FLIGHT_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_t40_t50_flight.csv")
-BATT_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_t40_t50_batt.csv")
-OTHER_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_t40_t50_other.csv")
-
-# Output directories
-SPRAY_DIR = os.path.join(RC_T40_T50_DIR, "spray")
-PROP_DIR = os.path.join(RC_T40_T50_DIR, "prop")
-FLIGHT_DIR = os.path.join(RC_T40_T50_DIR, "flight")
-BATT_DIR = os.path.join(RC_T40_T50_DIR, "batt")
-OTHER_DIR = os.path.join(RC_T40_T50_DIR, "other")
+# Manifest of category membership: one row per image (filename, categories separated
+# by semicolons, then the rest of its row of INPUT_CSV). Not a label file, so kept out of
+# the labels_*.csv names read by utilities_label_dataset.load_label_files
+CATEGORIES_CSV = os.path.join(CSV_DIR, "categories_DAL_rc_t40_t50.csv")
+# Categories: output directory of each one (images with none of the labels go to OTHER)
+CATEGORY_DIRS = {
+    "SPRAY": os.path.join(RC_T40_T50_DIR, "spray"),
+    "PROP": os.path.join(RC_T40_T50_DIR, "prop"),
+    "FLIGHT": os.path.join(RC_T40_T50_DIR, "flight"),
+    "BATT": os.path.join(RC_T40_T50_DIR, "batt"),
+    "OTHER": os.path.join(RC_T40_T50_DIR, "other"),
+}
+# Label file of each category (the rows of INPUT_CSV of its images, read e.g. by
+# agent_eval_s1_batch -csv)
+CATEGORY_CSVS = {name: os.path.join(CSV_DIR, f"labels_DAL_rc_t40_t50_{name.lower()}.csv")
+                 for name in CATEGORY_DIRS}
+# Matches the category names within labels (e.g. PROP within PROPULSION), in one scan
+CATEGORY_PATTERN = re.compile("|".join(name for name in CATEGORY_DIRS if name != "OTHER"), re.IGNORECASE)
 
 def ensure_directories():
     """Create necessary directories if they don't exist"""
-    for directory in [SPRAY_DIR, PROP_DIR, FLIGHT_DIR, BATT_DIR, OTHER_DIR]:
+    for directory in CATEGORY_DIRS.values():
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-def copy_image(filename, source_dir, dest_dir):
-    """Copy image from source to destination directory"""
-    source_path = os.path.join(source_dir, filename)
-    dest_path = os.path.join(dest_dir, filename)
-    
-    # Skip if source file doesn't exist
-    if not os.path.exists(source_path):
-        print(f"Warning: Source file not found: {source_path}")
-        return False
-    
-    try:
-        # Only copy if the file doesn't already exist in the destination
-        if not os.path.exists(dest_path):
-            shutil.copy2(source_path, dest_path)
-        return True
-    except Exception as e:
-        print(f"Error copying {filename}: {str(e)}")
-        return False
+def classify(labels):
+    """Categories of an image from its labels, in the order of CATEGORY_DIRS"""
+    found = set(match.upper() for match in CATEGORY_PATTERN.findall(",".join(labels)))
+    return [name for name in CATEGORY_DIRS if name in found] or ["OTHER"]
 
 def main():
     # Ensure directories exist
     ensure_directories()
     
-    # Initialize lists for CSV files
-    spray_labels = []
-    prop_labels = []
-    flight_labels = []
-    batt_labels = []
-    other_labels = []
-    
-    # First count total rows for progress bar
-    total_rows = sum(1 for _ in open(INPUT_CSV))
-    
-    # Read and process the input CSV
+    # Read the input CSV once and classify each image
+    routes = []
+    planned = []  # (row, categories, destinations)
     with open(INPUT_CSV, newline='') as f:
         reader = csv.reader(f)
-        for row in tqdm(reader, total=total_rows, desc="Processing RC T40/T50 images"):
+        for row in reader:
             if len(row) < 2:
                 continue
                 
             filename = row[0]
-            labels = [label.strip() for label in row[2:] if label]
-            
-            # Check for specific labels
-            has_spray = any('SPRAY' in label.upper() for label in labels)
-            has_prop = any('PROP' in label.upper() for label in labels)
-            has_flight = any('FLIGHT' in label.upper() for label in labels)
-            has_batt = any('BATT' in label.upper() for label in labels)
+            categories = classify([label.strip() for label in row[2:] if label])
             
-            # If none of the specific labels are found, categorize as OTHER
-            is_other = not (has_spray or has_prop or has_flight or has_batt)
-            
-            # Process image for each applicable category
-            if has_spray:
-                if copy_image(filename, RC_T40_T50_DIR, SPRAY_DIR):
-                    spray_labels.append(row)
-            
-            if has_prop:
-                if copy_image(filename, RC_T40_T50_DIR, PROP_DIR):
-                    prop_labels.append(row)
-            
-            if has_flight:
-                if copy_image(filename, RC_T40_T50_DIR, FLIGHT_DIR):
-                    flight_labels.append(row)
-            
-            if has_batt:
-                if copy_image(filename, RC_T40_T50_DIR, BATT_DIR):
-                    batt_labels.append(row)
-            
-            if is_other:
-                if copy_image(filename, RC_T40_T50_DIR, OTHER_DIR):
-                    other_labels.append(row)
+            # Place the image into all of its category directories: read once, then linked
+            dests = [os.path.join(CATEGORY_DIRS[name], filename) for name in categories]
+            routes += make_fanout_routes(os.path.join(RC_T40_T50_DIR, filename), dests)
+            planned.append((row, categories, dests))
+    
+    # Link or copy images in parallel (skipping the ones already up to date)
+    outcomes = route_images(routes, MANIFEST_FILE, NUM_WORKERS, desc="Processing RC T40/T50 images")
+    members = []
+    category_rows = {name: [] for name in CATEGORY_DIRS}
+    for row, categories, dests in planned:
+        if outcomes[dests[0]] == 'missing':
+            print(f"Warning: Source file not found: {os.path.join(RC_T40_T50_DIR, row[0])}")
+            continue
+        routed = [name for name, dest in zip(categories, dests) if outcomes[dest] not in ('missing', 'failed')]
+        if routed:
+            members.append([row[0], ";".join(routed)] + row[1:])
+            for name in routed:
+                category_rows[name].append(row)
     
-    # Write CSV files
+    # Write the label file of each category and the manifest of category membership
     def write_csv(filename, rows):
         # Explicitly use Unix line endings
         with open(filename, 'w', newline='\n') as f:
             writer = csv.writer(f)
             writer.writerows(rows)
     
-    write_csv(SPRAY_CSV, spray_labels)
-    write_csv(PROP_CSV, prop_labels)
-    write_csv(FLIGHT_CSV, flight_labels)
-    write_csv(BATT_CSV, batt_labels)
-    write_csv(OTHER_CSV, other_labels)
+    for name, rows in category_rows.items():
+        write_csv(CATEGORY_CSVS[name], rows)
+    write_csv(CATEGORIES_CSV, members)
     
     # Print and log summary
     summary_lines = []
     summary_lines.append(f"Processing complete at {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}:")
-    summary_lines.append(f"- SPRAY: {len(spray_labels)} files")
-    summary_lines.append(f"- PROP: {len(prop_labels)} files")
-    summary_lines.append(f"- FLIGHT: {len(flight_labels)} files")
-    summary_lines.append(f"- BATT: {len(batt_labels)} files")
-    summary_lines.append(f"- OTHER: {len(other_labels)} files")
-    summary_lines.append(f"Results written to CSV files in {CSV_DIR}")
+    for name, rows in category_rows.items():
+        summary_lines.append(f"- {name}: {len(rows)} files")
+    summary_lines.append("Image operations: " + ", ".join(f"{k}: {v}" for k, v in count_outcomes(outcomes).items()))
+    summary_lines.append(f"Results written to CSV files in {CSV_DIR} "
+                         f"(category membership: {os.path.basename(CATEGORIES_CSV)})")
     
     # Print to console
     for line in summary_lines:
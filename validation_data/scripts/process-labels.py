@@ -1,9 +1,15 @@
 import os
-import csv
-import shutil
-from PIL import Image
-from tqdm import tqdm
+import sys
 import datetime
+import numpy as np
+
+# Shared utilities live in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utilities_label_dataset import read_label_csv
+from utilities_label_dataset import write_label_csv
+from utilities_routing import count_outcomes
+from utilities_routing import make_route
+from utilities_routing import route_images
 
 # Configuration for DJI AGRAS LATINO
 BASE_DIR = "/home/luis/DJI_AGRAS_LATINO"
@@ -19,6 +25,8 @@ RC_T20_T30_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_t20_t30.csv")
 RC_OTHER_CSV = os.path.join(CSV_DIR, "labels_DAL_rc_other.csv")
 EMPTY_CSV = os.path.join(CSV_DIR, "labels_DAL_empty.csv")
 ROTATE_IMAGES = False  # Set to True to enable image rotation
+MANIFEST_FILE = os.path.join(BASE_DIR, "routing_manifest.json")  # Progress of routing
+NUM_WORKERS = None  # Number of worker processes (None: all cores)
 
 # Configuration for Latin Drone
 # BASE_DIR = "/home/luis/Latin_Drone"
@@ -34,6 +42,7 @@ ROTATE_IMAGES = False  # Set to True to enable image rotation
 # RC_OTHER_CSV = os.path.join(CSV_DIR, "labels_LD_rc_other.csv")
 # EMPTY_CSV = os.path.join(CSV_DIR, "labels_LD_empty.csv")
 # ROTATE_IMAGES = False  # Set to True to enable image rotation
+# MANIFEST_FILE = os.path.join(BASE_DIR, "routing_manifest.json")  # Progress of routing
 
 def ensure_directories():
     """Create necessary directories if they don't exist"""
@@ -51,130 +60,79 @@ def ensure_directories():
             if not os.path.exists(path):
                 os.makedirs(path)
 
-def determine_model_category(labels):
-    """Determine the model category based on labels"""
-    # Check for T40 or T50
-    if any('T40' in label or 'T50' in label for label in labels if label):
-        return 't40_t50'
-    # Check for T20 or T30
-    elif any('T20' in label or 'T30' in label for label in labels if label):
-        return 't20_t30'
-    # Default to other
-    else:
-        return 'other'
+def plan_categories(df):
+    """Determine the main and model category of every labeled image (vectorized)"""
+    labels = df['group_a'].astype(str).str.cat([df['group_b'].astype(str), df['group_c']], sep=',')
+    # Check for DRONE and RC labels
+    has_drone = labels.str.contains('DRONE', regex=False)
+    has_rc = labels.str.contains('RC', regex=False)
+    main_category = np.select([has_drone, has_rc], ['drone', 'rc'], 'empty')
+    # Check for T40 or T50, then for T20 or T30, and default to other
+    model_category = np.select([labels.str.contains('T40|T50'), labels.str.contains('T20|T30')],
+                               ['t40_t50', 't20_t30'], 'other')
+    return main_category, model_category
 
-def process_image(filename, rotation, main_category, model_category=None):
-    """Copy and rotate image if needed"""
-    source_path = os.path.join(SOURCE_DIR, filename)
-    
-    # For empty category, don't use model subcategory
-    if main_category == 'empty':
-        dest_path = os.path.join(BASE_DIR, main_category, filename)
-    else:
-        dest_path = os.path.join(BASE_DIR, main_category, model_category, filename)
-    
-    # Skip if source file doesn't exist
-    if not os.path.exists(source_path):
-        print(f"Warning: Source file not found: {source_path}")
-        return False
-    
-    try:
-        if ROTATE_IMAGES and rotation:
-            img = Image.open(source_path)
-            img = img.rotate(int(rotation), expand=True)
-            img.save(dest_path)
+def plan_routes(df, main_category, model_category):
+    """Plan the route (source, destination, rotation) of every labeled image"""
+    routes = []
+    for filename, rotation, main_cat, model_cat in zip(df['filename'], df['rotation'], main_category, model_category):
+        # For empty category, don't use model subcategory
+        if main_cat == 'empty':
+            dest_path = os.path.join(BASE_DIR, main_cat, filename)
         else:
-            shutil.copy2(source_path, dest_path)
-        return True
-    except Exception as e:
-        print(f"Error processing {filename}: {str(e)}")
-        return False
+            dest_path = os.path.join(BASE_DIR, main_cat, model_cat, filename)
+        routes.append(make_route(os.path.join(SOURCE_DIR, filename), dest_path,
+                                 rotation if ROTATE_IMAGES else 0))
+    return routes
 
 def main():
     # Ensure directories exist
     ensure_directories()
     
-    # Initialize lists for CSV files
-    drone_t40_t50_labels = []
-    drone_t20_t30_labels = []
-    drone_other_labels = []
-    rc_t40_t50_labels = []
-    rc_t20_t30_labels = []
-    rc_other_labels = []
-    empty_labels = []
-    
-    # First count total rows for progress bar
-    total_rows = sum(1 for _ in open(CSV_FILE))
+    # Read the input CSV and plan all routes
+    df = read_label_csv(CSV_FILE)
+    main_category, model_category = plan_categories(df)
+    routes = plan_routes(df, main_category, model_category)
     
-    # Read and process the input CSV
-    with open(CSV_FILE, newline='') as f:
-        reader = csv.reader(f)
-        for row in tqdm(reader, total=total_rows, desc="Processing images"):
-            if len(row) < 2:
-                continue
-                
-            filename = row[0]
-            rotation = row[1] if row[1] else "0"
-            labels = [label.strip() for label in row[2:] if label]
-            
-            # Check for DRONE and RC labels
-            has_drone = any('DRONE' in label for label in labels)
-            has_rc = any('RC' in label for label in labels)
-            
-            if has_drone:
-                model_category = determine_model_category(labels)
-                if process_image(filename, rotation, 'drone', model_category):
-                    if model_category == 't40_t50':
-                        drone_t40_t50_labels.append(row)
-                    elif model_category == 't20_t30':
-                        drone_t20_t30_labels.append(row)
-                    else:
-                        drone_other_labels.append(row)
-            elif has_rc:
-                model_category = determine_model_category(labels)
-                if process_image(filename, rotation, 'rc', model_category):
-                    if model_category == 't40_t50':
-                        rc_t40_t50_labels.append(row)
-                    elif model_category == 't20_t30':
-                        rc_t20_t30_labels.append(row)
-                    else:
-                        rc_other_labels.append(row)
-            else:
-                if process_image(filename, rotation, 'empty', None):
-                    empty_labels.append(row)
+    # Link, copy or rotate images in parallel (skipping the ones already up to date)
+    outcomes = route_images(routes, MANIFEST_FILE, NUM_WORKERS, desc="Processing images")
+    routed = np.array([outcomes[route[1]] not in ('missing', 'failed') for route in routes], dtype=bool)
+    for route in routes:
+        if outcomes[route[1]] == 'missing':
+            print(f"Warning: Source file not found: {route[0]}")
     
     # Write CSV files
-    def write_csv(filename, rows):
-        # Explicitly use Unix line endings
-        with open(filename, 'w', newline='\n') as f:
-            writer = csv.writer(f)
-            if ROTATE_IMAGES:
-                # Reset all rotation values to "0" if rotation is enabled
-                writer.writerows([row[0:1] + ["0"] + row[2:] for row in rows])
-            else:
-                # Keep original rotation values if rotation is disabled
-                writer.writerows(rows)
+    def write_csv(filename, mask):
+        rows = df[mask & routed]
+        if ROTATE_IMAGES:
+            # Reset all rotation values to "0" if rotation is enabled
+            rows = rows.assign(rotation=0)
+        write_label_csv(rows, filename)
+        return len(rows)
     
-    write_csv(DRONE_T40_T50_CSV, drone_t40_t50_labels)
-    write_csv(DRONE_T20_T30_CSV, drone_t20_t30_labels)
-    write_csv(DRONE_OTHER_CSV, drone_other_labels)
-    write_csv(RC_T40_T50_CSV, rc_t40_t50_labels)
-    write_csv(RC_T20_T30_CSV, rc_t20_t30_labels)
-    write_csv(RC_OTHER_CSV, rc_other_labels)
-    write_csv(EMPTY_CSV, empty_labels)
+    is_drone = main_category == 'drone'
+    is_rc = main_category == 'rc'
+    num_drone_t40_t50 = write_csv(DRONE_T40_T50_CSV, is_drone & (model_category == 't40_t50'))
+    num_drone_t20_t30 = write_csv(DRONE_T20_T30_CSV, is_drone & (model_category == 't20_t30'))
+    num_drone_other = write_csv(DRONE_OTHER_CSV, is_drone & (model_category == 'other'))
+    num_rc_t40_t50 = write_csv(RC_T40_T50_CSV, is_rc & (model_category == 't40_t50'))
+    num_rc_t20_t30 = write_csv(RC_T20_T30_CSV, is_rc & (model_category == 't20_t30'))
+    num_rc_other = write_csv(RC_OTHER_CSV, is_rc & (model_category == 'other'))
+    num_empty = write_csv(EMPTY_CSV, main_category == 'empty')
     
     # Print and log summary
     summary_lines = []
     summary_lines.append(f"Processing complete at {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}:")
     summary_lines.append(f"- DRONE categories:")
-    summary_lines.append(f"  - T40/T50: {len(drone_t40_t50_labels)} files")
-    summary_lines.append(f"  - T20/T30: {len(drone_t20_t30_labels)} files")
-    summary_lines.append(f"  - Other: {len(drone_other_labels)} files")
+    summary_lines.append(f"  - T40/T50: {num_drone_t40_t50} files")
+    summary_lines.append(f"  - T20/T30: {num_drone_t20_t30} files")
+    summary_lines.append(f"  - Other: {num_drone_other} files")
     summary_lines.append(f"- RC categories:")
-    summary_lines.append(f"  - T40/T50: {len(rc_t40_t50_labels)} files")
-    summary_lines.append(f"  - T20/T30: {len(rc_t20_t30_labels)} files")
-    summary_lines.append(f"  - Other: {len(rc_other_labels)} files")
-    summary_lines.append(f"- Empty: {len(empty_labels)} files")
+    summary_lines.append(f"  - T40/T50: {num_rc_t40_t50} files")
+    summary_lines.append(f"  - T20/T30: {num_rc_t20_t30} files")
+    summary_lines.append(f"  - Other: {num_rc_other} files")
+    summary_lines.append(f"- Empty: {num_empty} files")
+    summary_lines.append("Image operations: " + ", ".join(f"{k}: {v}" for k, v in count_outcomes(outcomes).items()))
     summary_lines.append(f"Results written to CSV files in {CSV_DIR}")
     
     # Print to console
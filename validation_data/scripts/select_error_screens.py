@@ -1,4 +1,10 @@
 import os
+import sys
+import json
+import time
+import argparse
+import difflib
+import re
 from pathlib import Path
 import pytesseract
 from PIL import Image
@@ -7,12 +13,57 @@ import numpy as np
 from tqdm import tqdm
 import multiprocessing as mp
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import signal
 
+# Shared utilities live in the repository root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utilities_label_dataset import read_label_csv
+from utilities_images import hash_file
+from utilities_ocr_store import OCR_DB
+from utilities_ocr_store import OcrStore
+from utilities_phash import CLUSTERS_FILE
+from utilities_phash import load_clusters
+from utilities_workers import DeadlinePool
+
 # Constants
 JPG_DIR = "/home/luis/DAL/JPG"
 OUTPUT_DIR = "/home/luis/DAL/ERROR_SCREENS"
 MIN_TEXT_LENGTH = 20  # Minimum characters to consider it a valid text screen
+# Seconds an image may take before its worker is killed and replaced
+OCR_TIMEOUT = 30
+# Images a worker processes before it is replaced (leaks)
+MAX_TASKS_PER_WORKER = 200
+# Statuses processed again by reruns (so are rejections under other prefilter thresholds)
+RETRY_STATUSES = ('error',)
+# Near-duplicates (see cluster_duplicates.py)
+CLUSTERS_CSV = os.path.join(JPG_DIR, CLUSTERS_FILE)
+# Text similarity confirming a near-duplicate of a screen (numbers must match too)
+MIN_DUPLICATE_SIMILARITY = 0.8
+# Longest side (pixels) of the image used to detect orientation
+ORIENTATION_SIZE = 1000
+# Below this, Tesseract OSD is not trusted and the fallback is used
+MIN_OSD_CONFIDENCE = 2.0
+# Longest side (pixels) of the grayscale buffer decoded for OCR
+OCR_MAX_SIDE = 2000
+# Height (pixels) text lines are downscaled to for OCR
+OCR_TEXT_HEIGHT = 32
+
+# Prefilter cascade: cheap features of a small grayscale copy reject images that are not
+# screens before OCR. Stages run in this order (cheapest first); each keeps the images
+# whose feature lies within [low, high] (None: unbounded). The bounds below only say
+# which sides --tune sets: the prefilter stays disabled until tuned thresholds are saved.
+LABELS_CSV = "/home/luis/kgraphs/labels_DAL.csv"  # Screens: group A labels starting with RC
+PREFILTER_FILE = os.path.join(OUTPUT_DIR, "prefilter_thresholds.json")
+PREFILTER_SIZE = 384  # Longest side (pixels) of the image used by the prefilter
+PREFILTER_STAGES = {
+    # Fraction of edge pixels: flat or busy (foliage) images fail
+    'edge_density': [0.01, 0.40],
+    # Image fraction covered by the largest bright rectangle
+    'screen_fraction': [0.10, None],
+    'text_line_density': [1.0, None],  # Text-line-like blobs per 100 rows
+}
+TARGET_RECALL = 0.99  # Fraction of the labeled screens each tuned stage must keep
 
 def ensure_output_directory():
     """Create output directory if it doesn't exist."""
@@ -22,188 +73,687 @@ def rotate_image(image, angle):
     """Rotate PIL Image by given angle."""
     return image.rotate(angle, expand=True)
 
-def preprocess_image(img_array):
-    """Preprocess image for better OCR results."""
-    # Convert to grayscale
-    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+def preprocess_image(gray):
+    """
+    Preprocess a grayscale image for better OCR results. Denoising is a median blur
+    before and a small morphological closing after thresholding, much cheaper than
+    non-local means (and isotropic: the result can be rotated afterwards).
+    """
+    # Remove salt-and-pepper noise
+    smoothed = cv2.medianBlur(gray, 3)
     
     # Apply adaptive thresholding
     binary = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+        smoothed, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
         cv2.THRESH_BINARY, 11, 2
     )
     
-    # Denoise
-    denoised = cv2.fastNlMeansDenoising(binary)
+    # Denoise: remove dark specks smaller than the strokes of the characters
+    denoised = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8))
     
     return denoised
 
-def extract_text(image_path, timeout=30):
+def preprocess_image_legacy(img_array):
+    """Former preprocessing on the full resolution RGB image (for benchmarks only)."""
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY, 11, 2)
+    return cv2.fastNlMeansDenoising(binary)
+
+def load_gray(image_path, max_side=OCR_MAX_SIDE):
+    """
+    Grayscale array of an image, downscaled so that its longest side is at most
+    max_side. JPEGs are decoded in draft mode (DCT-scaled), so large photos are never
+    decoded at full resolution when a smaller size is requested.
+    """
+    with Image.open(image_path) as image:
+        scale = min(1.0, max_side / max(image.size))
+        image.draft('L', (int(image.width * scale), int(image.height * scale)))
+        gray = np.array(image.convert('L'))
+    return downscale(gray, max_side)
+
+def downscale(gray, max_side):
+    """
+    Grayscale array downscaled (if needed) so that its longest side is at most max_side.
+    """
+    scale = max_side / max(gray.shape)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def rotate_array(gray, angle):
+    """Rotate a grayscale array counter-clockwise by a multiple of 90 degrees."""
+    if angle % 360 == 0:
+        return gray
+    return np.ascontiguousarray(np.rot90(gray, angle // 90))
+
+def osd_rotation(gray):
+    """
+    Counter-clockwise rotation that makes the text upright according to Tesseract OSD
+    (orientation and script detection). Returns None if OSD fails or is not confident.
+    """
+    try:
+        osd = pytesseract.image_to_osd(gray, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractError:
+        # Not enough characters to detect the orientation
+        return None
+    if osd.get('orientation_conf', 0) < MIN_OSD_CONFIDENCE:
+        return None
+    # OSD reports the clockwise rotation that corrects the image
+    return -int(osd['rotate']) % 360
+
+def profile_rotation(gray):
+    """
+    Counter-clockwise rotation that makes the text upright, by projection profiles:
+    text lines make the profile across them (row sums) much more uneven than the one
+    along them, which tells horizontal from vertical lines. Upright versus upside down
+    is then decided by a quick OCR of the small image in both candidate orientations.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Text is the minority of the pixels, whatever the polarity of the screen
+    if np.count_nonzero(binary) > binary.size / 2:
+        binary = cv2.bitwise_not(binary)
+    row_profile = binary.sum(axis=1) / binary.shape[1]
+    column_profile = binary.sum(axis=0) / binary.shape[0]
+    horizontal = np.var(row_profile) >= np.var(column_profile)
+    candidates = [0, 180] if horizontal else [90, 270]
+    best_rotation, best_length = candidates[0], -1
+    for angle in candidates:
+        rotated = rotate_array(binary, angle)
+        text = pytesseract.image_to_string(cv2.bitwise_not(rotated), lang='eng')
+        length = len(text.strip())
+        if length > best_length:
+            best_rotation, best_length = angle, length
+    return best_rotation
+
+def detect_orientation(small):
+    """
+    Decide the counter-clockwise rotation that makes the text of an image upright,
+    cheaply, on a small grayscale copy: Tesseract OSD first, projection profiles if OSD
+    is not conclusive.
+    """
+    rotation = osd_rotation(small)
+    if rotation is None:
+        rotation = profile_rotation(small)
+    return rotation
+
+def ocr_scale(small, full_side):
+    """
+    Scale factor that brings the median height of the text lines found in an (upright)
+    small copy of an image to OCR_TEXT_HEIGHT, for an image whose longest side is
+    full_side. Never upscales.
+    """
+    heights = [h for _, _, _, h in find_text_lines(small)]
+    if not heights:
+        return 1.0
+    text_height = np.median(heights) * full_side / max(small.shape)
+    return min(1.0, OCR_TEXT_HEIGHT / text_height)
+
+def ocr_image(image_path, timings=None, rotation=None):
     """
-    Try to extract text from image in different orientations.
-    Now with timeout protection.
+    Extract the text of an image: decode it once into a grayscale buffer, decide its
+    orientation (unless given) and text height on a small copy, downscale the buffer to
+    the text height suited for OCR, preprocess it and rotate only the binarized result.
+    Fills timings (if given) with the time (ms) of each stage.
+    Returns text and rotation.
     """
-    def timeout_handler(signum, frame):
-        raise TimeoutError("OCR processing took too long")
+    stage_start = time.perf_counter()
+    def lap(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        if timings is not None:
+            timings[stage] = 1000 * (now - stage_start)
+        stage_start = now
     
-    # Open image with PIL
-    image = Image.open(image_path)
+    gray = load_gray(image_path)
+    lap('load')
+    small = downscale(gray, ORIENTATION_SIZE)
+    if rotation is None:
+        rotation = detect_orientation(small)
+    lap('orientation')
+    scale = ocr_scale(rotate_array(small, rotation), max(gray.shape))
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    lap('scale')
+    processed = rotate_array(preprocess_image(gray), rotation)
+    lap('preprocess')
+    text = pytesseract.image_to_string(processed, lang='eng')
+    lap('ocr')
+    return text, rotation
+
+def ocr_image_legacy(image_path, rotation, timings=None):
+    """Former full resolution OCR at a given rotation (for benchmarks only)."""
+    start = time.perf_counter()
+    with Image.open(image_path) as image:
+        img_array = np.array(rotate_image(image.convert('RGB'), rotation))
+    processed = preprocess_image_legacy(img_array)
+    preprocessed = time.perf_counter()
+    text = pytesseract.image_to_string(processed, lang='eng')
+    if timings is not None:
+        timings['preprocess'] = 1000 * (preprocessed - start)
+        timings['ocr'] = 1000 * (time.perf_counter() - preprocessed)
+    return text
+
+def edge_density(gray):
+    """Fraction of edge pixels (Canny)."""
+    edges = cv2.Canny(gray, 50, 150)
+    return np.count_nonzero(edges) / edges.size
+
+def screen_fraction(gray):
+    """
+    Fraction of the image covered by the largest bright region, if it is rectangular
+    (the lit display of a remote controller), else 0.
+    """
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, bright = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(bright, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return 0.0
+    largest = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(largest)
+    (_, _), (width, height), _ = cv2.minAreaRect(largest)
+    if width * height == 0 or area / (width * height) < 0.8:
+        return 0.0
+    return area / gray.size
+
+def find_text_lines(gray):
+    """
+    Bounding boxes (x, y, w, h) of text-line-like blobs: horizontal gradient (the
+    vertical strokes of characters), binarized and closed horizontally so that the
+    characters of a line merge into one wide, short blob.
+    """
+    gradient = cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_16S, 1, 0, ksize=3))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (7, 1))
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    height, width = gray.shape
+    lines = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w > 2 * h and w > 0.05 * width and 2 <= h <= 0.1 * height:
+            lines.append((x, y, w, h))
+    return lines
+
+def text_line_density(gray):
+    """Number of text-line-like blobs per 100 rows."""
+    return 100 * len(find_text_lines(gray)) / gray.shape[0]
+
+PREFILTER_FEATURES = {
+    'edge_density': edge_density,
+    'screen_fraction': screen_fraction,
+    'text_line_density': text_line_density,
+}
+
+def load_prefilter_thresholds(thresholds_file=PREFILTER_FILE):
+    """
+    Tuned prefilter thresholds (in cascade order), or none (prefilter disabled) if not
+    tuned yet.
+    """
+    if not os.path.exists(thresholds_file):
+        return {}
+    with open(thresholds_file, 'r') as f:
+        tuned = json.load(f)
+    return {stage: tuned[stage] for stage in PREFILTER_STAGES if stage in tuned}
+
+def in_bounds(value, bounds):
+    """Check whether a value lies within [low, high] (None: unbounded)."""
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value <= high)
+
+def prefilter(image_path, thresholds, scores=None):
+    """
+    Run the prefilter cascade on an image, recording the features computed in scores
+    (if given). Returns the name of the rejecting stage, or None if the image may be a
+    screen.
+    """
+    gray = load_gray(image_path, PREFILTER_SIZE)
+    for stage, bounds in thresholds.items():
+        value = float(PREFILTER_FEATURES[stage](gray))
+        if scores is not None:
+            scores[stage] = value
+        if not in_bounds(value, bounds):
+            return stage
+    return None
+
+def measure_features(image_path):
+    """All prefilter features of an image, and the time (ms) to compute each one."""
+    start = time.perf_counter()
+    gray = load_gray(image_path, PREFILTER_SIZE)
+    times = {'load': 1000 * (time.perf_counter() - start)}
+    features = {}
+    for stage, feature in PREFILTER_FEATURES.items():
+        start = time.perf_counter()
+        features[stage] = feature(gray)
+        times[stage] = 1000 * (time.perf_counter() - start)
+    return features, times
+
+def measure_labeled_image(item):
+    """Features of a labeled image (item: filename, is screen), None if unreadable."""
+    file, is_screen = item
+    try:
+        features, times = measure_features(os.path.join(JPG_DIR, file))
+    except Exception as e:
+        print(f"\nError measuring {file}: {str(e)}")
+        return None
+    return is_screen, features, times
+
+def tune_prefilter(labels_csv=LABELS_CSV, thresholds_file=PREFILTER_FILE):
+    """
+    Tune the prefilter thresholds on the labeled images: each stage keeps TARGET_RECALL
+    of the screens (group A labels starting with RC) and rejects as many of the other
+    images as it can. Reports recall, rejection rate and cost of each stage.
+    """
+    labels = read_label_csv(labels_csv)
+    labels = labels.drop_duplicates('filename', keep='last')
+    labels = labels[[os.path.exists(os.path.join(JPG_DIR, f)) for f in labels['filename']]]
+    is_screen = labels['group_a'].astype(str).str.startswith('RC')
+    items = list(zip(labels['filename'], is_screen))
+    if not items or not is_screen.any():
+        print(f"No labeled screens of {labels_csv} found in {JPG_DIR}")
+        return
     
-    # Try different rotations
-    rotations = [0, 90, 180, 270]
-    best_text = ""
-    best_rotation = 0
+    num_processes = max(1, mp.cpu_count() - 1)
+    with mp.Pool(num_processes) as pool:
+        measured = [m for m in tqdm(pool.imap(measure_labeled_image, items, chunksize=16),
+                                    total=len(items), desc="Measuring labeled images") if m]
+    screens = np.array([m[0] for m in measured])
     
-    # Set timeout
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(timeout)
+    # Tune each stage on the images that reach it (cascade order)
+    thresholds = {}
+    reaching = np.ones(len(measured), dtype=bool)
+    tail = 100 * (1 - TARGET_RECALL)
+    print(f"\n{'Stage':<20}{'Low':>10}{'High':>10}"
+          f"{'Recall':>10}{'Rejected':>10}{'ms/image':>10}")
+    print(f"{'load':<20}{'':>30}{'':>10}{np.mean([m[2]['load'] for m in measured]):>10.2f}")
+    for stage, (low, high) in PREFILTER_STAGES.items():
+        values = np.array([m[1][stage] for m in measured])
+        positives = values[reaching & screens]
+        if len(positives) and low is not None:
+            low = float(np.percentile(positives, tail, method='lower'))
+        if len(positives) and high is not None:
+            high = float(np.percentile(positives, 100 - tail, method='higher'))
+        thresholds[stage] = [low, high]
+        kept = np.array([in_bounds(v, (low, high)) for v in values])
+        recall = (kept & reaching & screens).sum() / max(1, (reaching & screens).sum())
+        rejected = (~kept & reaching & ~screens).sum() / max(1, (reaching & ~screens).sum())
+        cost = np.mean([m[2][stage] for m in measured])
+        low_str = low if low is not None else '-'
+        high_str = high if high is not None else '-'
+        print(f"{stage:<20}{low_str:>10.4}{high_str:>10.4}"
+              f"{recall:>10.1%}{rejected:>10.1%}{cost:>10.2f}")
+        reaching &= kept
     
+    print(f"\nImages measured: {len(measured)} ({screens.sum()} screens)")
+    print(f"Passing the cascade: {reaching.sum()} "
+          f"({(reaching & screens).sum() / screens.sum():.1%} of screens, "
+          f"{(reaching & ~screens).sum() / max(1, (~screens).sum()):.1%} of other images)")
+    Path(os.path.dirname(thresholds_file)).mkdir(parents=True, exist_ok=True)
+    with open(thresholds_file, 'w') as f:
+        json.dump(thresholds, f, indent=4)
+    print(f"Thresholds saved to {thresholds_file}")
+
+def benchmark_image(item):
+    """
+    Run the OCR pipeline and the former one on a labeled image (item: filename, is
+    screen). Returns is screen, stage timings and text of both, or None on errors.
+    """
+    file, is_screen = item
+    image_path = os.path.join(JPG_DIR, file)
     try:
-        for angle in rotations:
-            # Rotate image
-            rotated = rotate_image(image, angle)
-            
-            # Convert PIL image to numpy array for OpenCV
-            img_array = np.array(rotated)
-            
-            # Preprocess
-            processed = preprocess_image(img_array)
-            
-            # Extract text
-            text = pytesseract.image_to_string(processed, lang='eng')
-            
-            # Keep the rotation that yields the most text
-            if len(text) > len(best_text):
-                best_text = text
-                best_rotation = angle
-    
-    except TimeoutError as e:
-        print(f"\nTimeout while processing {os.path.basename(image_path)}")
-        return "", 0
-    finally:
-        # Disable alarm
-        signal.alarm(0)
+        timings, legacy_timings = {}, {}
+        text, rotation = ocr_image(image_path, timings)
+        legacy_text = ocr_image_legacy(image_path, rotation, legacy_timings)
+    except Exception as e:
+        print(f"\nError benchmarking {file}: {str(e)}")
+        return None
+    return is_screen, timings, text, legacy_timings, legacy_text
+
+def run_benchmark(num_images, labels_csv=LABELS_CSV):
+    """
+    Benchmark the OCR pipeline against the former full resolution one (both at the
+    same rotation) on a sample of the labeled images: time per stage, screens detected
+    (text of at least MIN_TEXT_LENGTH characters) among the labeled screens and the
+    other images, and similarity of the text of both pipelines.
+    """
+    labels = read_label_csv(labels_csv).drop_duplicates('filename', keep='last')
+    labels = labels[[os.path.exists(os.path.join(JPG_DIR, f)) for f in labels['filename']]]
+    labels = labels.sample(n=min(num_images, len(labels)), random_state=0)
+    is_screen = labels['group_a'].astype(str).str.startswith('RC')
+    items = list(zip(labels['filename'], is_screen))
+    if not items:
+        print(f"No labeled images of {labels_csv} found in {JPG_DIR}")
+        return
     
-    return best_text, best_rotation
+    # The former pipeline may take long on some images: twice the deadline for both
+    with DeadlinePool(benchmark_image, timeout=2 * OCR_TIMEOUT) as pool:
+        results = tqdm(pool.imap_unordered(items), total=len(items),
+                       desc="Benchmarking OCR")
+        measured = [output for _, status, output in results if status == 'done' and output]
+    if not measured:
+        return
+    screens = np.array([m[0] for m in measured])
+    
+    print(f"\n{'Stage (ms/image)':<20}{'Pipeline':>12}{'Former':>12}")
+    for stage in measured[0][1]:
+        former = '-'
+        if stage in measured[0][3]:
+            former = f"{np.mean([m[3][stage] for m in measured]):.1f}"
+        print(f"{stage:<20}{np.mean([m[1][stage] for m in measured]):>12.1f}{former:>12}")
+    print(f"{'total':<20}{np.mean([sum(m[1].values()) for m in measured]):>12.1f}"
+          f"{np.mean([sum(m[3].values()) for m in measured]):>12.1f}")
+    for name, index in (('Pipeline', 2), ('Former', 4)):
+        detected = np.array([len(m[index].strip()) >= MIN_TEXT_LENGTH for m in measured])
+        print(f"{name}: text found in "
+              f"{(detected & screens).sum()}/{screens.sum()} screens, "
+              f"{(detected & ~screens).sum()}/{(~screens).sum()} other images")
+    similarity = [difflib.SequenceMatcher(None, m[2].strip(), m[4].strip()).ratio()
+                  for m in measured if m[0] and m[4].strip()]
+    if similarity:
+        print(f"Text similarity with the former pipeline (screens): "
+              f"{np.mean(similarity):.1%}")
 
-def process_single_image(file, jpg_dir=JPG_DIR, output_dir=OUTPUT_DIR):
-    """Process a single image and return its results."""
+def same_text(text, reference):
+    """
+    Check whether two OCR texts show the same message: similar overall, with the same
+    numbers (messages of one screen layout often differ only by a number).
+    """
+    text, reference = ' '.join(text.split()), ' '.join(reference.split())
+    if re.findall(r'\b\d+\b', text) != re.findall(r'\b\d+\b', reference):
+        return False
+    similarity = difflib.SequenceMatcher(None, text, reference).ratio()
+    return similarity >= MIN_DUPLICATE_SIMILARITY
+
+def process_single_image(task, jpg_dir=JPG_DIR, output_dir=OUTPUT_DIR, thresholds=None):
+    """
+    Process a single image (task: filename, hash of its contents and, for near-duplicates
+    of a screen, the filename, rotation and text of that screen) and return its record
+    for the OCR results store.
+    """
+    file, file_hash, reference = task
     image_path = os.path.join(jpg_dir, file)
-    result = None
+    stat = os.stat(image_path)
+    record = {
+        'hash': file_hash,
+        'filename': file,
+        'path': image_path,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'status': 'error',
+    }
+    timings, scores = {}, {}
     
     try:
         print(f"\nProcessing: {file}")
         
         # Check image size before processing
-        file_size = os.path.getsize(image_path)
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            print(f"Skipping large file ({file_size/1024/1024:.1f}MB): {file}")
-            return file, None
+        if stat.st_size > 10 * 1024 * 1024:  # 10MB
+            print(f"Skipping large file ({stat.st_size/1024/1024:.1f}MB): {file}")
+            record['status'] = 'skipped'
+            return record
+        
+        # Reject images that are obviously not screens before OCR (once tuned)
+        if thresholds:
+            start = time.perf_counter()
+            rejected_by = prefilter(image_path, thresholds, scores)
+            timings['prefilter'] = 1000 * (time.perf_counter() - start)
+            if rejected_by:
+                record.update(status='rejected', rejected_by=rejected_by, timings=timings,
+                              scores=scores, thresholds=thresholds)
+                return record
+        
+        if reference:
+            # Near-duplicate of a screen: read at its rotation (no orientation detection)
+            # and confirm by the text; only confirmed near-duplicates share evaluations
+            text, rotation = ocr_image(image_path, timings, rotation=reference['rotation'])
+            text = text.strip()
+            if same_text(text, reference['text']):
+                record.update(status='duplicate', duplicate_of=reference['filename'],
+                              rotation=rotation, text=text, text_length=len(text),
+                              is_screen=int(len(text) >= MIN_TEXT_LENGTH),
+                              timings=timings, scores=scores)
+                return record
+            # A different screen after all: processed like any other image
             
-        text, rotation = extract_text(image_path)
+        text, rotation = ocr_image(image_path, timings)
+        text = text.strip()
+        is_screen = len(text) >= MIN_TEXT_LENGTH
+        record.update(status='ocr', rotation=rotation, text=text, text_length=len(text),
+                      is_screen=int(is_screen), timings=timings, scores=scores)
         
-        if text:  # Only process if we got some text
-            if len(text.strip()) >= MIN_TEXT_LENGTH:
-                # Copy to output directory with rotation info in filename
-                image = Image.open(image_path)
-                if rotation != 0:
-                    image = rotate_image(image, rotation)
-                
-                base_name, ext = os.path.splitext(file)
-                new_name = f"{base_name}_rot{rotation}{ext}"
-                output_path = os.path.join(output_dir, new_name)
-                
-                image.save(output_path)
-                
-                result = {
-                    'file': file,
-                    'rotation': rotation,
-                    'text_length': len(text.strip()),
-                    'sample_text': text.strip()[:100]
-                }
+        if is_screen:
+            # Copy to output directory with rotation info in filename
+            image = Image.open(image_path)
+            if rotation != 0:
+                image = rotate_image(image, rotation)
+            
+            base_name, ext = os.path.splitext(file)
+            new_name = f"{base_name}_rot{rotation}{ext}"
+            output_path = os.path.join(output_dir, new_name)
+            
+            image.save(output_path)
     
     except Exception as e:
         print(f"\nError processing {file}: {str(e)}")
+        record.update(status='error', text=str(e), timings=timings, scores=scores)
     
-    return file, result
+    return record
+
+def hash_new_images(jpg_files, store):
+    """
+    Hash the images whose size or modification time differ from their record (or that
+    have none); the others keep the hash of their record.
+    Returns { filename : hash } for all images.
+    """
+    signatures = store.signatures()
+    hashes = {}
+    to_hash = []
+    for file in jpg_files:
+        image_path = os.path.join(JPG_DIR, file)
+        stat = os.stat(image_path)
+        signature = signatures.get(image_path)
+        if signature and signature[:2] == (stat.st_size, stat.st_mtime_ns):
+            hashes[file] = signature[2]
+        else:
+            to_hash.append(file)
+    # Hashing is I/O bound (and hashlib releases the GIL): threads suffice
+    with ThreadPoolExecutor() as executor:
+        digests = executor.map(lambda f: hash_file(os.path.join(JPG_DIR, f)), to_hash)
+        for file, digest in tqdm(zip(to_hash, digests), total=len(to_hash),
+                                 desc="Hashing new images"):
+            hashes[file] = digest
+    return hashes
 
-def process_images():
-    """Process all JPG images and copy those with readable text."""
+def import_copied_list(jpg_files, hashes, store):
+    """
+    Record the images listed as processed in copied.txt (former progress file) that
+    have no record yet, so that they are not processed again.
+    """
+    processed_file = os.path.join(OUTPUT_DIR, "copied.txt")
+    if not os.path.exists(processed_file):
+        return
+    with open(processed_file, 'r') as f:
+        processed_files = set(line.strip() for line in f)
+    known = store.hashes()
+    imported = 0
+    for file in jpg_files:
+        if file in processed_files and hashes[file] not in known:
+            image_path = os.path.join(JPG_DIR, file)
+            stat = os.stat(image_path)
+            store.add({'hash': hashes[file], 'filename': file, 'path': image_path,
+                       'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'status': 'imported'})
+            known.add(hashes[file])
+            imported += 1
+    store.flush()
+    if imported:
+        print(f"Imported {imported} images processed by former runs from {processed_file}")
+
+def plan_tasks(jpg_files, hashes, store, thresholds):
+    """
+    Choose the images to process: those without a record, or rejected by the prefilter
+    under other thresholds than the current ones. Near-duplicates (see
+    cluster_duplicates.py) of another image to process or already processed are put
+    apart, to be processed once the results of the representative of their cluster are
+    known.
+    Returns the tasks (filename, hash, None) and the near-duplicates (filename,
+    representative).
+    """
+    representatives = load_clusters(CLUSTERS_CSV)
+    jpg_set = set(jpg_files)
+    known = store.hashes(exclude_status=RETRY_STATUSES) - store.stale_rejections(thresholds)
+    tasks, duplicates = [], []
+    for file in jpg_files:
+        if hashes[file] in known:
+            continue
+        known.add(hashes[file])
+        representative = representatives.get(file, file)
+        if representative != file and representative in jpg_set:
+            duplicates.append((file, representative))
+        else:
+            tasks.append((file, hashes[file], None))
+    return tasks, duplicates
+
+def plan_duplicate_tasks(duplicates, hashes, store):
+    """
+    Tasks of near-duplicates, with the filename, rotation and text of their
+    representative if it is a screen (to be confirmed by the text of the near-duplicate).
+    """
+    store.flush()
+    tasks = []
+    for file, representative in duplicates:
+        record = store.get_by_hash(hashes[representative])
+        reference = None
+        if record and record['status'] == 'ocr' and record['is_screen']:
+            reference = {'filename': representative, 'rotation': record['rotation'],
+                         'text': record['text']}
+        tasks.append((file, hashes[file], reference))
+    return tasks
+
+def process_images(store):
+    """
+    Process all JPG images not yet in the OCR results store and copy those with readable
+    text.
+    """
     # Get list of JPG files
     jpg_files = [f for f in os.listdir(JPG_DIR) if f.lower().endswith(('.jpg', '.jpeg'))]
     
-    # Read already processed files
-    processed_files = set()
-    processed_file = os.path.join(OUTPUT_DIR, "copied.txt")
-    if os.path.exists(processed_file):
-        with open(processed_file, 'r') as f:
-            processed_files = set(line.strip() for line in f)
-    
-    # Filter out already processed files
-    jpg_files = [f for f in jpg_files if f not in processed_files]
+    # Filter out already processed files (by contents: renamed or copied files are skipped
+    # too)
+    hashes = hash_new_images(jpg_files, store)
+    import_copied_list(jpg_files, hashes, store)
+    thresholds = load_prefilter_thresholds()
+    if not thresholds:
+        print(f"Prefilter disabled: no tuned thresholds in {PREFILTER_FILE} (see --tune)")
+    tasks, duplicates = plan_tasks(jpg_files, hashes, store, thresholds)
     
-    if not jpg_files:
+    if not tasks and not duplicates:
         print("No new files to process.")
-        return []
-    
+        return
+    # Representatives first, then their near-duplicates
+    if tasks and not run_tasks(tasks, store, thresholds):
+        return
+    if duplicates:
+        print(f"Processing {len(duplicates)} near-duplicates of other images")
+        run_tasks(plan_duplicate_tasks(duplicates, hashes, store), store, thresholds)
+
+def run_tasks(tasks, store, thresholds):
+    """
+    Process images in parallel, writing their records to the store as they complete.
+    Returns False if interrupted.
+    """
     # Calculate number of processes to use (N-1 cores)
     num_processes = max(1, mp.cpu_count() - 1)
     print(f"Using {num_processes} processes")
     
-    # Process files in parallel
-    results = []
+    def terminate_handler(signum, frame):
+        raise KeyboardInterrupt
+    previous_handler = signal.signal(signal.SIGTERM, terminate_handler)
+    
     try:
-        with mp.Pool(num_processes) as pool:
-            with open(processed_file, 'a') as f:
-                # Create iterator for parallel processing with progress bar
-                pbar = tqdm(total=len(jpg_files), desc="Processing images")
-                
-                # Process files in parallel
-                for file, result in pool.imap_unordered(process_single_image, jpg_files):
-                    # Log processed file
-                    f.write(f"{file}\n")
-                    f.flush()
-                    
-                    # Store result if valid
-                    if result is not None:
-                        results.append(result)
-                    
-                    pbar.update(1)
-                
-                pbar.close()
+        worker = partial(process_single_image, thresholds=thresholds)
+        with DeadlinePool(worker, num_processes, timeout=OCR_TIMEOUT,
+                          max_tasks=MAX_TASKS_PER_WORKER) as pool:
+            # Process files in parallel with progress bar; records are written in batches
+            results = tqdm(pool.imap_unordered(tasks), total=len(tasks),
+                           desc="Processing images")
+            for (file, file_hash, _), status, output in results:
+                if status != 'done':
+                    # Images that timed out or crashed a worker are recorded too, so that
+                    # a rerun does not stall on them again
+                    print(f"\n{status.capitalize()} while processing {file}" +
+                          (f": {output}" if output else ""))
+                    output = {'hash': file_hash, 'filename': file,
+                              'path': os.path.join(JPG_DIR, file),
+                              'status': status, 'text': output}
+                store.add(output)
                 
     except KeyboardInterrupt:
-        print("\nOperation interrupted by user. Progress has been saved.")
-        pool.terminate()
-        pool.join()
-    
-    return results
+        # The pool has killed its workers; the records received are saved below
+        print("\nOperation interrupted. Progress has been saved.")
+        return False
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        store.flush()
+    return True
+
+def write_report(store, report_path):
+    """Write the report of all images with readable text found so far."""
+    screens = store.screens()
+    with open(report_path, 'w') as f:
+        f.write("OCR Processing Results\n")
+        f.write("====================\n\n")
+        for r in screens:
+            f.write(f"File: {r['filename']}\n")
+            f.write(f"Rotation applied: {r['rotation']}°\n")
+            f.write(f"Text length: {r['text_length']}\n")
+            f.write(f"Sample text: {r['text'][:100]}\n")
+            f.write("-" * 50 + "\n")
+    return screens
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Select images of screens with readable (error) text')
+    parser.add_argument('--tune', action='store_true',
+                        help=f'Tune the prefilter thresholds on the labeled images of '
+                             f'{LABELS_CSV}')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                        help='Benchmark the OCR pipeline stages on N labeled images')
+    return parser.parse_args()
 
 def main():
+    args = parse_arguments()
+    if args.tune:
+        tune_prefilter()
+        return
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+        return
+    store = None
     try:
         # Ensure output directory exists
         ensure_output_directory()
         
         # Process images
-        results = process_images()
+        store = OcrStore(OCR_DB)
+        process_images(store)
         
         # Save results to a report file
         report_path = os.path.join(OUTPUT_DIR, "ocr_results.txt")
-        with open(report_path, 'w') as f:
-            f.write("OCR Processing Results\n")
-            f.write("====================\n\n")
-            for r in results:
-                f.write(f"File: {r['file']}\n")
-                f.write(f"Rotation applied: {r['rotation']}°\n")
-                f.write(f"Text length: {r['text_length']}\n")
-                f.write(f"Sample text: {r['sample_text']}\n")
-                f.write("-" * 50 + "\n")
+        screens = write_report(store, report_path)
         
-        print(f"\nProcessing complete! Found {len(results)} potential error screens.")
-        print(f"Results saved to {report_path}")
+        print("\nImages per status: " +
+              ", ".join(f"{k}: {v}" for k, v in store.count_by('status').items()))
+        print("Images rejected by the prefilter: " +
+              ", ".join(f"{k}: {v}" for k, v in store.count_by('rejected_by').items()))
+        print(f"Processing complete! Found {len(screens)} potential error screens.")
+        print(f"Results saved to {OCR_DB} (report: {report_path})")
         
     except Exception as e:
         print(f"\nAn error occurred: {str(e)}")
+    finally:
+        if store is not None:
+            store.close()
 
 if __name__ == "__main__":
     main()